@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import argparse
+import http.server
+import json
+import pathlib
+import random
+import threading
+import time
+import urllib.parse
+
+# Ranks used in synthetic trees, from the root.
+synthetic_ranks = ["Kingdom", "Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+
+class SyntheticWorms:
+    """
+    Synthetic WoRMS data: A taxonomy tree with about number_of_taxa taxa,
+    where about 5% of the species are unaccepted. The same seed gives the
+    same tree.
+
+    Recorded payloads, saved by record_worms_payloads.py, are used before the
+    synthetic data if payload_dir is given.
+    """
+
+    def __init__(self, number_of_taxa=10000, seed=1, payload_dir=None):
+        """ """
+        self.records = {}  # Key: AphiaID. Value: WoRMS record.
+        self.species_ids = []
+        self.recorded = {}  # Key: (endpoint, AphiaID). Value: Payload.
+        self.names_dict = None  # Key: Scientific name. Value: List of records.
+        self.build(number_of_taxa, seed)
+        if payload_dir:
+            self.load_payloads(payload_dir)
+
+    def build(self, number_of_taxa, seed):
+        """Builds the tree breadth first. One kingdom, the same number of
+        children for each higher taxon, and about 10 species for each genus."""
+        rng = random.Random(seed)
+        number_of_genera = max(1, number_of_taxa // 11)
+        branching = max(1, round(number_of_genera ** (1 / 5)))
+        next_id = 100000
+        level = [None]
+        for rank in synthetic_ranks:
+            if rank == "Kingdom":
+                children_per_node = 1
+            elif rank == "Species":
+                remaining = max(1, number_of_taxa - len(self.records))
+                children_per_node = max(1, -(-remaining // len(level)))
+            else:
+                children_per_node = branching
+            new_level = []
+            for parent_id in level:
+                for _child in range(children_per_node):
+                    if (rank == "Species") and (len(self.records) >= number_of_taxa):
+                        break
+                    next_id += 1
+                    if rank == "Species":
+                        genus = self.records[parent_id]["scientificname"]
+                        name = genus + " " + self.make_epithet(next_id)
+                    else:
+                        name = rank + str(next_id)
+                    self.records[next_id] = self.make_record(
+                        next_id, name, rank, parent_id
+                    )
+                    new_level.append(next_id)
+            level = new_level
+        self.species_ids = level
+        # Some species are unaccepted, with a neighbour species as valid taxon.
+        for aphia_id in self.species_ids:
+            if rng.random() < 0.05:
+                worms_rec = self.records[aphia_id]
+                siblings = [
+                    other_id
+                    for other_id in (aphia_id - 1, aphia_id + 1)
+                    if (other_id in self.records)
+                    and (self.records[other_id]["status"] == "accepted")
+                    and (self.records[other_id]["rank"] == "Species")
+                ]
+                if siblings:
+                    valid_rec = self.records[siblings[0]]
+                    worms_rec["status"] = "unaccepted"
+                    worms_rec["unacceptreason"] = "synonym"
+                    worms_rec["valid_AphiaID"] = valid_rec["AphiaID"]
+                    worms_rec["valid_name"] = valid_rec["scientificname"]
+
+    def make_epithet(self, number):
+        """Epithets with letters only, for example "bcd"."""
+        return "".join(chr(97 + int(digit)) for digit in str(number))
+
+    def make_record(self, aphia_id, name, rank, parent_id):
+        """ """
+        return {
+            "AphiaID": aphia_id,
+            "url": "https://www.marinespecies.org/aphia.php?p=taxdetails&id="
+            + str(aphia_id),
+            "scientificname": name,
+            "authority": "Author, 1900",
+            "status": "accepted",
+            "unacceptreason": None,
+            "taxonRankID": (synthetic_ranks.index(rank) + 1) * 10,
+            "rank": rank,
+            "valid_AphiaID": aphia_id,
+            "valid_name": name,
+            "valid_authority": "Author, 1900",
+            "parentNameUsageID": parent_id,
+            "kingdom": None,
+            "phylum": None,
+            "class": None,
+            "order": None,
+            "family": None,
+            "genus": None,
+            "citation": None,
+            "lsid": "urn:lsid:marinespecies.org:taxname:" + str(aphia_id),
+            "isMarine": 1,
+            "isBrackish": None,
+            "isFreshwater": None,
+            "isTerrestrial": None,
+            "isExtinct": None,
+            "match_type": "exact",
+            "modified": "2020-01-01T00:00:00.000Z",
+        }
+
+    def load_payloads(self, payload_dir):
+        """Loads files named <endpoint>_<AphiaID>.json."""
+        for file_path in pathlib.Path(payload_dir).glob("*.json"):
+            endpoint, _, aphia_id = file_path.stem.rpartition("_")
+            if endpoint and aphia_id.isdigit():
+                with file_path.open("r", encoding="utf-8") as payload_file:
+                    self.recorded[(endpoint, int(aphia_id))] = json.load(payload_file)
+        print("Recorded payloads loaded: ", len(self.recorded))
+
+    def get_recorded_ids(self):
+        """AphiaIDs with a recorded AphiaRecordByAphiaID payload."""
+        return sorted(
+            aphia_id
+            for endpoint, aphia_id in self.recorded
+            if endpoint == "AphiaRecordByAphiaID"
+        )
+
+    def get_records(self):
+        """All records, synthetic and recorded. Key: AphiaID."""
+        records = dict(self.records)
+        for aphia_id in self.get_recorded_ids():
+            records[aphia_id] = self.get_record(aphia_id)
+        return records
+
+    def get_record(self, aphia_id):
+        """ """
+        recorded = self.recorded.get(("AphiaRecordByAphiaID", aphia_id), None)
+        if recorded is not None:
+            return recorded
+        return self.records.get(aphia_id, None)
+
+    def get_classification(self, aphia_id):
+        """ """
+        recorded = self.recorded.get(("AphiaClassificationByAphiaID", aphia_id), None)
+        if recorded is not None:
+            return recorded
+        chain = []
+        current_id = aphia_id
+        while current_id in self.records:
+            chain.append(self.records[current_id])
+            current_id = self.records[current_id]["parentNameUsageID"]
+        if not chain:
+            return None
+        classification = None
+        for worms_rec in chain:
+            classification = {
+                "AphiaID": worms_rec["AphiaID"],
+                "rank": worms_rec["rank"],
+                "scientificname": worms_rec["scientificname"],
+                "child": classification,
+            }
+        return classification
+
+    def respond(self, path, query):
+        """Returns (status, payload) for a REST API path."""
+        parts = path.strip("/").split("/")
+        if parts and parts[0] == "rest":
+            parts = parts[1:]
+        endpoint = parts[0] if parts else ""
+        if endpoint in ("AphiaRecordByAphiaID", "AphiaClassificationByAphiaID"):
+            try:
+                aphia_id = int(parts[1])
+            except (IndexError, ValueError):
+                return (400, None)
+            if endpoint == "AphiaRecordByAphiaID":
+                payload = self.get_record(aphia_id)
+            else:
+                payload = self.get_classification(aphia_id)
+            return (200, payload) if payload else (204, None)
+        if endpoint == "AphiaRecordsByAphiaIDs":
+            records = []
+            for aphia_id in query.get("aphiaids[]", []):
+                if not aphia_id.isdigit():
+                    continue
+                worms_rec = self.get_record(int(aphia_id))
+                if worms_rec:
+                    records.append(worms_rec)
+            return (200, records) if records else (204, None)
+        if endpoint == "AphiaRecordsByMatchNames":
+            if self.names_dict is None:
+                self.names_dict = {}
+                for worms_rec in self.records.values():
+                    name = worms_rec["scientificname"]
+                    self.names_dict.setdefault(name, []).append(worms_rec)
+            result = [
+                self.names_dict.get(name, [])
+                for name in query.get("scientificnames[]", [])
+            ]
+            return (200, result) if any(result) else (204, None)
+        if endpoint == "AphiaRecordsByDate":
+            return (204, None)
+        return (404, None)
+
+
+class MockWormsServer(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in for the WoRMS REST API, used by the benchmarks.
+
+    latency: Seconds added to each response, with +-20% jitter.
+    error_rate: Part of the requests answered with 503.
+    max_requests_per_second: Requests above this rate are answered with
+        429 and Retry-After. None: No throttling.
+    """
+
+    daemon_threads = True
+    # Listen backlog. The default, 5, stalls benchmarks with many parallel
+    # connections, so the client is not what is measured.
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        worms_data,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        error_rate=0.0,
+        max_requests_per_second=None,
+        seed=1,
+    ):
+        """ """
+        super().__init__((host, port), MockWormsRequestHandler)
+        self.worms_data = worms_data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+        self.thread = None
+        # Statistics.
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    @property
+    def base_url(self):
+        """ """
+        host, port = self.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/rest"
+
+    def start(self):
+        """Serves in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ """
+        self.shutdown()
+        self.server_close()
+
+    def check_request(self):
+        """Returns a status for errors and throttling, or None."""
+        with self.lock:
+            self.requests += 1
+            if self.max_requests_per_second:
+                now = time.monotonic()
+                interval = 1.0 / self.max_requests_per_second
+                if now < self.next_time - interval:
+                    self.throttled += 1
+                    return 429
+                self.next_time = max(now, self.next_time) + interval
+            if self.error_rate and (self.rng.random() < self.error_rate):
+                self.errors += 1
+                return 503
+        return None
+
+    def get_statistics(self):
+        """ """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+            }
+
+
+class MockWormsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """ """
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * (0.8 + 0.4 * server.rng.random()))
+        status = server.check_request()
+        if status is not None:
+            self.send_status(status, headers={"Retry-After": "1"})
+            return
+        url_parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url_parts.query)
+        status, payload = server.worms_data.respond(url_parts.path, query)
+        if payload is None:
+            self.send_status(status)
+            return
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_status(self, status, headers=None):
+        """Response without body."""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if status != 204:
+            self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        """ """
+
+
+if __name__ == "__main__":
+    """ """
+    parser = argparse.ArgumentParser(description="Local mock of the WoRMS REST API.")
+    parser.add_argument("--port", type=int, default=8766, help="Default: 8766")
+    parser.add_argument("--taxa", type=int, default=10000, help="Default: 10000")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="0.0 - 1.0")
+    parser.add_argument("--max-requests-per-second", type=float, default=None)
+    parser.add_argument("--payload-dir", help="Recorded payloads to replay.")
+    args = parser.parse_args()
+
+    worms_data = SyntheticWorms(args.taxa, payload_dir=args.payload_dir)
+    server = MockWormsServer(
+        worms_data,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        max_requests_per_second=args.max_requests_per_second,
+    )
+    print("Mock WoRMS REST API on: ", server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import argparse
+import json
+import pathlib
+import sys
+import urllib.parse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from wormsextractor import worms_http_pool
+
+if __name__ == "__main__":
+    """Records AphiaRecordByAphiaID and AphiaClassificationByAphiaID payloads
+    from WoRMS, to be replayed by mock_worms_server.py. The cache is not used."""
+    parser = argparse.ArgumentParser(description="Record WoRMS payloads.")
+    parser.add_argument("aphia_id_file", help="Text file with one AphiaID on each row.")
+    parser.add_argument("--payload-dir", default="benchmarks/payloads")
+    parser.add_argument("--base-url", default="https://www.marinespecies.org/rest")
+    args = parser.parse_args()
+
+    payload_path = pathlib.Path(args.payload_dir)
+    payload_path.mkdir(parents=True, exist_ok=True)
+    http_pool = worms_http_pool.HttpConnectionPool(args.base_url, pool_size=1)
+    base_path = urllib.parse.urlsplit(args.base_url).path.rstrip("/")
+    with open(args.aphia_id_file, "r", encoding="utf-8") as aphia_id_file:
+        aphia_id_list = [row.strip() for row in aphia_id_file if row.strip().isdigit()]
+    for aphia_id in aphia_id_list:
+        for endpoint in ("AphiaRecordByAphiaID", "AphiaClassificationByAphiaID"):
+            status, body, _headers = http_pool.get(
+                base_path + "/" + endpoint + "/" + aphia_id
+            )
+            if status != 200:
+                print("Not recorded: ", endpoint, aphia_id, " Response code: ", status)
+                continue
+            payload_file = payload_path / (endpoint + "_" + aphia_id + ".json")
+            payload_file.write_text(
+                json.dumps(json.loads(body.decode("utf-8")), indent=1),
+                encoding="utf-8",
+            )
+    http_pool.close()
+    print("Recorded payloads in: ", payload_path)
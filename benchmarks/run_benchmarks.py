@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks_path = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(benchmarks_path.parent))
+
+import mock_worms_server
+from wormsextractor import worms_extract_taxa
+from wormsextractor import worms_rest_client
+from wormsextractor import worms_sqlite_cache
+from wormsextractor import worms_taxon
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hides the progress printed for each taxon."""
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+@contextlib.contextmanager
+def working_dir(path):
+    """The cache file is created in the current directory."""
+    old_path = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old_path)
+
+
+def write_indata(data_in_path, aphia_id_list):
+    """ """
+    data_in_path.mkdir(parents=True, exist_ok=True)
+    with (data_in_path / "aphia_id_list.txt").open("w", encoding="cp1252") as indata:
+        indata.write("used_aphia_id\n")
+        for aphia_id in aphia_id_list:
+            indata.write(str(aphia_id) + "\n")
+
+
+def run_generator(server, work_path, max_workers):
+    """Runs TaxaListGenerator.run_all against the mock server.
+    Returns (seconds, number_of_taxa, requests)."""
+    requests_before = server.get_statistics()["requests"]
+    with working_dir(work_path), quiet():
+        generator = worms_extract_taxa.TaxaListGenerator(
+            max_workers=max_workers, requests_per_second=None
+        )
+        generator.worms_client = worms_rest_client.WormsRestClient(
+            base_url=server.base_url, pool_size=max_workers
+        )
+        start_time = time.perf_counter()
+        generator.run_all()
+        seconds = time.perf_counter() - start_time
+        generator.worms_client.close()
+    requests = server.get_statistics()["requests"] - requests_before
+    return (seconds, len(generator.taxa_worms_dict), requests)
+
+
+def benchmark_runs(args, results):
+    """Cold and warm cache runs, and a cold run with errors and throttling."""
+    worms_data = mock_worms_server.SyntheticWorms(
+        args.tree_taxa, payload_dir=args.payload_dir
+    )
+    # Recorded taxa are used before the synthetic species.
+    aphia_id_list = worms_data.get_recorded_ids() + worms_data.species_ids
+    aphia_id_list = aphia_id_list[: args.input_taxa]
+    for name, error_rate, max_requests_per_second in [
+        ("run_all", 0.0, None),
+        ("run_all_unreliable", args.error_rate, args.max_requests_per_second),
+    ]:
+        server = mock_worms_server.MockWormsServer(
+            worms_data,
+            latency=args.latency,
+            error_rate=error_rate,
+            max_requests_per_second=max_requests_per_second,
+        ).start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                work_path = pathlib.Path(tmp_dir)
+                write_indata(work_path / "data_in", aphia_id_list)
+                runs = [("cold", name)]
+                if name == "run_all":
+                    runs.append(("warm", name))
+                for cache_state, run_name in runs:
+                    print("Running: ", run_name, cache_state)
+                    seconds, number_of_taxa, requests = run_generator(
+                        server, work_path, args.max_workers
+                    )
+                    results[run_name + "_" + cache_state] = {
+                        "seconds": round(seconds, 3),
+                        "taxa_per_second": round(number_of_taxa / seconds, 1),
+                        "number_of_taxa": number_of_taxa,
+                        "requests": requests,
+                    }
+            results[name + "_cold"].update(server.get_statistics())
+        finally:
+            server.stop()
+
+
+def benchmark_cache(args, results):
+    """Micro-benchmarks for WormsSqliteCache, with and without memory tier."""
+    worms_data = mock_worms_server.SyntheticWorms(
+        args.cache_taxa, payload_dir=args.payload_dir
+    )
+    records = list(worms_data.get_records().values())
+    aphia_id_list = [str(worms_rec["AphiaID"]) for worms_rec in records]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = str(pathlib.Path(tmp_dir, "worms_cache.db"))
+        db_cache = worms_sqlite_cache.WormsSqliteCache(db_file=db_file)
+        start_time = time.perf_counter()
+        db_cache.add_results(
+            "worms_records",
+            {str(worms_rec["AphiaID"]): (worms_rec, "") for worms_rec in records},
+        )
+        db_cache.flush()
+        seconds = time.perf_counter() - start_time
+        results["cache_add_results"] = {
+            "seconds": round(seconds, 3),
+            "records_per_second": round(len(records) / seconds, 1),
+        }
+        db_cache.close()
+        for memory_cache_size in (0, len(records)):
+            db_cache = worms_sqlite_cache.WormsSqliteCache(
+                db_file=db_file, memory_cache_size=memory_cache_size
+            )
+            # The first pass fills the memory tier.
+            for pass_name in ("first", "second"):
+                start_time = time.perf_counter()
+                for aphia_id in aphia_id_list:
+                    db_cache.get_result("worms_records", aphia_id)
+                seconds = time.perf_counter() - start_time
+                name = "cache_get_result_memory_" + str(memory_cache_size > 0)
+                results[name + "_" + pass_name] = {
+                    "seconds": round(seconds, 3),
+                    "lookups_per_second": round(len(aphia_id_list) / seconds, 1),
+                }
+            start_time = time.perf_counter()
+            for index in range(0, len(aphia_id_list), 500):
+                chunk = aphia_id_list[index : index + 500]
+                db_cache.get_results("worms_records", chunk)
+            seconds = time.perf_counter() - start_time
+            name = "cache_get_results_memory_" + str(memory_cache_size > 0)
+            results[name] = {
+                "seconds": round(seconds, 3),
+                "lookups_per_second": round(len(aphia_id_list) / seconds, 1),
+            }
+            db_cache.close()
+
+
+def benchmark_classification(args, results):
+    """Classification build for synthetic trees, without WoRMS calls."""
+    for number_of_taxa in args.tree_sizes:
+        print("Building synthetic tree: ", number_of_taxa)
+        worms_data = mock_worms_server.SyntheticWorms(
+            number_of_taxa, payload_dir=args.payload_dir
+        )
+        with quiet():
+            generator = worms_extract_taxa.TaxaListGenerator()
+        for aphia_id, worms_rec in worms_data.get_records().items():
+            taxon = worms_taxon.normalise_worms_record(worms_rec)
+            generator.taxa_worms_dict[aphia_id] = taxon
+            generator.higher_taxa_dict[aphia_id] = worms_taxon.Taxon(
+                aphia_id=aphia_id,
+                rank=taxon.rank,
+                scientific_name=taxon.scientific_name,
+                parent_id=worms_rec.get("parentNameUsageID", None) or "",
+            )
+        del worms_data
+        start_time = time.perf_counter()
+        generator.add_classification()
+        seconds = time.perf_counter() - start_time
+        results["classification_" + str(number_of_taxa)] = {
+            "seconds": round(seconds, 3),
+            "taxa_per_second": round(len(generator.taxa_worms_dict) / seconds, 1),
+        }
+        del generator
+
+
+def get_version():
+    """ """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=benchmarks_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def print_comparison(old_results, new_results):
+    """Prints the seconds for each benchmark and new/old ratio."""
+    print("\n" + "benchmark".ljust(45) + "old (s)".rjust(10) + "new (s)".rjust(10))
+    for name, new_result in new_results["benchmarks"].items():
+        old_result = old_results["benchmarks"].get(name, None)
+        old_seconds = old_result["seconds"] if old_result else None
+        row = name.ljust(45)
+        row += (str(old_seconds) if old_seconds is not None else "-").rjust(10)
+        row += str(new_result["seconds"]).rjust(10)
+        if old_seconds:
+            row += "  x" + str(round(new_result["seconds"] / old_seconds, 2))
+        print(row)
+
+
+if __name__ == "__main__":
+    """ """
+    parser = argparse.ArgumentParser(
+        description="Benchmarks against a local mock of the WoRMS REST API."
+    )
+    parser.add_argument("--input-taxa", type=int, default=2000)
+    parser.add_argument("--tree-taxa", type=int, default=10000)
+    parser.add_argument("--cache-taxa", type=int, default=10000)
+    parser.add_argument(
+        "--tree-sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="Sizes for the classification build. Default: 10000 100000",
+    )
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--max-requests-per-second", type=float, default=100)
+    parser.add_argument(
+        "--only", nargs="+", choices=["runs", "cache", "classification"]
+    )
+    parser.add_argument(
+        "--payload-dir",
+        help="Recorded payloads, used before the synthetic data in all benchmarks.",
+    )
+    parser.add_argument("--results-dir", default=str(benchmarks_path / "results"))
+    parser.add_argument("--compare", metavar="FILE", help="Earlier results file.")
+    args = parser.parse_args()
+
+    benchmark_results = {}
+    benchmarks = {
+        "runs": benchmark_runs,
+        "cache": benchmark_cache,
+        "classification": benchmark_classification,
+    }
+    for name, benchmark_function in benchmarks.items():
+        if (not args.only) or (name in args.only):
+            benchmark_function(args, benchmark_results)
+
+    new_results = {
+        "created_at": datetime.datetime.now().replace(microsecond=0).isoformat(),
+        "version": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "benchmarks": benchmark_results,
+    }
+    results_path = pathlib.Path(args.results_dir)
+    results_path.mkdir(parents=True, exist_ok=True)
+    results_file = results_path / (
+        "benchmark_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json"
+    )
+    with results_file.open("w", encoding="utf-8") as out_file:
+        json.dump(new_results, out_file, indent=2)
+    print(json.dumps(benchmark_results, indent=2))
+    print("Results saved to: ", results_file)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as old_file:
+            print_comparison(json.load(old_file), new_results)
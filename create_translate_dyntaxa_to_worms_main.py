@@ -4,37 +4,57 @@
 # Copyright (c) 2019-present SMHI, Swedish Meteorological and Hydrological Institute
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import argparse
 import pathlib
 
+from wormsextractor import worms_extract_taxa
+from wormsextractor import worms_sqlite_cache
+from wormsextractor import worms_taxa_index
+
 class CreateTranslateDyntaxaToWorms():
     """ """
 
-    def __init__(self, data_in_path="data_in", data_out_path="data_out"):
-        """ """
+    def __init__(
+        self,
+        data_in_path="data_in",
+        data_out_path="data_out",
+        db_file=None,
+        taxa=None,
+    ):
+        """
+        db_file: WoRMS cache used to find taxa instead of taxa_worms.txt, for
+            example "worms_cache.db". Note that the cache contains all taxa
+            fetched, also taxa not in the generated list.
+        taxa: Taxon records used instead of the cache, for example
+            TaxaListGenerator.taxa_worms_dict.values().
+        """
         self.data_in_path = data_in_path
         self.data_out_path = data_out_path
+        self.db_file = db_file
+        self.taxa = taxa
         #
         self.define_out_headers()
         #
-        self.taxa_worms_dict = {}
+        self.taxa_index = worms_taxa_index.TaxaIndex()
         self.translate_to_worms_dict = {}
+        self.dyntaxa_to_aphia_id_dict = {}
 
     def define_out_headers(self):
         """ """
         self.rename_worms_header_items = {
             "worms_scientific_name": "scientific_name",
             "worms_status": "status",
-            "worms_valid_aphia_id": "",
-            "worms_valid_name": "",
+            "worms_valid_aphia_id": "valid_aphia_id",
+            "worms_valid_name": "valid_name",
             "worms_rank": "rank",
             "worms_kingdom": "kingdom",
             "worms_phylum": "phylum",
-            "worms_class": "v",
+            "worms_class": "class",
             "worms_order": "order",
             "worms_family": "family",
             "worms_genus": "genus",
             # "worms_rec_error": "",
-            # "worms_lsid": "",
+            "worms_lsid": "lsid",
           }
 
         self.translate_dyntaxa_to_worms_header = [
@@ -60,9 +80,59 @@ class CreateTranslateDyntaxaToWorms():
         """ """
         self.import_taxa_worms()
         self.import_translate_to_worms()
+        self.import_dyntaxa_to_aphia_id()
 
-        out_data_rows = []
+        # Rows are written when created.
+        translate_file = pathlib.Path(self.data_out_path, "translate_dyntaxa_to_worms.txt")
+        with worms_extract_taxa.atomic_write(translate_file) as out_file:
+            out_file.write("\t".join(self.translate_dyntaxa_to_worms_header) + "\n")
+            for row in self.translate_rows():
+                out_file.write("\t".join(row) + "\n")
 
+    def translate_rows(self):
+        """Yields one row for each taxa in indata_taxa_by_name.txt found in WoRMS."""
+        worms_columns = [
+            self.rename_worms_header_items.get(column, column)
+            for column in self.translate_dyntaxa_to_worms_header[2:]
+        ]
+        for row_dict in self.read_indata_taxa_by_name():
+            dyntaxa_scientific_name = row_dict.get("scientific_name", "")
+            dyntaxa_id = row_dict.get("dyntaxa_id", "")
+            taxon = self.find_taxon(dyntaxa_scientific_name, dyntaxa_id)
+            if taxon is not None:
+                yield [dyntaxa_scientific_name, dyntaxa_id] + taxon.to_row(worms_columns)
+        print("")
+
+    def find_taxon(self, dyntaxa_scientific_name, dyntaxa_id):
+        """Returns a Taxon, or None. Dyntaxa id is used before scientific name."""
+        # AphiaID for the Dyntaxa id in aphia_id_list.txt.
+        aphia_id = self.dyntaxa_to_aphia_id_dict.get(dyntaxa_id, "")
+        if aphia_id:
+            taxon = self.taxa_index.get_by_aphia_id(aphia_id)
+            if taxon is not None:
+                return taxon
+
+        scientific_name = dyntaxa_scientific_name
+        if scientific_name in self.translate_to_worms_dict:
+            translate_dict = self.translate_to_worms_dict[scientific_name]
+            taxon = self.taxa_index.get_by_aphia_id(translate_dict.get("aphia_id_to", ""))
+            if taxon is not None:
+                return taxon
+            scientific_name = translate_dict.get("scientific_name_to", "")
+
+        if len(scientific_name) < 2:
+            print("- MISSING SCIENTIFIC NAME: ", dyntaxa_scientific_name, " - ", scientific_name)
+            return None
+        if not self.taxa_index.get_all_by_name(scientific_name):
+            print("- MISSING TAXA IN WORMS: ", scientific_name)
+            return None
+        taxon = self.taxa_index.get_by_name(scientific_name)
+        if taxon is None:
+            print("- MORE THAN ONE TAXA IN WORMS: ", scientific_name)
+        return taxon
+
+    def read_indata_taxa_by_name(self):
+        """Yields a dict for each row in indata_taxa_by_name.txt."""
         indata_species = pathlib.Path(self.data_in_path, "indata_taxa_by_name.txt")
         if indata_species.exists():
             print("Importing file: ", indata_species)
@@ -76,49 +146,32 @@ class CreateTranslateDyntaxaToWorms():
                         if header is None:
                             header = row
                         else:
-                            row_dict = dict(zip(header, row))
-                            dyntaxa_scientific_name = row_dict.get("scientific_name", "")
-                            dyntaxa_id = row_dict.get("dyntaxa_id", "")
-
-                            scientific_name = dyntaxa_scientific_name
-                            if scientific_name in self.translate_to_worms_dict:
-                                translate_dict = self.translate_to_worms_dict[scientific_name]
-                                scientific_name = translate_dict.get("scientific_name_to", "")
-
-                            if len(scientific_name) >= 2:
-                                row = [dyntaxa_scientific_name, dyntaxa_id]
-                                if scientific_name in self.taxa_worms_dict:
-                                    worms_dict = self.taxa_worms_dict[scientific_name]
-
-                                    for column in self.translate_dyntaxa_to_worms_header[2:]:
-                                        worms_column = self.rename_worms_header_items.get(column, column)
-                                        row.append(worms_dict.get(worms_column, ""))
-                                    out_data_rows.append(row)
-                                else:
-                                    print("- MISSING TAXA IN WORMS: ", scientific_name)
-                            else:
-                                print("- MISSING SCIENTIFIC NAME: ", dyntaxa_scientific_name, " - ", scientific_name)
-
-            print("")
-
-
-        # Write to file.
-        outdata_path = pathlib.Path(self.data_out_path)
-        if not outdata_path.exists():
-            outdata_path.mkdir(parents=True)
-        translate_file = pathlib.Path(outdata_path, "translate_dyntaxa_to_worms.txt")
-        with translate_file.open("w", encoding="cp1252") as out_file:
-            out_file.write("\t".join(self.translate_dyntaxa_to_worms_header) + "\n")
-            for row in out_data_rows:
-                out_file.write("\t".join(row) + "\n")
-
+                            yield dict(zip(header, row))
 
     def import_taxa_worms(self):
         """ """
-        taxa_worms = pathlib.Path(self.data_out_path, "taxa_worms.txt")
-        if taxa_worms.exists():
-            print("Importing file: ", taxa_worms)
-            with taxa_worms.open(
+        if self.taxa is not None:
+            self.taxa_index.add_taxa(self.taxa)
+        elif self.db_file and pathlib.Path(self.db_file).exists():
+            print("Importing WoRMS cache: ", self.db_file)
+            db_cache = worms_sqlite_cache.WormsSqliteCache(db_file=self.db_file)
+            try:
+                self.taxa_index.load_cache(db_cache)
+            finally:
+                db_cache.close()
+        else:
+            taxa_worms = pathlib.Path(self.data_out_path, "taxa_worms.txt")
+            if taxa_worms.exists():
+                print("Importing file: ", taxa_worms)
+                self.taxa_index.load_taxa_worms_file(taxa_worms)
+        print("Taxa available for translation: ", len(self.taxa_index))
+
+    def import_translate_to_worms(self):
+        """ """
+        translate_to_worms = pathlib.Path(self.data_out_path, "translate_to_worms.txt")
+        if translate_to_worms.exists():
+            print("Importing file: ", translate_to_worms)
+            with translate_to_worms.open(
                 "r", encoding="cp1252", errors="ignore"
             ) as indata_file:
                 header = None
@@ -128,17 +181,16 @@ class CreateTranslateDyntaxaToWorms():
                         header = row
                     else:
                         row_dict = dict(zip(header, row))
-                        scientific_name = row_dict.get("scientific_name", "")
-                        aphia_id = row_dict.get("aphia_id", "")
+                        scientific_name = row_dict.get("scientific_name_from", "")
                         if scientific_name:
-                            self.taxa_worms_dict[scientific_name] = row_dict
+                            self.translate_to_worms_dict[scientific_name] = row_dict
 
-    def import_translate_to_worms(self):
-        """ """
-        translate_to_worms = pathlib.Path(self.data_out_path, "translate_to_worms.txt")
-        if translate_to_worms.exists():
-            print("Importing file: ", translate_to_worms)
-            with translate_to_worms.open(
+    def import_dyntaxa_to_aphia_id(self):
+        """Dyntaxa id and AphiaID from aphia_id_list.txt, if available."""
+        indata_aphia_id = pathlib.Path(self.data_in_path, "aphia_id_list.txt")
+        if indata_aphia_id.exists():
+            print("Importing file: ", indata_aphia_id)
+            with indata_aphia_id.open(
                 "r", encoding="cp1252", errors="ignore"
             ) as indata_file:
                 header = None
@@ -148,15 +200,25 @@ class CreateTranslateDyntaxaToWorms():
                         header = row
                     else:
                         row_dict = dict(zip(header, row))
-                        scientific_name = row_dict.get("scientific_name_from", "")
-                        aphia_id = row_dict.get("aphia_id", "")
-                        if scientific_name:
-                            self.translate_to_worms_dict[scientific_name] = row_dict
+                        dyntaxa_id = row_dict.get("DyntaxaID", "")
+                        aphia_id = row_dict.get("used_aphia_id", "")
+                        if dyntaxa_id and aphia_id:
+                            self.dyntaxa_to_aphia_id_dict[dyntaxa_id] = aphia_id
 
 
 if __name__ == "__main__":
     """ """
+    parser = argparse.ArgumentParser(
+        description="Create translate_dyntaxa_to_worms.txt from taxa_worms.txt."
+    )
+    parser.add_argument(
+        "--db-file",
+        metavar="DB_FILE",
+        help="Find taxa in the WoRMS cache instead of taxa_worms.txt.",
+    )
+    args = parser.parse_args()
+
     taxa_mgr = CreateTranslateDyntaxaToWorms(
-        data_in_path="data_in", data_out_path="data_out"
+        data_in_path="data_in", data_out_path="data_out", db_file=args.db_file
     )
     taxa_mgr.create_translate_file()
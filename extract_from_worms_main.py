@@ -4,12 +4,118 @@
 # Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import argparse
+
 import wormsextractor
+from wormsextractor import worms_offline_store
 
 if __name__ == "__main__":
     """ """
+    parser = argparse.ArgumentParser(description="Extract species lists from WoRMS.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch records modified in WoRMS since the last sync.",
+    )
+    parser.add_argument(
+        "--refresh-stale",
+        action="store_true",
+        help="Fetch cached results older than --cache-ttl-days again, then run all.",
+    )
+    parser.add_argument(
+        "--cache-ttl-days",
+        type=float,
+        metavar="DAYS",
+        help="Max age for cached WoRMS results. Default: Never expires.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the checkpoint saved by an interrupted run.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream taxa from indata to outdata files with bounded memory use.",
+    )
+    parser.add_argument(
+        "--offline-db",
+        metavar="DB_FILE",
+        help="Run offline from a local WoRMS snapshot, see --import-snapshot.",
+    )
+    parser.add_argument(
+        "--import-snapshot",
+        metavar="FILE",
+        help="Import a WoRMS DwC-A zip or taxon.txt file to the offline db and exit.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help="Write metrics in the Prometheus text format to FILE after the run.",
+    )
+    parser.add_argument(
+        "--output-formats",
+        nargs="+",
+        choices=["tsv", "jsonl", "parquet"],
+        default=["tsv"],
+        help="Formats for the taxa table. Parquet requires pyarrow. Default: tsv",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        metavar="N",
+        help="Split the indata lists into N shards, run them in parallel processes "
+        "and merge the results.",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        metavar="I",
+        help="With --shards: Only run shard I (0 to N-1), for example on one node "
+        "in a cluster.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="With --shards: Number of worker processes. Default: One for each shard.",
+    )
+    parser.add_argument(
+        "--merge-shards",
+        nargs="+",
+        metavar="SHARD_DIR",
+        help="Merge shard directories into worms_cache.db and data_out, and exit.",
+    )
+    args = parser.parse_args()
+
+    if args.import_snapshot:
+        store = worms_offline_store.WormsOfflineStore(
+            args.offline_db or "worms_offline.db"
+        )
+        store.import_snapshot(args.import_snapshot)
+        store.close()
+        raise SystemExit()
+
     taxa_mgr = wormsextractor.TaxaListGenerator(
         data_in_dir="data_in",
         data_out_dir="data_out",
+        max_workers=8,
+        requests_per_second=10,
+        cache_ttl_days=args.cache_ttl_days,
+        offline_db=args.offline_db,
+        metrics_file=args.metrics_file,
+        output_formats=args.output_formats,
     )
-    taxa_mgr.run_all()
+    if args.merge_shards:
+        taxa_mgr.merge_shards(args.merge_shards)
+    elif args.shards and (args.shard_index is not None):
+        taxa_mgr.run_shard(args.shard_index, args.shards)
+    elif args.shards:
+        taxa_mgr.run_sharded(args.shards, processes=args.processes)
+    elif args.incremental:
+        taxa_mgr.run_incremental()
+    elif args.refresh_stale:
+        taxa_mgr.run_refresh_stale()
+    elif args.streaming:
+        taxa_mgr.run_streaming()
+    else:
+        taxa_mgr.run_all(resume=args.resume)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+import io
+import time
+import unittest
+
+from wormsextractor import worms_flow_control
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """ """
+
+    def create_open_breaker(self, max_outage=60.0):
+        """Returns a CircuitBreaker opened by one failure."""
+        breaker = worms_flow_control.CircuitBreaker(
+            failure_threshold=1,
+            reset_timeout=0.05,
+            max_reset_timeout=0.05,
+            max_outage=max_outage,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        return breaker
+
+    def test_throttled_test_request_reopens_circuit(self):
+        """A 429 on the test request must not keep the circuit half open."""
+        breaker = self.create_open_breaker()
+        time.sleep(0.06)
+        breaker.before_request()
+        self.assertEqual(breaker.state, "half_open")
+        breaker.record_throttle(retry_after=0.05)
+        self.assertEqual(breaker.state, "open")
+        # The next caller gets the test request when the timeout has passed.
+        start_time = time.monotonic()
+        breaker.before_request()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertLess(time.monotonic() - start_time, 1.0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_recovers_after_max_outage(self):
+        """Callers fail after max_outage, but test requests are still sent."""
+        breaker = self.create_open_breaker(max_outage=0.01)
+        time.sleep(0.02)
+        # Outage too long and the circuit is still open: The caller fails.
+        breaker.open_until = time.monotonic() + 10.0
+        with self.assertRaises(worms_flow_control.CircuitOpenError):
+            breaker.before_request()
+        # When the timeout has passed a test request is allowed.
+        breaker.open_until = time.monotonic()
+        breaker.before_request()
+        self.assertEqual(breaker.state, "half_open")
+        with contextlib.redirect_stdout(io.StringIO()):
+            breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before_request()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import pathlib
+import tempfile
+import unittest
+import urllib.parse
+
+from wormsextractor import worms_rest_client
+
+
+class FakeWorms:
+    """Answers get_json() calls. AphiaID 999 is rejected by WoRMS with 400,
+    which makes the whole AphiaRecordsByAphiaIDs request fail."""
+
+    bad_aphia_id = "999"
+
+    def __init__(self):
+        """ """
+        self.urls = []
+
+    def get_json(self, url):
+        """ """
+        self.urls.append(url)
+        path, _, query = url.partition("?")
+        if path.endswith("/AphiaRecordsByAphiaIDs"):
+            aphia_ids = urllib.parse.parse_qs(query)["aphiaids[]"]
+            if self.bad_aphia_id in aphia_ids:
+                return ({}, "Response code: 400")
+            return ([self.make_record(aphia_id) for aphia_id in aphia_ids], "")
+        aphia_id = path.rsplit("/", 1)[-1]
+        if aphia_id == self.bad_aphia_id:
+            return ({}, "Response code: 400")
+        return (self.make_record(aphia_id), "")
+
+    def make_record(self, aphia_id):
+        """ """
+        return {"AphiaID": int(aphia_id), "scientificname": "Taxon " + aphia_id}
+
+
+class FetchRecordsTest(unittest.TestCase):
+    """ """
+
+    def setUp(self):
+        """ """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.client = worms_rest_client.WormsRestClient(
+            db_file=str(pathlib.Path(self.tmp_dir.name, "worms_cache.db"))
+        )
+        self.fake_worms = FakeWorms()
+        self.client.get_json = self.fake_worms.get_json
+
+    def tearDown(self):
+        """ """
+        self.client.close()
+        self.tmp_dir.cleanup()
+
+    def test_invalid_aphia_id_is_not_requested(self):
+        """A non-numeric AphiaID must not make the other AphiaIDs fail."""
+        aphia_id_list = [str(aphia_id) for aphia_id in range(100, 149)] + ["abc"]
+        records_dict, errors_dict = self.client.get_records_by_aphiaids(aphia_id_list)
+        self.assertEqual(len(records_dict), 49)
+        self.assertEqual(list(errors_dict), ["abc"])
+        self.assertIn("Invalid AphiaID", errors_dict["abc"])
+        self.assertEqual(len(self.fake_worms.urls), 1)
+        self.assertNotIn("abc", self.fake_worms.urls[0])
+        self.assertIsNone(self.client.db_cache.get_result("worms_records", "abc"))
+
+    def test_failed_chunk_is_requested_one_by_one(self):
+        """Only the AphiaID causing the error is reported and cached as an error."""
+        aphia_id_list = [str(aphia_id) for aphia_id in range(100, 149)] + ["999"]
+        records_dict, errors_dict = self.client.get_records_by_aphiaids(aphia_id_list)
+        self.assertEqual(len(records_dict), 49)
+        self.assertEqual(list(errors_dict), ["999"])
+        self.assertEqual(
+            self.client.db_cache.get_result("worms_records", "100"),
+            (records_dict["100"], ""),
+        )
+        self.assertEqual(
+            self.client.db_cache.get_result("worms_records", "999")[1],
+            errors_dict["999"],
+        )
+        # Cached results are used in the next call.
+        number_of_urls = len(self.fake_worms.urls)
+        self.client.get_records_by_aphiaids(aphia_id_list)
+        self.assertEqual(len(self.fake_worms.urls), number_of_urls)
+
+
+if __name__ == "__main__":
+    unittest.main()
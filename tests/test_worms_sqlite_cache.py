@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+import io
+import json
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+
+from wormsextractor import worms_sqlite_cache
+
+
+def make_record(aphia_id, scientific_name, rank="Species", parent_id=None):
+    """ """
+    return {
+        "AphiaID": aphia_id,
+        "scientificname": scientific_name,
+        "rank": rank,
+        "status": "accepted",
+        "valid_AphiaID": aphia_id,
+        "parentNameUsageID": parent_id,
+    }
+
+
+class SqliteCacheTest(unittest.TestCase):
+    """ """
+
+    def setUp(self):
+        """ """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        """ """
+        self.tmp_dir.cleanup()
+
+    def open_cache(self, file_name):
+        """ """
+        db_cache = worms_sqlite_cache.WormsSqliteCache(
+            db_file=str(self.tmp_path / file_name)
+        )
+        self.addCleanup(db_cache.close)
+        return db_cache
+
+    def set_fetched_at(self, db_cache, aphia_id, fetched_at):
+        """ """
+        db_cache.flush()
+        db_cache.db_conn.execute(
+            "update worms_records set fetched_at = ? where aphia_id = ?",
+            (fetched_at, int(aphia_id)),
+        )
+        db_cache.db_conn.commit()
+
+    def test_migrate_baseline_db(self):
+        """Cache files from the first version, with JSON text and aphia_id as
+        varchar, are migrated to the current schema version."""
+        db_path = self.tmp_path / "worms_cache.db"
+        db_conn = sqlite3.connect(db_path)
+        db_conn.execute(
+            "CREATE TABLE worms_records(aphia_id varchar(20) PRIMARY KEY, data json)"
+        )
+        db_conn.execute(
+            "CREATE TABLE classification(aphia_id varchar(20) PRIMARY KEY, data json)"
+        )
+        rows = [
+            ("104251", make_record(104251, "Acartia tonsa", parent_id=104108)),
+            ("104108", make_record(104108, "Acartia", rank="Genus")),
+            ("Acartia", make_record(104108, "Acartia", rank="Genus")),
+        ]
+        db_conn.executemany(
+            "insert into worms_records values (?, ?)",
+            [(aphia_id, json.dumps(worms_rec)) for aphia_id, worms_rec in rows],
+        )
+        classification = {"AphiaID": 104251, "rank": "Species", "child": None}
+        db_conn.execute(
+            "insert into classification values (?, ?)",
+            ("104251", json.dumps(classification)),
+        )
+        db_conn.commit()
+        db_conn.close()
+
+        db_cache = self.open_cache("worms_cache.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            db_cache.connect()
+        version = db_cache.db_conn.execute("PRAGMA user_version").fetchone()[0]
+        self.assertEqual(version, worms_sqlite_cache.SCHEMA_VERSION)
+        self.assertEqual(
+            db_cache.get_result("worms_records", "104251"), (rows[0][1], "")
+        )
+        self.assertEqual(
+            db_cache.get_result("classification", "104251"), (classification, "")
+        )
+        # Keys that are not AphiaIDs are dropped.
+        self.assertEqual(db_cache.get_ids("worms_records"), ["104108", "104251"])
+        # Indexed columns are filled from the old records.
+        self.assertEqual(db_cache.find_record_ids(parent_id=104108), ["104251"])
+        self.assertEqual(db_cache.count_records(rank="Genus"), 1)
+
+    def test_merge_keeps_last_fetched(self):
+        """For AphiaIDs in both files, the entry fetched last is kept."""
+        db_cache = self.open_cache("worms_cache.db")
+        shard_cache = self.open_cache("shard_cache.db")
+        db_cache.add_results(
+            "worms_records",
+            {
+                "1": (make_record(1, "Old in cache"), ""),
+                "2": (make_record(2, "New in cache"), ""),
+                "3": (make_record(3, "Only in cache"), ""),
+            },
+        )
+        shard_cache.add_results(
+            "worms_records",
+            {
+                "1": (make_record(1, "New in shard"), ""),
+                "2": (make_record(2, "Old in shard"), ""),
+                "4": (make_record(4, "Only in shard"), ""),
+            },
+        )
+        self.set_fetched_at(db_cache, "1", 100.0)
+        self.set_fetched_at(db_cache, "2", 300.0)
+        self.set_fetched_at(shard_cache, "1", 200.0)
+        self.set_fetched_at(shard_cache, "2", 200.0)
+        shard_cache.close()
+
+        number_of_rows = db_cache.merge_from(self.tmp_path / "shard_cache.db")
+        self.assertEqual(number_of_rows, 2)
+        names = {
+            aphia_id: worms_rec["scientificname"]
+            for aphia_id, worms_rec in db_cache.iter_data("worms_records")
+        }
+        self.assertEqual(
+            names,
+            {
+                "1": "New in shard",
+                "2": "New in cache",
+                "3": "Only in cache",
+                "4": "Only in shard",
+            },
+        )
+        fetched_times = db_cache.get_fetched_times("worms_records")
+        self.assertEqual(fetched_times["1"], 200.0)
+        self.assertEqual(fetched_times["2"], 300.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
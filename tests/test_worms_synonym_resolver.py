@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import unittest
+
+from wormsextractor import worms_synonym_resolver
+from wormsextractor import worms_taxon
+
+
+class FakeWormsClient:
+    """Returns records from a dict, and counts the requested AphiaIDs."""
+
+    def __init__(self, records):
+        """records: Key: AphiaID as text. Value: WoRMS record."""
+        self.records = records
+        self.requested_ids = []
+
+    def get_records_by_aphiaids(self, aphia_id_list, executor=None):
+        """ """
+        self.requested_ids.extend(aphia_id_list)
+        records_dict = {}
+        errors_dict = {}
+        for aphia_id in aphia_id_list:
+            if aphia_id in self.records:
+                records_dict[aphia_id] = self.records[aphia_id]
+            else:
+                errors_dict[aphia_id] = "AphiaID: " + aphia_id + "  Response code: 204"
+        return (records_dict, errors_dict)
+
+
+def make_record(aphia_id, scientific_name, status, valid_aphia_id):
+    """ """
+    return {
+        "AphiaID": aphia_id,
+        "scientificname": scientific_name,
+        "status": status,
+        "valid_AphiaID": valid_aphia_id,
+    }
+
+
+class SynonymResolverTest(unittest.TestCase):
+    """ """
+
+    def test_chain_is_followed_to_valid_taxon(self):
+        """ """
+        worms_client = FakeWormsClient(
+            {
+                "2": make_record(2, "Name B", "unaccepted", 3),
+                "3": make_record(3, "Name C", "accepted", 3),
+            }
+        )
+        resolver = worms_synonym_resolver.SynonymResolver(worms_client)
+        taxon = worms_taxon.normalise_worms_record(
+            make_record(1, "Name A", "unaccepted", 2)
+        )
+        resolver.add_taxon(taxon)
+        self.assertEqual(resolver.resolve(), ["3"])
+        rows, errors = resolver.get_translate_rows()
+        self.assertEqual(
+            rows, [["Name A", "Name C", "1", "3", "unaccepted", "accepted"]]
+        )
+        self.assertEqual(errors, [])
+
+    def test_loop_in_valid_taxa(self):
+        """A -> B -> A: resolve() ends, and the loop is reported as an error."""
+        worms_client = FakeWormsClient(
+            {
+                "1": make_record(1, "Name A", "unaccepted", 2),
+                "2": make_record(2, "Name B", "unaccepted", 1),
+            }
+        )
+        resolver = worms_synonym_resolver.SynonymResolver(worms_client)
+        resolver.add_taxon(
+            worms_taxon.normalise_worms_record(worms_client.records["1"])
+        )
+        self.assertEqual(resolver.resolve(), [])
+        # Each AphiaID is only requested once.
+        self.assertEqual(worms_client.requested_ids, ["2"])
+        rows, errors = resolver.get_translate_rows()
+        self.assertEqual(rows, [])
+        self.assertEqual(errors, [["Name A", "1", "Loop in valid taxa: 1 -> 2 -> 1"]])
+
+    def test_missing_valid_taxon(self):
+        """ """
+        worms_client = FakeWormsClient({})
+        resolver = worms_synonym_resolver.SynonymResolver(worms_client)
+        resolver.add_taxon(
+            worms_taxon.normalise_worms_record(
+                make_record(1, "Name A", "unaccepted", 2)
+            )
+        )
+        self.assertEqual(resolver.resolve(), [])
+        self.assertEqual(worms_client.requested_ids, ["2"])
+        _rows, errors = resolver.get_translate_rows()
+        self.assertEqual(errors, [["Name A", "1", "Valid taxa not found: 2"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import argparse
+
+import wormsextractor
+from wormsextractor import worms_lookup_service
+
+if __name__ == "__main__":
+    """ """
+    parser = argparse.ArgumentParser(
+        description="Local HTTP service for taxon lookups, shared by many jobs."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="Default: 8765")
+    parser.add_argument(
+        "--offline-db",
+        metavar="DB_FILE",
+        help="Use a local WoRMS snapshot instead of the REST API.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=3600,
+        help="Seconds finished taxa are kept in memory. Default: 3600",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log each request.")
+    args = parser.parse_args()
+
+    if args.offline_db:
+        worms_client = wormsextractor.OfflineWormsClient(args.offline_db)
+    else:
+        worms_client = wormsextractor.WormsRestClient(
+            requests_per_second=10, pool_size=8
+        )
+    lookup_service = worms_lookup_service.TaxonLookupService(
+        worms_client, max_workers=8, max_age=args.max_age
+    )
+    server = worms_lookup_service.create_server(
+        lookup_service, host=args.host, port=args.port, verbose=args.verbose
+    )
+    print("Taxon lookup service on http://" + args.host + ":" + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        lookup_service.close()
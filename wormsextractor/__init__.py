@@ -1,3 +1,5 @@
 
 from wormsextractor.worms_rest_client import WormsRestClient
+from wormsextractor.worms_async_rest_client import AsyncWormsRestClient
+from wormsextractor.worms_offline_client import OfflineWormsClient
 from wormsextractor.worms_extract_taxa import TaxaListGenerator
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import ssl
+import time
+import urllib.parse
+
+from wormsextractor import worms_flow_control
+from wormsextractor import worms_sqlite_cache
+
+
+class AsyncWormsRestClient:
+    """
+    Asyncio version of WormsRestClient.
+    For usage instructions check "https://github.com/sharkdata/species".
+
+    Example:
+        client = AsyncWormsRestClient()
+        worms_rec, error = await client.get_record_by_aphiaid(aphia_id)
+        await client.close()
+    """
+
+    def __init__(
+        self,
+        base_url="https://www.marinespecies.org/rest",
+        max_connections=20,
+        requests_per_second=None,
+        timeout=60,
+        ttl_days=None,
+        negative_ttl_days=1,
+        memory_cache_size=20000,
+        max_retries=5,
+        db_file="worms_cache.db",
+    ):
+        """
+        max_connections: Max number of open HTTP connections. Lookups above
+            that limit are waiting in the event loop, not in threads.
+        requests_per_second: Global limit for calls to the WoRMS REST API.
+        timeout: Timeout in seconds for each HTTP request.
+        ttl_days, negative_ttl_days: Max age for cached results, see WormsSqliteCache.
+        memory_cache_size: Max number of decoded cache entries kept in memory.
+        max_retries: Retries for network errors and responses like 429 and 503.
+        db_file: SQLite file used as cache.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.db_cache = worms_sqlite_cache.WormsSqliteCache(
+            db_file=db_file,
+            ttl_days=ttl_days,
+            negative_ttl_days=negative_ttl_days,
+            memory_cache_size=memory_cache_size,
+        )
+        # All SQLite work is done in one thread outside the event loop.
+        self.db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.max_connections = max_connections
+        self.connection_semaphore = None
+        self.rate_limiter = AsyncRateLimiter(requests_per_second)
+        self.retry_policy = worms_flow_control.RetryPolicy(max_retries=max_retries)
+
+    async def close(self):
+        """ """
+        await self.run_in_db_thread(self.db_cache.close)
+        self.db_executor.shutdown(wait=True)
+
+    async def run_in_db_thread(self, function, *args):
+        """ """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, function, *args)
+
+    async def get_record_by_aphiaid(self, aphia_id):
+        """WoRMS REST: AphiaRecordByAphiaID"""
+        # Check db cache.
+        cached_result = await self.run_in_db_thread(
+            self.db_cache.get_result, "worms_records", aphia_id
+        )
+        if cached_result is not None:
+            return cached_result
+        # Ask REST API.
+        url = self.base_url + "/AphiaRecordByAphiaID/" + str(aphia_id)
+        result_dict, error = await self.get_json(url, aphia_id)
+        # Save to db cache. Not found and errors are also cached, but not
+        # transient errors.
+        if not worms_flow_control.is_transient_error(error):
+            await self.run_in_db_thread(
+                self.db_cache.add_result, "worms_records", aphia_id, result_dict, error
+            )
+        return (result_dict, error)
+
+    async def get_classification_by_aphiaid(self, aphia_id):
+        """WoRMS REST: AphiaClassificationByAphiaID"""
+        # Check db cache.
+        cached_result = await self.run_in_db_thread(
+            self.db_cache.get_result, "classification", aphia_id
+        )
+        if cached_result is not None:
+            return cached_result
+        # Ask REST API.
+        url = self.base_url + "/AphiaClassificationByAphiaID/" + str(aphia_id)
+        result_dict, error = await self.get_json(url, aphia_id)
+        # Save to db cache. Not found and errors are also cached, but not
+        # transient errors.
+        if not worms_flow_control.is_transient_error(error):
+            await self.run_in_db_thread(
+                self.db_cache.add_result, "classification", aphia_id, result_dict, error
+            )
+        return (result_dict, error)
+
+    async def get_json(self, url, aphia_id):
+        """Returns (result_dict, error) in the same way as WormsRestClient.
+        Network errors and responses like 429 and 503 are retried with backoff."""
+        if self.connection_semaphore is None:
+            self.connection_semaphore = asyncio.Semaphore(self.max_connections)
+        error_prefix = "AphiaID: " + str(aphia_id) + "  "
+        error = ""
+        for attempt in range(self.retry_policy.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.connection_semaphore:
+                    await self.rate_limiter.wait()
+                    status, body, headers = await asyncio.wait_for(
+                        self.http_get(url), timeout=self.timeout
+                    )
+            except Exception as e:
+                error = error_prefix + "Exception: " + str(e)
+            else:
+                if status not in worms_flow_control.transient_status_codes:
+                    if status != 200:
+                        return ({}, error_prefix + "Response code: " + str(status))
+                    try:
+                        return (json.loads(body.decode("utf-8")), "")
+                    except Exception as e:
+                        return ({}, error_prefix + "Exception: " + str(e))
+                error = error_prefix + "Response code: " + str(status)
+                retry_after = worms_flow_control.parse_retry_after(
+                    headers.get("retry-after", "")
+                )
+            if attempt < self.retry_policy.max_retries:
+                await asyncio.sleep(self.retry_policy.get_delay(attempt, retry_after))
+        return ({}, error)
+
+    async def http_get(self, url):
+        """Minimal non-blocking HTTP/1.1 GET. Returns (status, body, headers)."""
+        parts = urllib.parse.urlsplit(url)
+        use_ssl = parts.scheme == "https"
+        port = parts.port or (443 if use_ssl else 80)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        reader, writer = await asyncio.open_connection(
+            parts.hostname,
+            port,
+            ssl=ssl.create_default_context() if use_ssl else None,
+        )
+        try:
+            request = (
+                "GET " + path + " HTTP/1.1\r\n"
+                "Host: " + parts.netloc + "\r\n"
+                "Accept: application/json\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(request.encode("ascii"))
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            if status in (204, 304):
+                body = b""
+            elif headers.get("transfer-encoding", "").lower() == "chunked":
+                body = await self.read_chunked(reader)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+            return (status, body, headers)
+        finally:
+            writer.close()
+            # Waits until the transport is closed, so that connections are
+            # not left open until garbage collection.
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def read_chunked(self, reader):
+        """ """
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                # Skip trailers.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return b"".join(chunks)
+
+
+class AsyncRateLimiter:
+    """Asyncio limiter used to keep a global requests per second limit."""
+
+    def __init__(self, requests_per_second=None):
+        """ """
+        self.requests_per_second = requests_per_second
+        self.next_time = 0.0
+
+    async def wait(self):
+        """Waits, without blocking the event loop, until the next request is allowed."""
+        if not self.requests_per_second:
+            return
+        interval = 1.0 / self.requests_per_second
+        now = time.monotonic()
+        wait_time = self.next_time - now
+        self.next_time = max(now, self.next_time) + interval
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
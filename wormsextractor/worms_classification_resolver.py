@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+
+from wormsextractor import worms_taxon
+
+class ClassificationResolver:
+    """
+    Adds classification nodes to TaxaListGenerator.higher_taxa_dict and only
+    calls AphiaClassificationByAphiaID for new lineages.
+
+    If the parent of an accepted taxon (parentNameUsageID in the WoRMS record)
+    already is in higher_taxa_dict, the full classification is known and the
+    node for the taxon is derived from the record instead.
+
+    Usage, for a list of WoRMS records:
+        classification_dict = resolver.prefetch(records_list, executor)
+        for worms_rec in records_list:
+            error = resolver.add_to_higher_taxa(worms_rec, classification_dict)
+    """
+
+    def __init__(self, worms_client, higher_taxa_dict, lock=None):
+        """
+        lock: Used when higher_taxa_dict is shared by threads, for example in
+            TaxonLookupService. It is only held while higher_taxa_dict is read
+            or changed, never during calls to WoRMS.
+        """
+        self.worms_client = worms_client
+        self.higher_taxa_dict = higher_taxa_dict
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        # Statistics.
+        self.calls_made = 0
+        self.calls_avoided = 0
+        self.cache_hits = 0
+
+    def prefetch(self, records_list, executor=None):
+        """Fetches classifications needed for the records, in parallel if an
+        executor is given. Only one taxon is fetched for each unknown parent,
+        the siblings are derived from that classification later.
+        Returns a dict. Key: AphiaID. Value: (classification, error)."""
+        with self.lock:
+            known_ids = set(self.higher_taxa_dict.keys())
+        pending_parents = set()
+        classification_dict = {}
+        fetch_list = []
+        for worms_rec in records_list:
+            aphia_id = worms_rec.get("AphiaID", "")
+            if aphia_id in known_ids:
+                continue
+            classification = self.worms_client.get_cached_classification(aphia_id)
+            if classification is not None:
+                self.cache_hits += 1
+                classification_dict[aphia_id] = (classification, "")
+                known_ids.update(self.get_classification_ids(classification))
+                continue
+            parent_id = self.get_derivable_parent_id(worms_rec)
+            if parent_id in known_ids:
+                known_ids.add(aphia_id)
+                continue
+            if parent_id in pending_parents:
+                # Derived when the classification for a sibling is added.
+                continue
+            if parent_id:
+                pending_parents.add(parent_id)
+            fetch_list.append(aphia_id)
+        if executor:
+            results = executor.map(self.fetch_classification, fetch_list)
+        else:
+            results = map(self.fetch_classification, fetch_list)
+        classification_dict.update(zip(fetch_list, results))
+        self.calls_made += len(fetch_list)
+        return classification_dict
+
+    def add_to_higher_taxa(self, worms_rec, classification_dict):
+        """Adds nodes for the record and its ancestors. Should be called in the
+        same order as records were prefetched. Returns an error string."""
+        aphia_id = worms_rec.get("AphiaID", "")
+        if aphia_id in classification_dict:
+            classification, error = classification_dict[aphia_id]
+            with self.lock:
+                self.add_classification_nodes(classification)
+            return error
+        with self.lock:
+            if aphia_id in self.higher_taxa_dict:
+                self.calls_avoided += 1
+                return ""
+            parent_id = self.get_derivable_parent_id(worms_rec)
+            if parent_id in self.higher_taxa_dict:
+                self.calls_avoided += 1
+                self.higher_taxa_dict[aphia_id] = worms_taxon.Taxon(
+                    aphia_id=aphia_id,
+                    rank=worms_rec.get("rank", ""),
+                    scientific_name=worms_rec.get("scientificname", ""),
+                    parent_id=parent_id,
+                    parent_name=self.higher_taxa_dict[parent_id].scientific_name,
+                    lsid=worms_rec.get("lsid", ""),
+                )
+                return ""
+        # Not prefetched, for example if the classification for a sibling failed.
+        classification, error = self.fetch_classification(aphia_id)
+        with self.lock:
+            self.calls_made += 1
+            self.add_classification_nodes(classification)
+        return error
+
+    def get_derivable_parent_id(self, worms_rec):
+        """Returns the parent AphiaID, or None if the node can't be derived
+        from the record."""
+        if worms_rec.get("status", "") != "accepted":
+            return None
+        if not (worms_rec.get("rank", "") and worms_rec.get("scientificname", "")):
+            return None
+        return worms_rec.get("parentNameUsageID", None) or None
+
+    def get_classification_ids(self, classification):
+        """AphiaIDs in a classification from AphiaClassificationByAphiaID."""
+        aphia_ids = []
+        current_node = classification
+        while current_node:
+            aphia_ids.append(current_node.get("AphiaID", ""))
+            current_node = current_node.get("child", None)
+        return aphia_ids
+
+    def fetch_classification(self, aphia_id):
+        """ """
+        try:
+            return self.worms_client.get_classification_by_aphiaid(aphia_id)
+        except Exception as e:
+            return ({}, "AphiaID: " + str(aphia_id) + "  Exception: " + str(e))
+
+    def add_classification_nodes(self, classification):
+        """Adds all nodes in a classification to higher_taxa_dict."""
+        aphia_id = None
+        scientific_name = None
+        current_node = classification
+        while current_node not in [None, ""]:
+            parent_id = aphia_id
+            parent_name = scientific_name
+            aphia_id = current_node.get("AphiaID", "")
+            rank = current_node.get("rank", "")
+            scientific_name = current_node.get("scientificname", "")
+            lsid = current_node.get("lsid", "")  # MH adderar LSID
+            if aphia_id and rank and scientific_name:
+                if aphia_id not in self.higher_taxa_dict:
+                    self.higher_taxa_dict[aphia_id] = worms_taxon.Taxon(
+                        aphia_id=aphia_id,
+                        rank=rank,
+                        scientific_name=scientific_name,
+                        parent_id=parent_id,
+                        parent_name=parent_name,
+                        lsid=lsid,  # MH adderar LSID
+                    )
+                current_node = current_node.get("child", None)
+            else:
+                current_node = None
+
+    def get_statistics(self):
+        """ """
+        return {
+            "classification_calls_made": self.calls_made,
+            "classification_calls_avoided": self.calls_avoided,
+            "classification_cache_hits": self.cache_hits,
+        }
@@ -4,9 +4,23 @@
 # Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import json
+import os
 import pathlib
 
+from wormsextractor import worms_classification_resolver
+from wormsextractor import worms_name_matcher
+from wormsextractor import worms_offline_client
+from wormsextractor import worms_output_writers
 from wormsextractor import worms_rest_client
+from wormsextractor import worms_run_metrics
+from wormsextractor import worms_synonym_resolver
+from wormsextractor import worms_taxon
+from wormsextractor import worms_taxonomy_tree
 
 
 class TaxaListGenerator:
@@ -18,46 +32,86 @@ class TaxaListGenerator:
         self,
         data_in_dir="data_in",
         data_out_dir="data_out",
+        max_workers=8,
+        requests_per_second=10,
+        cache_ttl_days=None,
+        cache_negative_ttl_days=1,
+        cache_memory_size=20000,
+        checkpoint_interval=500,
+        offline_db=None,
+        metrics_file=None,
+        output_formats=("tsv",),
+        cache_db_file="worms_cache.db",
     ):
-        """ """
+        """
+        max_workers: Number of parallel workers used when fetching from WoRMS.
+        requests_per_second: Global limit for calls to the WoRMS REST API.
+        cache_ttl_days: Max age for cached WoRMS results. None: Never expires.
+        cache_negative_ttl_days: Max age for cached "not found" and error results.
+        cache_memory_size: Max number of decoded cache entries kept in memory.
+        checkpoint_interval: Number of taxa checked between checkpoints.
+        offline_db: Local WoRMS snapshot, see WormsOfflineStore. If used,
+            WoRMS is not called.
+        metrics_file: Metrics in the Prometheus text format are written to this
+            file after each run. The run report, data_out/run_report.json, is
+            always written.
+        output_formats: Formats for the taxa table: "tsv" (taxa_worms.txt),
+            "jsonl" (taxa_worms.jsonl) and "parquet" (taxa_worms.parquet,
+            requires pyarrow). All are written in one pass.
+        cache_db_file: SQLite file used as cache for WoRMS results.
+        """
         self.data_in_dir = data_in_dir
         self.data_out_dir = data_out_dir
+        self.max_workers = max_workers
+        self.checkpoint_interval = checkpoint_interval
+        self.metrics_file = metrics_file
+        self.output_formats = output_formats
+        self.cache_db_file = cache_db_file
+        # Used for the workers in sharded mode.
+        self.requests_per_second = requests_per_second
+        self.cache_ttl_days = cache_ttl_days
+        self.cache_negative_ttl_days = cache_negative_ttl_days
+        self.cache_memory_size = cache_memory_size
+        self.executor = None
         self.clear()
-        # Create client for the REST API.
-        self.worms_client = worms_rest_client.WormsRestClient()
+        self.offline_db = offline_db
+        if offline_db:
+            # Client for a local WoRMS snapshot.
+            self.worms_client = worms_offline_client.OfflineWormsClient(offline_db)
+        else:
+            # Create client for the REST API.
+            self.worms_client = worms_rest_client.WormsRestClient(
+                requests_per_second=requests_per_second,
+                pool_size=max_workers,
+                ttl_days=cache_ttl_days,
+                negative_ttl_days=cache_negative_ttl_days,
+                memory_cache_size=cache_memory_size,
+                db_file=cache_db_file,
+            )
         #
         self.define_out_headers()
 
     def clear(self):
         """ """
         # Indata:
-        # self.indata_name_list = []
+        self.indata_name_list = []
         self.indata_aphia_id_list = []
         # Outdata.
         self.taxa_worms_header = {}
-        self.taxa_worms_dict = {}  # Key: AphiaID.
+        self.taxa_worms_dict = {}  # Key: AphiaID. Value: Taxon.
         self.errors_list = []  # Errors.
+        self.translate_to_worms_list = []  # Unaccepted to valid taxa.
         # Working area.
         self.new_aphia_id_list = []
-        self.higher_taxa_dict = {}  # Key: aphia_id.
-
-
-        self.rename_worms_header_items = {
-            "AphiaID": "aphia_id",
-            "valid_AphiaID": "valid_aphia_id",
-            "scientificname": "scientific_name",
-            "lsid": "lsid", # MH adderar LSID
-        }
+        self.higher_taxa_dict = {}  # Key: aphia_id. Value: Taxon.
+        # Progress, saved in checkpoints.
+        self.completed_stages = []
+        self.checked_aphia_ids = set()
+        self.classification_resolver = None
+        self.run_metrics = worms_run_metrics.RunMetrics()
 
     def define_out_headers(self):
         """ """
-        self.rename_worms_header_items = {
-            "AphiaID": "aphia_id",
-            "valid_AphiaID": "valid_aphia_id",
-            "scientificname": "scientific_name",
-            "lsid": "lsid", # MH adderar LSID
-        }
-
         self.taxa_worms_header = [
             "scientific_name",
             "authority",
@@ -90,34 +144,326 @@ class TaxaListGenerator:
             #             "modified",
         ]
 
-    def run_all(self):
-        """ """
+    def run_all(self, resume=False):
+        """
+        resume: Continue from the checkpoint saved by an interrupted run.
+        """
         print("\nSpecies list generator started.")
+        self.run_metrics = worms_run_metrics.RunMetrics()
+        stage = self.run_metrics.stage
+
+        with stage("read_indata_files"):
+            self.read_indata_files()
+
+        with stage("prepare_list_of_taxa"):
+            self.prepare_list_of_taxa()
+
+        if resume:
+            self.load_checkpoint()
+
+        try:
+            if "check_taxa_in_worms" not in self.completed_stages:
+                with stage("check_taxa_in_worms"):
+                    self.check_taxa_in_worms()
+                self.save_checkpoint("check_taxa_in_worms")
+
+            if "add_valid_taxa" not in self.completed_stages:
+                with stage("add_valid_taxa"):
+                    self.add_valid_taxa()
+                self.save_checkpoint("add_valid_taxa")
+
+            if "add_higher_taxa" not in self.completed_stages:
+                with stage("add_higher_taxa"):
+                    self.add_higher_taxa()
+                self.save_checkpoint("add_higher_taxa")
+        finally:
+            self.shutdown_executor()
+            self.worms_client.close_connections()
+            self.worms_client.flush()
+
+        with stage("add_classification"):
+            self.add_classification()
+
+        with stage("save_results"):
+            self.save_results()
+        self.remove_checkpoint()
+
+        self.print_cache_statistics()
+        self.save_run_report(
+            {
+                "number_of_taxa": len(self.taxa_worms_dict),
+                "number_of_errors": len(self.errors_list),
+            }
+        )
+        print("\nDone... Woho YES success")
 
-        self.read_indata_files()
-
-        self.prepare_list_of_taxa()
-
-        self.check_taxa_in_worms()
-        self.save_results()
-
-        self.add_higher_taxa()
-        self.save_results()
+    def print_cache_statistics(self):
+        """ """
+        statistics = self.worms_client.get_cache_statistics()
+        if statistics:
+            print(
+                "\nMemory cache hits: ",
+                statistics["memory_cache_hits"],
+                " misses: ",
+                statistics["memory_cache_misses"],
+                " evictions: ",
+                statistics["memory_cache_evictions"],
+            )
 
-        self.add_parent_info()
-        self.save_results()
+    def save_run_report(self, statistics=None):
+        """Writes data_out/run_report.json, and the Prometheus metrics file if
+        used. statistics: Dict with values for the run, added to the report.
+        Endpoint and cache counters are totals since the client was created."""
+        report_statistics = dict(statistics or {})
+        if self.classification_resolver is not None:
+            report_statistics["classification"] = (
+                self.classification_resolver.get_statistics()
+            )
+        report_statistics["endpoints"] = self.worms_client.get_request_statistics()
+        report_statistics["cache"] = self.worms_client.get_cache_statistics()
+        report = self.run_metrics.get_report(report_statistics)
+        report_file = pathlib.Path(self.data_out_dir, "run_report.json")
+        with atomic_write(report_file, encoding="utf-8") as outdata_file:
+            json.dump(report, outdata_file, indent=2)
+        if self.metrics_file:
+            with atomic_write(self.metrics_file, encoding="utf-8") as outdata_file:
+                outdata_file.write(worms_run_metrics.to_prometheus_text(report))
+
+    def run_streaming(self, chunk_size=500):
+        """Streaming version of run_all() with bounded memory use.
+        See TaxaStreamPipeline for details."""
+        from wormsextractor import worms_stream_pipeline
+
+        self.run_metrics = worms_run_metrics.RunMetrics()
+        pipeline = worms_stream_pipeline.TaxaStreamPipeline(
+            self, chunk_size=chunk_size
+        )
+        with self.run_metrics.stage("run_streaming"):
+            pipeline.run()
+        self.classification_resolver = pipeline.classification_resolver
+        self.save_run_report()
+
+    def run_sharded(self, number_of_shards, processes=None, shard_root="shards"):
+        """Runs the indata lists split into shards, in parallel processes, and
+        merges the results. See ShardedTaxaRun for details."""
+        from wormsextractor import worms_shards
+
+        sharded_run = worms_shards.ShardedTaxaRun(
+            self, number_of_shards=number_of_shards, shard_root=shard_root
+        )
+        try:
+            sharded_run.run(processes=processes)
+        finally:
+            self.worms_client.flush()
+
+    def run_shard(self, shard_index, number_of_shards, shard_root="shards"):
+        """Runs one shard only, for example on one node in a cluster.
+        Merge the shard directories with merge_shards()."""
+        from wormsextractor import worms_shards
+
+        sharded_run = worms_shards.ShardedTaxaRun(
+            self, number_of_shards=number_of_shards, shard_root=shard_root
+        )
+        return sharded_run.run_shard(shard_index)
+
+    def merge_shards(self, shard_paths):
+        """Merges shard directories, from run_shard() on one or more nodes,
+        into the cache and data_out."""
+        from wormsextractor import worms_shards
+
+        self.run_metrics = worms_run_metrics.RunMetrics()
+        sharded_run = worms_shards.ShardedTaxaRun(self)
+        try:
+            with self.run_metrics.stage("merge_shards"):
+                sharded_run.merge(shard_paths)
+        finally:
+            self.worms_client.flush()
+        self.save_run_report(
+            {
+                "number_of_shards": len(shard_paths),
+                "number_of_taxa": len(self.taxa_worms_dict),
+                "number_of_errors": len(self.errors_list),
+            }
+        )
+
+    def run_incremental(self):
+        """Updates the cache with records modified in WoRMS since the last
+        successful sync, then creates new output files from the cache.
+        A full run is done if there is no earlier sync."""
+        if self.offline_db:
+            print("\nIncremental mode is not used for offline snapshots, running all.")
+            self.run_all()
+            return
+        print("\nSpecies list generator started in incremental mode.")
+        db_cache = self.worms_client.db_cache
+        sync_time = datetime.datetime.now(datetime.timezone.utc).replace(
+            microsecond=0
+        )
+        last_sync = db_cache.get_meta("last_sync")
+        if last_sync:
+            if not self.sync_modified_records(last_sync, sync_time.isoformat()):
+                print("\nIncremental sync failed. Last sync time not changed.")
+                return
+        else:
+            print("No earlier sync found, running all.")
+        self.run_all()
+        db_cache.set_meta("last_sync", sync_time.isoformat())
+
+    def run_refresh_stale(self):
+        """Fetches new versions of cached results older than the TTL, see
+        cache_ttl_days and cache_negative_ttl_days, then creates new output
+        files from the cache."""
+        if self.offline_db:
+            print("\nThe cache is not used for offline snapshots, running all.")
+            self.run_all()
+            return
+        print("\nSpecies list generator started in refresh mode.")
+        try:
+            self.worms_client.refresh_stale(executor=self.get_executor())
+        finally:
+            self.shutdown_executor()
+        self.run_all()
+
+    def sync_modified_records(self, since, until):
+        """Updates cached records and classifications modified in WoRMS
+        between since and until. Returns False if the sync failed."""
+        db_cache = self.worms_client.db_cache
+        print("Checking records modified in WoRMS since: ", since)
+        cached_ids = set(db_cache.get_ids("worms_records"))
+        cached_ids.update(db_cache.get_ids("classification"))
+        modified_dict = {}
+        number_of_checked = 0
+        for records_list, error in self.worms_client.get_records_by_date(
+            since, until
+        ):
+            if error:
+                print("Error when checking modified records: ", error)
+                return False
+            for worms_rec in records_list:
+                number_of_checked += 1
+                aphia_id = str(worms_rec.get("AphiaID", ""))
+                if aphia_id in cached_ids:
+                    modified_dict[aphia_id] = worms_rec
+        print(
+            "Modified records: ",
+            number_of_checked,
+            " Used in cache: ",
+            len(modified_dict),
+        )
+        if not modified_dict:
+            return True
+        # Replace modified records.
+        db_cache.add_results(
+            "worms_records",
+            {aphia_id: (worms_rec, "") for aphia_id, worms_rec in modified_dict.items()},
+        )
+        # Remove classifications containing modified taxa. They are fetched
+        # again when used.
+        invalid_list = []
+        for aphia_id, classification in db_cache.iter_data("classification"):
+            current_node = classification
+            while current_node:
+                if str(current_node.get("AphiaID", "")) in modified_dict:
+                    invalid_list.append(aphia_id)
+                    break
+                current_node = current_node.get("child", None)
+        invalid_list.extend(
+            [aphia_id for aphia_id in modified_dict if aphia_id not in invalid_list]
+        )
+        db_cache.invalidate("classification", invalid_list)
+        print("Classifications to update: ", len(invalid_list))
+        return True
+
+    def get_checkpoint_path(self):
+        """ """
+        return pathlib.Path(self.data_out_dir, "checkpoint.json")
+
+    def get_input_hash(self):
+        """Used to check that a checkpoint belongs to the same indata."""
+        aphia_ids = "\n".join(sorted(str(aphia_id) for aphia_id in self.new_aphia_id_list))
+        return hashlib.sha1(aphia_ids.encode("utf-8")).hexdigest()
+
+    def save_checkpoint(self, completed_stage=None):
+        """Saves the progress, atomically, to data_out/checkpoint.json."""
+        if completed_stage and (completed_stage not in self.completed_stages):
+            self.completed_stages.append(completed_stage)
+        # Cached results are needed when resuming.
+        self.worms_client.flush()
+        checkpoint = {
+            "input_hash": self.get_input_hash(),
+            "completed_stages": self.completed_stages,
+            "checked_aphia_ids": sorted(self.checked_aphia_ids),
+            "taxa_worms": [taxon.to_dict() for taxon in self.taxa_worms_dict.values()],
+            "higher_taxa": [taxon.to_dict() for taxon in self.higher_taxa_dict.values()],
+            "errors": self.errors_list,
+            "translate_to_worms": self.translate_to_worms_list,
+        }
+        with atomic_write(self.get_checkpoint_path(), encoding="utf-8") as out_file:
+            json.dump(checkpoint, out_file)
 
-        self.add_classification()
+    def load_checkpoint(self):
+        """ """
+        checkpoint_path = self.get_checkpoint_path()
+        if not checkpoint_path.exists():
+            print("No checkpoint found, starting from the beginning.")
+            return
+        with checkpoint_path.open("r", encoding="utf-8") as in_file:
+            checkpoint = json.load(in_file)
+        if checkpoint.get("input_hash", "") != self.get_input_hash():
+            print("Checkpoint is for another list of taxa, starting from the beginning.")
+            return
+        self.completed_stages = checkpoint.get("completed_stages", [])
+        self.checked_aphia_ids = set(checkpoint.get("checked_aphia_ids", []))
+        self.taxa_worms_dict = {}
+        for taxon_dict in checkpoint.get("taxa_worms", []):
+            taxon = worms_taxon.Taxon.from_dict(taxon_dict)
+            self.taxa_worms_dict[taxon.aphia_id] = taxon
+        self.higher_taxa_dict = {}
+        for taxon_dict in checkpoint.get("higher_taxa", []):
+            taxon = worms_taxon.Taxon.from_dict(taxon_dict)
+            self.higher_taxa_dict[taxon.aphia_id] = taxon
+        self.errors_list = checkpoint.get("errors", [])
+        self.translate_to_worms_list = checkpoint.get("translate_to_worms", [])
+        print(
+            "Resuming from checkpoint. Completed stages: ",
+            ", ".join(self.completed_stages),
+            " Checked taxa: ",
+            len(self.checked_aphia_ids),
+        )
+
+    def remove_checkpoint(self):
+        """ """
+        checkpoint_path = self.get_checkpoint_path()
+        if checkpoint_path.exists():
+            checkpoint_path.unlink()
+
+    def get_executor(self):
+        """Worker pool shared by all steps calling WoRMS."""
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers
+            )
+        return self.executor
 
-        self.save_results()
+    def shutdown_executor(self):
+        """ """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
 
-        print("\nDone... Woho YES success")
+    def fetch_classification(self, aphia_id):
+        """Fetches classification. Called from the worker pool."""
+        try:
+            return self.worms_client.get_classification_by_aphiaid(aphia_id)
+        except Exception as e:
+            return ({}, "AphiaID: " + str(aphia_id) + "  Exception: " + str(e))
 
     def read_indata_files(self):
         """
-        Imports list containing aphia_id.
+        Imports lists containing aphia_id and scientific names.
         """
         self.import_taxa_by_aphia_id()
+        self.import_taxa_by_name()
 
     def prepare_list_of_taxa(self):
         """Prepares a list of all aphia ids to import."""
@@ -128,29 +474,89 @@ class TaxaListGenerator:
             print("Load AphiaID: ", aphia_id)
             self.new_aphia_id_list.append(str(aphia_id))
 
+        # Check scientific name indata list.
+        if self.indata_name_list:
+            self.match_names()
+
+    def match_names(self):
+        """Adds AphiaIDs for taxa in the scientific name indata list.
+        Names not found, or with more than one match, are added to errors."""
+        name_matcher = worms_name_matcher.NameMatcher(self.worms_client)
+        records_dict, errors_dict = name_matcher.match_names(
+            self.indata_name_list, executor=self.get_executor()
+        )
+        aphia_id_set = set(self.new_aphia_id_list)
+        for scientific_name in self.indata_name_list:
+            if scientific_name in errors_dict:
+                self.errors_list.append([scientific_name, "", errors_dict[scientific_name]])
+                continue
+            aphia_id = str(records_dict[scientific_name].get("AphiaID", ""))
+            print("Load scientific name: ", scientific_name, " (", aphia_id, ")")
+            if aphia_id not in aphia_id_set:
+                aphia_id_set.add(aphia_id)
+                self.new_aphia_id_list.append(aphia_id)
+        statistics = name_matcher.get_statistics()
+        print(
+            "\nNames matched locally: ",
+            statistics["names_matched_locally"],
+            " in WoRMS: ",
+            statistics["names_matched_in_worms"],
+        )
+
     def check_taxa_in_worms(self):
         """ """
         # Iterate over taxa.
         number_of_taxa = len(self.new_aphia_id_list)
-        for index, aphia_id in enumerate(sorted(self.new_aphia_id_list)):
+        # Taxa checked in an earlier, interrupted, run are skipped.
+        todo_list = [
+            aphia_id
+            for aphia_id in sorted(self.new_aphia_id_list)
+            if aphia_id not in self.checked_aphia_ids
+        ]
+        first_index = number_of_taxa - len(todo_list)
+        self.classification_resolver = (
+            worms_classification_resolver.ClassificationResolver(
+                self.worms_client, self.higher_taxa_dict
+            )
+        )
+        for chunk_start in range(0, len(todo_list), self.checkpoint_interval):
+            chunk = todo_list[chunk_start : chunk_start + self.checkpoint_interval]
+            self.check_taxa_chunk(chunk, first_index + chunk_start, number_of_taxa)
+            self.checked_aphia_ids.update(chunk)
+            self.save_checkpoint()
+        statistics = self.classification_resolver.get_statistics()
+        print(
+            "\nClassification calls made: ",
+            statistics["classification_calls_made"],
+            " avoided: ",
+            statistics["classification_calls_avoided"],
+            " cached: ",
+            statistics["classification_cache_hits"],
+        )
+
+    def check_taxa_chunk(self, aphia_id_list, first_index, number_of_taxa):
+        """ """
+        # Fetch records in batches and classifications in parallel.
+        # Results are merged in the same order as requested.
+        records_dict, errors_dict = self.worms_client.get_records_by_aphiaids(
+            aphia_id_list, executor=self.get_executor()
+        )
+        # Classifications are only fetched for new lineages.
+        found_records = [
+            records_dict[aphia_id] for aphia_id in aphia_id_list if aphia_id in records_dict
+        ]
+        classification_dict = self.classification_resolver.prefetch(
+            found_records, executor=self.get_executor()
+        )
+        for index, aphia_id in enumerate(aphia_id_list, first_index):
             try:
-                worms_rec, error = self.worms_client.get_record_by_aphiaid(aphia_id)
-                if error:
+                if aphia_id not in records_dict:
+                    error = errors_dict.get(aphia_id, "AphiaID: " + str(aphia_id))
                     self.errors_list.append(["", aphia_id, error])
                 else:
-                    # Replace 'None' by space.
-                    for key in worms_rec.keys():
-                        if worms_rec[key] in ["None", None]:
-                            worms_rec[key] = ""
-                    # Translate keys from WoRMS.
-                    for from_key, to_key in self.rename_worms_header_items.items():
-                        worms_rec[to_key] = worms_rec.get(from_key, "")
-                    #
-                    aphia_id = worms_rec.get("AphiaID", "")
-                    scientific_name = worms_rec.get("scientificname", "")
-                    valid_aphia_id = worms_rec.get("valid_AphiaID", "")
-                    valid_name = worms_rec.get("valid_name", "")
-                    lsid = worms_rec.get("lsid", "") # MH adderar LSID
+                    worms_rec = records_dict[aphia_id]
+                    taxon = worms_taxon.normalise_worms_record(worms_rec)
+                    aphia_id = taxon.aphia_id
 
                     print(
                         "Processing",
@@ -158,123 +564,93 @@ class TaxaListGenerator:
                         "(",
                         number_of_taxa,
                         "): ",
-                        scientific_name,
+                        taxon.scientific_name,
                     )
 
-                    self.taxa_worms_dict[aphia_id] = worms_rec
-                    # Create classification dictionary.
-                    (
-                        worms_rec,
-                        error,
-                    ) = self.worms_client.get_classification_by_aphiaid(aphia_id)
-                    if error:
-                        self.errors_list.append(["", aphia_id, error])
-
-                    # Replace 'None' by space.
-                    for key in worms_rec.keys():
-                        if worms_rec[key] in ["None", None]:
-                            worms_rec[key] = ""
-                    # Translate keys from WoRMS.
-                    for from_key, to_key in self.rename_worms_header_items.items():
-                        worms_rec[to_key] = worms_rec.get(from_key, "")
-                    #
-                    aphia_id = None
-                    rank = None
-                    scientific_name = None
-                    current_node = worms_rec
-                    while current_node not in [None, ""]:
-                        parent_id = aphia_id
-                        #                             parent_rank = rank
-                        parent_name = scientific_name
-                        aphia_id = current_node.get("AphiaID", "")
-                        rank = current_node.get("rank", "")
-                        scientific_name = current_node.get("scientificname", "")
-                        lsid = current_node.get("lsid", "") # MH adderar LSID
-                        if aphia_id and rank and scientific_name:
-                            taxa_dict = {}
-                            taxa_dict["aphia_id"] = aphia_id
-                            taxa_dict["rank"] = rank
-                            taxa_dict["scientific_name"] = scientific_name
-                            taxa_dict["parent_id"] = parent_id
-                            taxa_dict["parent_name"] = parent_name
-                            taxa_dict["lsid"] = lsid # MH adderar LSID
-                            # Replace 'None' by space.
-                            for key in taxa_dict.keys():
-                                if taxa_dict[key] in ["None", None]:
-                                    taxa_dict[key] = ""
-                            if aphia_id not in self.higher_taxa_dict:
-                                self.higher_taxa_dict[aphia_id] = taxa_dict
-                            current_node = current_node.get("child", None)
-                        else:
-                            current_node = None
+                    self.taxa_worms_dict[aphia_id] = taxon
+                    # Add to classification dictionary. The resolver uses
+                    # fields from the WoRMS record that are not in the Taxon.
+                    resolver = self.classification_resolver
+                    classification_error = resolver.add_to_higher_taxa(
+                        worms_rec, classification_dict
+                    )
+                    if classification_error:
+                        self.errors_list.append(["", aphia_id, classification_error])
             except Exception as e:
                 print("Exception in check_taxa_in_worms: ", e)
 
+    def add_valid_taxa(self):
+        """Adds valid taxa for unaccepted taxa in the list, and creates rows
+        for translate_to_worms.txt. Chains of unaccepted taxa are followed
+        to the end."""
+        synonym_resolver = worms_synonym_resolver.SynonymResolver(self.worms_client)
+        for taxon in self.taxa_worms_dict.values():
+            synonym_resolver.add_taxon(taxon)
+        valid_aphia_ids = synonym_resolver.resolve(executor=self.get_executor())
+        used_aphia_ids = {str(aphia_id) for aphia_id in self.taxa_worms_dict}
+        aphia_id_list = [
+            aphia_id for aphia_id in valid_aphia_ids if aphia_id not in used_aphia_ids
+        ]
+        print("\nValid taxa added for unaccepted taxa: ", len(aphia_id_list))
+        if self.classification_resolver is None:
+            self.classification_resolver = (
+                worms_classification_resolver.ClassificationResolver(
+                    self.worms_client, self.higher_taxa_dict
+                )
+            )
+        self.check_taxa_chunk(aphia_id_list, 0, len(aphia_id_list))
+        self.translate_to_worms_list, errors = synonym_resolver.get_translate_rows()
+        self.errors_list.extend(errors)
+
     def add_higher_taxa(self):
         """Add higher taxa to WoRMS dictionary."""
-        for aphia_id, worms_dict in self.higher_taxa_dict.items():
-            scientific_name = worms_dict.get("scientific_name", "")
+        aphia_id_list = [
+            aphia_id
+            for aphia_id in self.higher_taxa_dict.keys()
+            if aphia_id not in self.taxa_worms_dict
+        ]
+        records_dict, errors_dict = self.worms_client.get_records_by_aphiaids(
+            aphia_id_list, executor=self.get_executor()
+        )
+        for aphia_id in aphia_id_list:
+            error = errors_dict.get(aphia_id, "")
+            scientific_name = self.higher_taxa_dict[aphia_id].scientific_name
             if aphia_id not in self.taxa_worms_dict:
 
                 print(
                     "- Processing higher taxa: ", scientific_name, " (", aphia_id, ")"
                 )
 
-                worms_rec, error = self.worms_client.get_record_by_aphiaid(aphia_id)
                 if error:
                     self.errors_list.append(["", aphia_id, error])
-                # Replace 'None' by space.
-                for key in worms_rec.keys():
-                    if worms_rec[key] in ["None", None]:
-                        worms_rec[key] = ""
-                # Translate keys from WoRMS.
-                for from_key, to_key in self.rename_worms_header_items.items():
-                    worms_rec[to_key] = worms_rec.get(from_key, "")
-                #
-                self.taxa_worms_dict[aphia_id] = worms_rec
-
-    def add_parent_info(self):
-        """Add parent info to built classification hierarchies."""
-        for taxa_dict in self.taxa_worms_dict.values():
-            aphia_id = taxa_dict.get("AphiaID", "")
-            higher_taxa_dict = self.higher_taxa_dict.get(aphia_id, None)
-            if higher_taxa_dict:
-                taxa_dict["parent_id"] = higher_taxa_dict.get("parent_id", "")
-                taxa_dict["parent_name"] = higher_taxa_dict.get("parent_name", "")
-
+                taxon = worms_taxon.normalise_worms_record(records_dict.get(aphia_id, {}))
+                if not taxon.aphia_id:
+                    taxon.aphia_id = aphia_id
+                self.taxa_worms_dict[aphia_id] = taxon
 
     def add_classification(self):
-        """Add classification."""
-        for aphia_id in list(self.taxa_worms_dict.keys()):
-            classification_list = []
-            taxon_dict = self.taxa_worms_dict[aphia_id]
-            name = taxon_dict["scientific_name"]
-            level_counter = 0  # To avoid recursive endless loops.
-            while len(name) > 0:
-                if level_counter > 20:
-                    print(
-                        "Warning: Too many levels in classification for: "
-                        + scientific_name
-                    )
-                    break
-                level_counter += 1
-                classification_list.append(
-                    "["
-                    + taxon_dict.get("rank", "")
-                    + "] "
-                    + taxon_dict.get("scientific_name", "")
-                )
-                # Parents.
-                parent_id = taxon_dict.get("parent_id", "")
-                taxon_dict = self.taxa_worms_dict.get(parent_id, None)
-                if taxon_dict:
-                    name = taxon_dict.get("scientific_name", "")
-                else:
-                    name = ""
-            # Add classification string.
-            self.taxa_worms_dict[aphia_id]["classification"] = " - ".join(
-                classification_list[::-1]
+        """Add parent info, classification and rank columns.
+        Calculated in one pass over a taxonomy tree built from higher_taxa_dict."""
+        tree = worms_taxonomy_tree.TaxonomyTree()
+        for aphia_id, taxon in self.taxa_worms_dict.items():
+            higher_taxon = self.higher_taxa_dict.get(aphia_id, None)
+            tree.add_node(
+                aphia_id,
+                taxon.rank,
+                taxon.scientific_name,
+                higher_taxon.parent_id if higher_taxon else "",
             )
+        tree.build()
+        for aphia_id, taxon in self.taxa_worms_dict.items():
+            higher_taxon = self.higher_taxa_dict.get(aphia_id, None)
+            if higher_taxon:
+                taxon.parent_id = higher_taxon.parent_id
+                taxon.parent_name = higher_taxon.parent_name
+            taxon.classification = tree.get_classification(aphia_id)
+            # Use ranks from the classification, values from WoRMS if missing.
+            for column, name in tree.get_rank_columns(aphia_id).items():
+                if name:
+                    taxon[column] = name
 
     def save_results(self):
         """Save the results"""
@@ -285,6 +661,7 @@ class TaxaListGenerator:
         #
         self.save_errors()
         self.save_taxa_worms()
+        self.save_translate_to_worms()
 
     def import_taxa_by_aphia_id(self):
         """ """
@@ -309,35 +686,55 @@ class TaxaListGenerator:
                                     self.indata_aphia_id_list.append(aphia_id)
             print("")
 
+    def import_taxa_by_name(self):
+        """ """
+        indata_name = pathlib.Path(self.data_in_dir, "indata_taxa_by_name.txt")
+        if indata_name.exists():
+            print("Importing file: ", indata_name)
+            name_set = set(self.indata_name_list)
+            with indata_name.open("r", encoding="cp1252", errors="ignore") as indata_file:
+                header = None
+                for row in indata_file:
+                    row = [item.strip() for item in row.strip().split("\t")]
+                    if row:
+                        if header is None:
+                            header = row
+                        else:
+                            row_dict = dict(zip(header, row))
+                            scientific_name = row_dict.get("scientific_name", "")
+                            if scientific_name:
+                                # Avoid duplicates.
+                                if scientific_name not in name_set:
+                                    name_set.add(scientific_name)
+                                    self.indata_name_list.append(scientific_name)
+            print("")
+
     def save_taxa_worms(self):
+        """Writes the taxa table in the formats in self.output_formats."""
+        with self.create_taxa_writer() as taxa_writer:
+            for taxon in self.taxa_worms_dict.values():
+                taxa_writer.write_taxon(taxon)
+
+    def create_taxa_writer(self):
         """ """
-        taxa_worms_file = pathlib.Path(self.data_out_dir, "taxa_worms.txt")
-        with taxa_worms_file.open(
-            "w", encoding="cp1252", errors="ignore"
-        ) as outdata_file:
-            outdata_file.write("\t".join(self.taxa_worms_header) + "\n")
-            for taxa_dict in self.taxa_worms_dict.values():
-                row = []
-                for header_item in self.taxa_worms_header:
-                    row.append(str(taxa_dict.get(header_item, "")))
-                try:
-                    outdata_file.write("\t".join(row) + "\n")
-                except Exception as e:
-                    try:
-                        print(
-                            "Exception when writing to taxa_worms.txt: ",
-                            row[0],
-                            "   ",
-                            e,
-                        )
-                    except:
-                        pass
+        return worms_output_writers.create_taxa_writer(
+            self.data_out_dir, self.taxa_worms_header, self.output_formats
+        )
+
+    def save_translate_to_worms(self):
+        """ """
+        header = worms_synonym_resolver.SynonymResolver.translate_to_worms_header
+        translate_file = pathlib.Path(self.data_out_dir, "translate_to_worms.txt")
+        with atomic_write(translate_file) as outdata_file:
+            outdata_file.write("\t".join(header) + "\n")
+            for row in self.translate_to_worms_list:
+                outdata_file.write("\t".join(row) + "\n")
 
     def save_errors(self):
         """ """
         header = ["scientific_name", "aphia_id", "error"]
         errors_file = pathlib.Path(self.data_out_dir, "errors.txt")
-        with errors_file.open("w", encoding="cp1252", errors="ignore") as outdata_file:
+        with atomic_write(errors_file) as outdata_file:
             outdata_file.write("\t".join(header) + "\n")
             for row in self.errors_list:
                 try:
@@ -352,3 +749,23 @@ class TaxaListGenerator:
                         )
                     except:
                         pass
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, encoding="cp1252", errors="ignore"):
+    """Writes to a temporary file that replaces file_path when closed without
+    errors. Readers will never see a partly written file."""
+    file_path = pathlib.Path(file_path)
+    if not file_path.parent.exists():
+        file_path.parent.mkdir(parents=True)
+    # Unique for each process, for concurrent runs in the same directory.
+    tmp_path = file_path.with_name(file_path.name + "." + str(os.getpid()) + ".tmp")
+    try:
+        with tmp_path.open("w", encoding=encoding, errors=errors) as out_file:
+            yield out_file
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
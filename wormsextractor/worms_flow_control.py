@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+import email.utils
+import random
+import threading
+import time
+
+# Responses that may work if the request is sent again.
+transient_status_codes = (429, 500, 502, 503, 504)
+# Responses telling that WoRMS is overloaded and that we should slow down.
+throttle_status_codes = (429, 503)
+
+
+class CircuitOpenError(Exception):
+    """Raised when WoRMS has been unavailable for too long."""
+
+
+def is_transient_error(error):
+    """True for errors from get_json() that may work later, for example network
+    errors or "Response code: 503". These should not be cached."""
+    if error.startswith("Exception:") or ("  Exception:" in error):
+        return True
+    for status in transient_status_codes:
+        if error.endswith("Response code: " + str(status)):
+            return True
+    return False
+
+
+def parse_retry_after(value):
+    """Returns seconds from a Retry-After header, or None. The value can be
+    seconds or a HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter. A Retry-After value from the
+    server is used if it is longer."""
+
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=60.0):
+        """
+        max_retries: Number of retries after the first request.
+        base_delay, max_delay: Min and max of the backoff range, in seconds.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt, retry_after=None):
+        """attempt: 0 for the first retry."""
+        backoff = min(self.max_delay, self.base_delay * (2**attempt))
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay * 5))
+        return delay
+
+
+class AdaptiveRateController:
+    """
+    Thread safe limits for concurrency and requests per second, adjusted with
+    AIMD (additive increase, multiplicative decrease).
+
+    Limits are slowly increased while requests succeed and halved when WoRMS
+    answers 429 or 503. The limits will then stay close to the highest
+    throughput WoRMS accepts.
+
+    Usage:
+        with controller.request_slot():
+            response = ...
+        controller.on_success() or controller.on_throttle()
+    """
+
+    def __init__(
+        self,
+        max_requests_per_second=None,
+        max_concurrency=10,
+        min_requests_per_second=0.5,
+        increase_per_second=1.0,
+    ):
+        """
+        max_requests_per_second: Upper limit. None: No limit until throttled.
+        max_concurrency: Upper limit for parallel requests.
+        min_requests_per_second: Lower limit when throttled.
+        increase_per_second: Requests per second added for each second of
+            successful requests.
+        """
+        self.max_requests_per_second = max_requests_per_second
+        self.max_concurrency = max_concurrency
+        self.min_requests_per_second = min_requests_per_second
+        self.increase_per_second = increase_per_second
+        # Current limits.
+        self.requests_per_second = max_requests_per_second
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.next_time = 0.0
+        # Start times of recent requests, used to measure the current rate.
+        self.recent_starts = []
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def request_slot(self):
+        """Waits for a free slot and for the next allowed start time."""
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+            delay = 0.0
+            now = time.monotonic()
+            if self.requests_per_second:
+                start_time = max(now, self.next_time)
+                self.next_time = start_time + 1.0 / self.requests_per_second
+                delay = start_time - now
+            self.recent_starts.append(now + delay)
+            if len(self.recent_starts) > 50:
+                del self.recent_starts[0]
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def on_success(self):
+        """Additive increase."""
+        with self.condition:
+            self.successes += 1
+            if self.requests_per_second:
+                self.requests_per_second += (
+                    self.increase_per_second / self.requests_per_second
+                )
+                if self.max_requests_per_second:
+                    self.requests_per_second = min(
+                        self.requests_per_second, self.max_requests_per_second
+                    )
+            if self.successes >= self.concurrency:
+                self.successes = 0
+                if self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self.condition.notify()
+
+    def on_throttle(self):
+        """Multiplicative decrease."""
+        with self.condition:
+            self.successes = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            current_rate = self.requests_per_second or self.get_measured_rate()
+            self.requests_per_second = max(
+                self.min_requests_per_second, current_rate / 2.0
+            )
+
+    def get_measured_rate(self):
+        """Requests per second for the recent requests."""
+        if len(self.recent_starts) < 2:
+            return self.min_requests_per_second * 2
+        duration = self.recent_starts[-1] - self.recent_starts[0]
+        if duration <= 0:
+            return float(len(self.recent_starts))
+        return (len(self.recent_starts) - 1) / duration
+
+    def get_status(self):
+        """ """
+        with self.condition:
+            return {
+                "requests_per_second": self.requests_per_second,
+                "concurrency": self.concurrency,
+            }
+
+
+class CircuitBreaker:
+    """
+    Stops all requests when WoRMS seems to be down.
+
+    After failure_threshold failures in a row the circuit is opened, and
+    threads asking for a request wait until reset_timeout has passed. Then
+    one request is sent as a test. If it succeeds the circuit is closed, else
+    it is opened again with a doubled timeout. CircuitOpenError is raised if
+    WoRMS has been down for longer than max_outage seconds.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=5,
+        reset_timeout=10.0,
+        max_reset_timeout=120.0,
+        max_outage=900.0,
+    ):
+        """ """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.max_outage = max_outage
+        self.failures = 0
+        self.state = "closed"  # closed, open or half_open.
+        self.open_until = 0.0
+        self.outage_start = None
+        self.current_timeout = reset_timeout
+        self.condition = threading.Condition()
+
+    def before_request(self):
+        """Blocks while the circuit is open. Raises CircuitOpenError if WoRMS
+        has been down for more than max_outage seconds. Only the caller is
+        failed, test requests are still sent when the timeout has passed."""
+        with self.condition:
+            while True:
+                if self.state == "closed":
+                    return
+                now = time.monotonic()
+                if (self.state == "open") and (now >= self.open_until):
+                    # This thread sends the test request.
+                    self.state = "half_open"
+                    return
+                if (self.outage_start is not None) and (
+                    now - self.outage_start > self.max_outage
+                ):
+                    raise CircuitOpenError(
+                        "WoRMS unavailable for "
+                        + str(int(now - self.outage_start))
+                        + " s, circuit open."
+                    )
+                if self.state == "open":
+                    self.condition.wait(timeout=self.open_until - now)
+                else:
+                    # Wait for the test request.
+                    self.condition.wait(timeout=1.0)
+
+    def record_success(self):
+        """ """
+        with self.condition:
+            if self.state != "closed":
+                print("WoRMS available again.")
+            self.failures = 0
+            self.state = "closed"
+            self.outage_start = None
+            self.current_timeout = self.reset_timeout
+            self.condition.notify_all()
+
+    def record_throttle(self, retry_after=None):
+        """WoRMS answered 429. This is not counted as a failure, but if it was
+        the test request the circuit is opened again, without a longer timeout,
+        so that another test request can be sent."""
+        with self.condition:
+            if self.state != "half_open":
+                return
+            if retry_after is None:
+                retry_after = self.current_timeout
+            self.state = "open"
+            self.open_until = time.monotonic() + retry_after
+            self.condition.notify_all()
+
+    def record_failure(self):
+        """ """
+        with self.condition:
+            self.failures += 1
+            if self.state == "open":
+                return
+            if (self.state == "half_open") or (self.failures >= self.failure_threshold):
+                if self.state == "half_open":
+                    self.current_timeout = min(
+                        self.max_reset_timeout, self.current_timeout * 2
+                    )
+                if self.outage_start is None:
+                    self.outage_start = time.monotonic()
+                print(
+                    "WoRMS not available, pausing requests for ",
+                    round(self.current_timeout),
+                    " s.",
+                )
+                self.state = "open"
+                self.open_until = time.monotonic() + self.current_timeout
+                self.condition.notify_all()
+
+
+class InFlightCall:
+    """One request in SingleFlight. Other threads wait for the result."""
+
+    def __init__(self):
+        """ """
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+    def wait(self):
+        """Blocks until the request is done. Returns the shared result."""
+        self.event.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class SingleFlight:
+    """
+    Registry of in-flight requests, used to coalesce duplicate requests.
+
+    The first thread asking for a key does the request. Threads asking for
+    the same key while the request is running wait and get the same result,
+    without sending another request or writing to the cache again.
+
+    Usage:
+        result = single_flight.do(("worms_records", aphia_id), fetch_function)
+    or, for batches:
+        owned_keys, waiting_dict = single_flight.claim(keys)
+        ... fetch owned_keys, then single_flight.complete(key, result) for each.
+        ... call.wait() for each call in waiting_dict.
+    """
+
+    def __init__(self):
+        """ """
+        self.calls = {}  # Key: Request key. Value: InFlightCall.
+        self.lock = threading.Lock()
+        # Statistics.
+        self.shared_results = 0
+
+    def claim(self, keys):
+        """Returns (owned_keys, waiting_dict). The caller must call complete()
+        for all owned keys. waiting_dict contains calls already running in
+        other threads. Key: Request key. Value: InFlightCall."""
+        owned_keys = []
+        waiting_dict = {}
+        with self.lock:
+            for key in keys:
+                call = self.calls.get(key, None)
+                if call is None:
+                    self.calls[key] = InFlightCall()
+                    owned_keys.append(key)
+                elif key not in waiting_dict:
+                    waiting_dict[key] = call
+                    self.shared_results += 1
+        return (owned_keys, waiting_dict)
+
+    def complete(self, key, result=None, exception=None):
+        """Releases waiting threads. Does nothing if the key is not in flight."""
+        with self.lock:
+            call = self.calls.pop(key, None)
+        if call is not None:
+            call.result = result
+            call.exception = exception
+            call.event.set()
+
+    def do(self, key, function):
+        """Calls function() once for all threads asking for key at the same time."""
+        owned_keys, waiting_dict = self.claim([key])
+        if not owned_keys:
+            return waiting_dict[key].wait()
+        try:
+            result = function()
+        except Exception as e:
+            self.complete(key, exception=e)
+            raise
+        self.complete(key, result)
+        return result
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import gzip
+import http.client
+import queue
+import threading
+import urllib.parse
+
+
+class HttpConnectionPool:
+    """
+    Thread safe pool of persistent (keep-alive) HTTP/HTTPS connections to one host.
+
+    Example:
+        pool = HttpConnectionPool("https://www.marinespecies.org", pool_size=10)
+        status, body, headers = pool.get("/rest/AphiaRecordByAphiaID/1080")
+    """
+
+    def __init__(
+        self,
+        base_url="https://www.marinespecies.org",
+        pool_size=10,
+        connect_timeout=10,
+        read_timeout=60,
+    ):
+        """
+        pool_size: Max number of open connections. Threads asking for more
+            connections are waiting until one is released.
+        connect_timeout: Timeout in seconds when opening a connection.
+        read_timeout: Timeout in seconds when waiting for response data.
+        """
+        parts = urllib.parse.urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_connections = queue.LifoQueue()
+        self.connection_semaphore = threading.BoundedSemaphore(pool_size)
+        self.headers = {
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+
+    def get(self, path):
+        """HTTP GET. Returns (status, body, headers). The body is decoded if gzipped."""
+        with self.connection_semaphore:
+            conn, reused = self.get_connection()
+            try:
+                try:
+                    response = self.send_request(conn, path)
+                except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    # The server may have closed an idle keep-alive connection.
+                    conn.close()
+                    if not reused:
+                        raise
+                    conn = self.new_connection()
+                    response = self.send_request(conn, path)
+                body = response.read()
+                status = response.status
+                headers = {key.lower(): value for key, value in response.getheaders()}
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.idle_connections.put(conn)
+        return (status, self.decode_body(body, headers), headers)
+
+    def get_connection(self):
+        """Returns (connection, reused)."""
+        try:
+            return (self.idle_connections.get_nowait(), True)
+        except queue.Empty:
+            return (self.new_connection(), False)
+
+    def new_connection(self):
+        """ """
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout
+            )
+        else:
+            conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.connect_timeout
+            )
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def send_request(self, conn, path):
+        """ """
+        if conn.sock is None:
+            # Closed by http.client, for example after "Connection: close".
+            conn.connect()
+            conn.sock.settimeout(self.read_timeout)
+        conn.request("GET", path, headers=self.headers)
+        return conn.getresponse()
+
+    def decode_body(self, body, headers):
+        """ """
+        encoding = headers.get("content-encoding", "").lower()
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        return body
+
+    def close(self):
+        """Closes all idle connections."""
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import concurrent.futures
+import http.server
+import json
+import threading
+import urllib.parse
+
+from wormsextractor import worms_classification_resolver
+from wormsextractor import worms_flow_control
+from wormsextractor import worms_memory_cache
+from wormsextractor import worms_name_matcher
+from wormsextractor import worms_rest_client
+from wormsextractor import worms_taxon
+from wormsextractor import worms_taxonomy_tree
+
+
+class TaxonLookupService:
+    """
+    Looks up taxa, with parent, classification and rank columns, for other
+    jobs. Runs as a long-running process so that all jobs can share one warm
+    cache, see create_server().
+
+    Finished taxa are kept in memory. Taxa not there are read from the
+    WoRMS cache, and WoRMS is only called for taxa missing in the cache.
+    Higher taxa found are kept, so most classifications can be derived from
+    the parent without calling WoRMS.
+
+    Usage:
+        service = TaxonLookupService(worms_client)
+        results = service.lookup_aphia_ids(["104251", "104108"])
+    """
+
+    # Max number of AphiaIDs or names in one request.
+    max_batch_size = 10000
+
+    def __init__(
+        self, worms_client, max_workers=8, memory_cache_size=100000, max_age=3600
+    ):
+        """
+        worms_client: WormsRestClient or OfflineWormsClient.
+        max_workers: Number of parallel workers used when fetching from WoRMS.
+        memory_cache_size: Max number of finished taxa kept in memory.
+        max_age: Max age in seconds for finished taxa in memory. Older taxa
+            are read again from the WoRMS cache, where the TTL is used.
+        """
+        self.worms_client = worms_client
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.taxa_cache = worms_memory_cache.LruCache(
+            memory_cache_size, max_age=max_age
+        )
+        # Used when higher taxa and the tree are changed. Not held during
+        # calls to WoRMS.
+        self.lock = threading.Lock()
+        # Used for the name index, so that name matching does not block
+        # lookups on AphiaID.
+        self.name_lock = threading.Lock()
+        self.higher_taxa_dict = {}  # Key: aphia_id. Value: Taxon.
+        self.classification_resolver = (
+            worms_classification_resolver.ClassificationResolver(
+                self.worms_client, self.higher_taxa_dict, lock=self.lock
+            )
+        )
+        self.taxonomy_tree = worms_taxonomy_tree.TaxonomyTree()
+        self.name_matcher = worms_name_matcher.NameMatcher(self.worms_client)
+
+    def close(self):
+        """ """
+        self.executor.shutdown(wait=True)
+        self.worms_client.close()
+
+    def lookup_aphia_ids(self, aphia_id_list):
+        """Returns a list with one dict for each AphiaID, in the same order.
+        Keys: aphia_id, taxon (dict with the taxa_worms.txt columns or None)
+        and error. Invalid AphiaIDs get an error and are not sent to WoRMS."""
+        aphia_id_list = [str(aphia_id).strip() for aphia_id in aphia_id_list]
+        results_dict = {}
+        missing_list = []
+        for aphia_id in dict.fromkeys(aphia_id_list):
+            if not worms_rest_client.is_valid_aphia_id(aphia_id):
+                results_dict[aphia_id] = {
+                    "aphia_id": aphia_id,
+                    "taxon": None,
+                    "error": "AphiaID: " + aphia_id + "  Invalid AphiaID",
+                }
+                continue
+            result = self.taxa_cache.get(aphia_id)
+            if result is None:
+                missing_list.append(aphia_id)
+            else:
+                results_dict[aphia_id] = result
+        if missing_list:
+            results_dict.update(self.fetch_taxa(missing_list))
+        return [results_dict[aphia_id] for aphia_id in aphia_id_list]
+
+    def lookup_names(self, scientific_name_list):
+        """Returns a list with one dict for each name, in the same order.
+        Keys: scientific_name, aphia_id, taxon and error."""
+        scientific_name_list = [str(name).strip() for name in scientific_name_list]
+        with self.name_lock:
+            records_dict, errors_dict = self.name_matcher.match_names(
+                scientific_name_list, executor=self.executor
+            )
+        aphia_id_dict = {
+            scientific_name: str(worms_rec.get("AphiaID", ""))
+            for scientific_name, worms_rec in records_dict.items()
+        }
+        aphia_id_list = list(dict.fromkeys(aphia_id_dict.values()))
+        taxa_results = self.lookup_aphia_ids(aphia_id_list)
+        taxa_dict = {result["aphia_id"]: result for result in taxa_results}
+        results = []
+        for scientific_name in scientific_name_list:
+            aphia_id = aphia_id_dict.get(scientific_name, "")
+            if aphia_id:
+                result = dict(taxa_dict[aphia_id])
+            else:
+                error = errors_dict.get(
+                    scientific_name,
+                    "Scientific name: " + scientific_name + "  Response code: 204",
+                )
+                result = {"aphia_id": "", "taxon": None, "error": error}
+            result["scientific_name"] = scientific_name
+            results.append(result)
+        return results
+
+    def fetch_taxa(self, aphia_id_list):
+        """Fetches records and classifications. Returns a dict with results.
+        Key: aphia_id."""
+        records_dict, errors_dict = self.worms_client.get_records_by_aphiaids(
+            aphia_id_list, executor=self.executor
+        )
+        records_list = [
+            records_dict[aphia_id]
+            for aphia_id in aphia_id_list
+            if aphia_id in records_dict
+        ]
+        # Classifications are fetched without the lock, the resolver only
+        # takes it when higher taxa are added.
+        classification_dict = self.classification_resolver.prefetch(
+            records_list, executor=self.executor
+        )
+        classification_errors = {}
+        for worms_rec in records_list:
+            error = self.classification_resolver.add_to_higher_taxa(
+                worms_rec, classification_dict
+            )
+            if error:
+                classification_errors[str(worms_rec.get("AphiaID", ""))] = error
+        results_dict = {}
+        with self.lock:
+            for aphia_id in aphia_id_list:
+                if aphia_id not in records_dict:
+                    error = errors_dict.get(
+                        aphia_id, "AphiaID: " + aphia_id + "  Response code: 204"
+                    )
+                    results_dict[aphia_id] = {
+                        "aphia_id": aphia_id,
+                        "taxon": None,
+                        "error": error,
+                    }
+                    continue
+                taxon = worms_taxon.normalise_worms_record(records_dict[aphia_id])
+                self.add_parent_info(taxon)
+                results_dict[aphia_id] = {
+                    "aphia_id": aphia_id,
+                    "taxon": taxon.to_dict(),
+                    "error": classification_errors.get(aphia_id, ""),
+                }
+        # Transient errors are not kept, they are tried again next time.
+        for aphia_id, result in results_dict.items():
+            if not worms_flow_control.is_transient_error(result["error"]):
+                self.taxa_cache.put(aphia_id, result)
+        return results_dict
+
+    def add_parent_info(self, taxon):
+        """Adds parent, classification and rank columns from the taxonomy tree."""
+        aphia_id = taxon.aphia_id
+        # Add the taxon and its ancestors to the tree.
+        current_id = aphia_id
+        while (current_id in self.higher_taxa_dict) and (
+            current_id not in self.taxonomy_tree
+        ):
+            higher_taxon = self.higher_taxa_dict[current_id]
+            self.taxonomy_tree.add_node(
+                current_id,
+                higher_taxon.rank,
+                higher_taxon.scientific_name,
+                higher_taxon.parent_id,
+            )
+            current_id = higher_taxon.parent_id
+        tree = self.taxonomy_tree
+        if aphia_id not in tree:
+            taxon.classification = "[" + taxon.rank + "] " + taxon.scientific_name
+            return
+        taxon.parent_id = tree.nodes[aphia_id].parent_id
+        taxon.parent_name = tree.get_parent_name(aphia_id)
+        taxon.classification = tree.get_classification(aphia_id)
+        for column, name in tree.get_rank_columns(aphia_id).items():
+            if name:
+                taxon[column] = name
+
+    def get_status(self):
+        """ """
+        status = {
+            "taxa_in_memory": len(self.taxa_cache),
+            "higher_taxa": len(self.higher_taxa_dict),
+        }
+        status.update(self.taxa_cache.get_statistics())
+        status.update(self.classification_resolver.get_statistics())
+        status.update(self.name_matcher.get_statistics())
+        return status
+
+
+class LookupRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP API for TaxonLookupService. All responses are JSON.
+
+        GET  /taxa/<aphia_id>
+        POST /taxa   {"aphia_ids": ["104251", ...]}
+        GET  /names?scientific_name=<name>
+        POST /names  {"scientific_names": ["Acartia tonsa", ...]}
+        GET  /status
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """ """
+        url_parts = urllib.parse.urlsplit(self.path)
+        path = url_parts.path.rstrip("/")
+        service = self.server.lookup_service
+        if path.startswith("/taxa/"):
+            aphia_id = urllib.parse.unquote(path[len("/taxa/") :]).strip()
+            if not worms_rest_client.is_valid_aphia_id(aphia_id):
+                self.send_json(400, {"error": "Invalid AphiaID: " + aphia_id})
+                return
+            self.send_json(200, service.lookup_aphia_ids([aphia_id])[0])
+        elif path == "/names":
+            query = urllib.parse.parse_qs(url_parts.query)
+            names = query.get("scientific_name", [])
+            if not names:
+                self.send_json(400, {"error": "Parameter missing: scientific_name"})
+                return
+            self.send_json(200, service.lookup_names(names[:1])[0])
+        elif path == "/status":
+            self.send_json(200, service.get_status())
+        else:
+            self.send_json(404, {"error": "Not found: " + url_parts.path})
+
+    def do_POST(self):
+        """ """
+        path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+        service = self.server.lookup_service
+        if path == "/taxa":
+            key = "aphia_ids"
+            lookup_function = service.lookup_aphia_ids
+        elif path == "/names":
+            key = "scientific_names"
+            lookup_function = service.lookup_names
+        else:
+            self.send_json(404, {"error": "Not found: " + path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request_data = json.loads(self.rfile.read(length).decode("utf-8"))
+            value_list = request_data[key]
+            if not isinstance(value_list, list):
+                raise ValueError(key + " is not a list")
+        except Exception as e:
+            self.send_json(400, {"error": "Bad request: " + str(e)})
+            return
+        if len(value_list) > service.max_batch_size:
+            self.send_json(
+                413, {"error": "Max batch size: " + str(service.max_batch_size)}
+            )
+            return
+        self.send_json(200, {"results": lookup_function(value_list)})
+
+    def send_json(self, status, data):
+        """ """
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Requests are only logged if the server is verbose."""
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(lookup_service, host="127.0.0.1", port=8765, verbose=False):
+    """Returns a ThreadingHTTPServer. Call serve_forever() to start it."""
+    server = http.server.ThreadingHTTPServer((host, port), LookupRequestHandler)
+    server.daemon_threads = True
+    server.lookup_service = lookup_service
+    server.verbose = verbose
+    return server
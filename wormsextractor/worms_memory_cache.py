@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import collections
+import threading
+import time
+
+
+class LruCache:
+    """
+    Thread safe in-memory cache with a max number of entries. The least
+    recently used entry is removed when the cache is full.
+
+    Used by WormsSqliteCache to keep decoded records in memory, so that
+    taxa used many times are not read from the db and parsed each time.
+    """
+
+    def __init__(self, max_size=20000, max_age=None):
+        """
+        max_size: Max number of entries. 0: Nothing is cached.
+        max_age: Max age in seconds for entries. None: Never expires.
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        # Key: key. Value: (value, time when added).
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Statistics.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        """ """
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Returns the cached value and marks it as recently used."""
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if (entry is not None) and (self.max_age is not None):
+                if (time.monotonic() - entry[1]) >= self.max_age:
+                    del self.entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """ """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key):
+        """ """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """ """
+        with self.lock:
+            self.entries.clear()
+
+    def get_statistics(self):
+        """ """
+        with self.lock:
+            return {
+                "memory_cache_size": len(self.entries),
+                "memory_cache_hits": self.hits,
+                "memory_cache_misses": self.misses,
+                "memory_cache_evictions": self.evictions,
+            }
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import re
+import unicodedata
+
+# Words used between epithets, for example "Fucus vesiculosus f. mytili".
+rank_markers = {"subsp.", "ssp.", "var.", "f.", "forma", "subvar.", "subf."}
+# Lower case words that start an authority, for example "Gymnodinium de Candolle".
+author_particles = {"de", "van", "von", "der", "den", "du", "la", "le", "ex", "in"}
+
+
+def normalise_name(scientific_name):
+    """Returns a key used to compare scientific names. Case, whitespace,
+    diacritics and authority are ignored, and a subgenus is kept.
+    For example "Acartia (Acanthacartia)  tonsa Dana, 1849" ->
+    "acartia (acanthacartia) tonsa"."""
+    name = unicodedata.normalize("NFKD", str(scientific_name))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    if name.isupper():
+        # Epithets and authority can't be separated by case.
+        name = name.capitalize()
+    words = name.replace("×", "x").split()
+    if not words:
+        return ""
+    # The first word is the genus, or a name of higher rank.
+    name_words = [words[0]]
+    for index, word in enumerate(words[1:], 1):
+        if (
+            (index == 1)
+            and re.fullmatch(r"\([A-Za-z]+\)", word)
+            and (len(words) > 2)
+            and words[2][:1].islower()
+        ):
+            # Subgenus.
+            name_words.append(word)
+        elif word.lower() in rank_markers:
+            name_words.append(word)
+        elif (word not in author_particles) and re.fullmatch(r"[a-z][a-z\-]*", word):
+            # Epithet.
+            name_words.append(word)
+        else:
+            # Start of the authority.
+            break
+    return " ".join(name_words).casefold()
+
+
+class NameIndex:
+    """
+    Index of WoRMS records by normalised scientific name. A name can have
+    more than one record, for example for homonyms.
+    """
+
+    def __init__(self):
+        """ """
+        self.records_by_name = {}  # Key: Normalised name. Value: Dict of records.
+
+    def __len__(self):
+        """ """
+        return len(self.records_by_name)
+
+    def add_record(self, worms_rec):
+        """ """
+        name_key = normalise_name(worms_rec.get("scientificname", "") or "")
+        aphia_id = worms_rec.get("AphiaID", "")
+        if name_key and aphia_id:
+            self.records_by_name.setdefault(name_key, {})[str(aphia_id)] = worms_rec
+
+    def get_records(self, scientific_name):
+        """Returns a list of records matching the name."""
+        name_key = normalise_name(scientific_name)
+        return list(self.records_by_name.get(name_key, {}).values())
+
+
+class NameMatcher:
+    """
+    Matches scientific names to WoRMS records.
+
+    Names are first looked up in a local index built from records in the
+    cache. Only names not found there are sent to AphiaRecordsByMatchNames,
+    in batches of 50 names. Matched records are added to the cache, and will
+    be found locally next time.
+
+    Usage:
+        matcher = NameMatcher(worms_client)
+        records_dict, errors_dict = matcher.match_names(name_list, executor)
+    """
+
+    def __init__(self, worms_client):
+        """ """
+        self.worms_client = worms_client
+        self.name_index = None
+        # Statistics.
+        self.local_matches = 0
+        self.remote_matches = 0
+
+    def build_index(self):
+        """ """
+        self.name_index = NameIndex()
+        for worms_rec in self.worms_client.iter_cached_records():
+            self.name_index.add_record(worms_rec)
+        print("Names in local name index: ", len(self.name_index))
+
+    def match_names(self, scientific_name_list, executor=None):
+        """Returns (records_dict, errors_dict), both with the scientific names
+        as keys. Names with more than one possible match are errors
+        (Response code: 206) and have to be added by AphiaID instead."""
+        if self.name_index is None:
+            self.build_index()
+        records_dict = {}
+        errors_dict = {}
+        missing_list = []
+        for scientific_name in dict.fromkeys(scientific_name_list):
+            candidates = self.name_index.get_records(scientific_name)
+            if candidates:
+                self.local_matches += 1
+                self.select_match(scientific_name, candidates, records_dict, errors_dict)
+            else:
+                missing_list.append(scientific_name)
+        if not missing_list:
+            return (records_dict, errors_dict)
+
+        # Ask REST API.
+        chunk_size = self.worms_client.max_records_per_request
+        chunks = [
+            missing_list[index : index + chunk_size]
+            for index in range(0, len(missing_list), chunk_size)
+        ]
+        if executor:
+            results = executor.map(self.worms_client.get_records_by_match_names, chunks)
+        else:
+            results = map(self.worms_client.get_records_by_match_names, chunks)
+        for chunk, (result_list, error) in zip(chunks, results):
+            for index, scientific_name in enumerate(chunk):
+                if error:
+                    errors_dict[scientific_name] = (
+                        "Scientific name: " + scientific_name + "  " + error
+                    )
+                    continue
+                candidates = []
+                if index < len(result_list or []):
+                    candidates = result_list[index] or []
+                if not candidates:
+                    errors_dict[scientific_name] = (
+                        "Scientific name: " + scientific_name + "  Response code: 204"
+                    )
+                    continue
+                self.remote_matches += 1
+                for worms_rec in candidates:
+                    self.name_index.add_record(worms_rec)
+                # Near and phonetic matches are only used if there is no exact match.
+                exact_matches = [
+                    worms_rec
+                    for worms_rec in candidates
+                    if worms_rec.get("match_type", "") == "exact"
+                ]
+                self.select_match(
+                    scientific_name,
+                    exact_matches or candidates,
+                    records_dict,
+                    errors_dict,
+                )
+        return (records_dict, errors_dict)
+
+    def select_match(self, scientific_name, candidates, records_dict, errors_dict):
+        """ """
+        candidates_dict = {
+            str(worms_rec.get("AphiaID", "")): worms_rec for worms_rec in candidates
+        }
+        if len(candidates_dict) == 1:
+            records_dict[scientific_name] = list(candidates_dict.values())[0]
+        else:
+            errors_dict[scientific_name] = (
+                "Scientific name: "
+                + scientific_name
+                + "  Response code: 206  AphiaIDs: "
+                + ", ".join(sorted(candidates_dict))
+            )
+
+    def get_statistics(self):
+        """ """
+        return {
+            "names_matched_locally": self.local_matches,
+            "names_matched_in_worms": self.remote_matches,
+        }
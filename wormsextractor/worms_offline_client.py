@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+from wormsextractor import worms_offline_store
+
+
+class OfflineWormsClient:
+    """
+    Client with the same methods as WormsRestClient, used by TaxaListGenerator,
+    but answered from a local WoRMS snapshot (WormsOfflineStore). No HTTP calls
+    are made.
+
+    Results are returned in the same format as from the REST API, and taxa
+    not in the snapshot give the same error as "not found" in WoRMS.
+    """
+
+    # Used as chunk size when names are matched.
+    max_records_per_request = 500
+
+    def __init__(self, db_file="worms_offline.db"):
+        """
+        db_file: SQLite file created by WormsOfflineStore.import_snapshot().
+        """
+        self.store = worms_offline_store.WormsOfflineStore(db_file)
+        if not self.store.exists():
+            raise FileNotFoundError(
+                "No WoRMS snapshot imported in offline db: " + str(db_file)
+            )
+        print(
+            "Offline mode. WoRMS snapshot: ",
+            self.store.get_meta("snapshot_file"),
+            " imported: ",
+            self.store.get_meta("imported_at"),
+        )
+
+    def flush(self):
+        """Nothing to save, the snapshot is read only."""
+
+    def close_connections(self):
+        """No HTTP connections are used."""
+
+    def close(self):
+        """ """
+        self.store.close()
+
+    def get_cache_statistics(self):
+        """No cache is used in offline mode."""
+        return {}
+
+    def get_request_statistics(self):
+        """No requests are sent in offline mode."""
+        return {}
+
+    def get_record_by_aphiaid(self, aphia_id):
+        """Same as WoRMS REST: AphiaRecordByAphiaID"""
+        worms_rec = self.store.get_record(aphia_id)
+        if worms_rec is None:
+            return ({}, "AphiaID: " + str(aphia_id) + "  Response code: 204")
+        return (worms_rec, "")
+
+    def get_records_by_aphiaids(self, aphia_id_list, executor=None):
+        """Same as WoRMS REST: AphiaRecordsByAphiaIDs
+
+        Returns (records_dict, errors_dict), both with the requested AphiaIDs as keys.
+        The executor is not used, all records are read in one query.
+        """
+        records_dict = {}
+        errors_dict = {}
+        found_dict = self.store.get_records(aphia_id_list)
+        for aphia_id in dict.fromkeys(aphia_id_list):
+            worms_rec = found_dict.get(worms_offline_store.parse_aphia_id(aphia_id), None)
+            if worms_rec is None:
+                errors_dict[aphia_id] = (
+                    "AphiaID: " + str(aphia_id) + "  Response code: 204"
+                )
+            else:
+                records_dict[aphia_id] = worms_rec
+        return (records_dict, errors_dict)
+
+    def get_classification_by_aphiaid(self, aphia_id):
+        """Same as WoRMS REST: AphiaClassificationByAphiaID"""
+        classification = self.store.get_classification(aphia_id)
+        if classification is None:
+            return ({}, "AphiaID: " + str(aphia_id) + "  Response code: 204")
+        return (classification, "")
+
+    def get_records_by_match_names(self, scientific_name_list):
+        """Same as WoRMS REST: AphiaRecordsByMatchNames, but only names that are
+        the same after normalisation are matched (match_type "exact")."""
+        records_dict = self.store.get_records_by_names(scientific_name_list)
+        result_list = []
+        for scientific_name in scientific_name_list:
+            candidates = []
+            for worms_rec in records_dict.get(scientific_name, []):
+                worms_rec = dict(worms_rec)
+                worms_rec["match_type"] = "exact"
+                candidates.append(worms_rec)
+            result_list.append(candidates)
+        return (result_list, "")
+
+    def iter_cached_records(self):
+        """No local name index is needed, names are looked up in the snapshot."""
+        return iter([])
+
+    def get_cached_classification(self, aphia_id):
+        """Returns None. Classifications are built from the snapshot when
+        needed, most of them can be derived from the parent instead."""
+        return None
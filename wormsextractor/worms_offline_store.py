@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import csv
+import io
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+import xml.etree.ElementTree
+import zipfile
+
+from wormsextractor import worms_name_matcher
+
+# Columns in the table "taxon", and the Darwin Core terms they are imported from.
+darwin_core_columns = {
+    "aphia_id": "taxonID",
+    "scientific_name": "scientificName",
+    "authority": "scientificNameAuthorship",
+    "rank": "taxonRank",
+    "status": "taxonomicStatus",
+    "unaccept_reason": "nomenclaturalStatus",
+    "parent_id": "parentNameUsageID",
+    "accepted_id": "acceptedNameUsageID",
+    "kingdom": "kingdom",
+    "phylum": "phylum",
+    "class": "class",
+    "order": "order",
+    "family": "family",
+    "genus": "genus",
+    "modified": "modified",
+}
+
+# Columns with AphiaIDs. Column names are quoted in SQL since "order" and
+# "class" are keywords.
+id_columns = ("aphia_id", "parent_id", "accepted_id")
+
+url_template = "https://www.marinespecies.org/aphia.php?p=taxdetails&id="
+lsid_template = "urn:lsid:marinespecies.org:taxname:"
+
+
+class WormsOfflineStore:
+    """
+    Local SQLite store with a WoRMS snapshot, for example a Darwin Core Archive
+    (DwC-A) export or a taxon.txt file with the columns taxonID,
+    parentNameUsageID, acceptedNameUsageID, etc.
+
+    Usage:
+        store = WormsOfflineStore("worms_offline.db")
+        store.import_snapshot("WoRMS_DwC-A.zip")
+        worms_rec = store.get_record(aphia_id)
+    """
+
+    # Number of rows in each insert during import.
+    import_batch_size = 10000
+    # Max number of variables in one "IN (...)" query.
+    max_query_variables = 500
+
+    def __init__(self, db_file="worms_offline.db"):
+        """ """
+        self.db_file = db_file
+        self.db_path = pathlib.Path(self.db_file)
+        self.db_conn = None
+        # The connection is shared between worker threads.
+        self.db_lock = threading.RLock()
+
+    def connect(self):
+        """ """
+        with self.db_lock:
+            if self.db_conn is None:
+                self.db_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self.db_conn
+
+    def close(self):
+        """ """
+        with self.db_lock:
+            if self.db_conn is not None:
+                self.db_conn.close()
+                self.db_conn = None
+
+    def exists(self):
+        """True if a snapshot is imported. number_of_taxa in the meta table is
+        the last value written by a completed import."""
+        if not self.db_path.exists():
+            return False
+        with self.db_lock:
+            c = self.connect().cursor()
+            try:
+                c.execute(
+                    "SELECT count(*) FROM sqlite_master "
+                    "WHERE type='table' AND name IN ('taxon', 'meta')"
+                )
+                if c.fetchone()[0] < 2:
+                    return False
+                c.execute("SELECT count(*) FROM meta WHERE key='number_of_taxa'")
+                return c.fetchone()[0] > 0
+            finally:
+                c.close()
+
+    def import_snapshot(self, snapshot_file):
+        """Imports a DwC-A zip file or a tab separated taxon.txt file.
+        Existing data in the store is replaced.
+        The snapshot is imported to a temporary file that replaces the db file
+        when the import is done. An interrupted import leaves the old db as it
+        was."""
+        snapshot_path = pathlib.Path(snapshot_file)
+        print("Importing WoRMS snapshot: ", snapshot_path)
+        start_time = time.time()
+        # Unique for each process, for concurrent imports of the same store.
+        tmp_path = self.db_path.with_name(
+            self.db_path.name + "." + str(os.getpid()) + ".tmp"
+        )
+        with self.db_lock:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            db_conn = sqlite3.connect(tmp_path)
+            try:
+                number_of_rows = self.import_rows(db_conn, snapshot_path)
+                db_conn.commit()
+                db_conn.close()
+                # Replace the old db when the new one is complete.
+                self.close()
+                os.replace(tmp_path, self.db_path)
+            finally:
+                db_conn.close()
+                if tmp_path.exists():
+                    tmp_path.unlink()
+        print(
+            "Imported taxa: ",
+            number_of_rows,
+            " Time: ",
+            round(time.time() - start_time, 1),
+            "s",
+        )
+        return number_of_rows
+
+    def import_rows(self, db_conn, snapshot_path):
+        """Creates tables in an empty db and imports the snapshot rows.
+        Returns the number of taxa."""
+        c = db_conn.cursor()
+        # Faster bulk import. A temporary file is used, so no journal is needed.
+        c.execute("PRAGMA journal_mode=OFF")
+        c.execute("PRAGMA synchronous=OFF")
+        c.execute(
+            "CREATE TABLE taxon(aphia_id INTEGER PRIMARY KEY, "
+            + ", ".join(
+                '"' + column + '"' + (" INTEGER" if column in id_columns else " text")
+                for column in darwin_core_columns
+                if column != "aphia_id"
+            )
+            + ", name_key text)"
+        )
+        c.execute("CREATE TABLE meta(key text PRIMARY KEY, value text)")
+        number_of_rows = 0
+        batch = []
+        insert_sql = (
+            "INSERT OR REPLACE INTO taxon("
+            + ", ".join('"' + column + '"' for column in darwin_core_columns)
+            + ", name_key) VALUES ("
+            + ", ".join("?" for _column in darwin_core_columns)
+            + ", ?)"
+        )
+        for row in self.read_snapshot_rows(snapshot_path):
+            if row[0] is None:
+                continue
+            batch.append(row)
+            if len(batch) >= self.import_batch_size:
+                c.executemany(insert_sql, batch)
+                number_of_rows += len(batch)
+                batch = []
+        c.executemany(insert_sql, batch)
+        number_of_rows += len(batch)
+        # Indexes are faster to create after the import.
+        c.execute("CREATE INDEX taxon_parent_id ON taxon(parent_id)")
+        c.execute("CREATE INDEX taxon_accepted_id ON taxon(accepted_id)")
+        c.execute("CREATE INDEX taxon_scientific_name ON taxon(scientific_name)")
+        c.execute("CREATE INDEX taxon_name_key ON taxon(name_key)")
+        # number_of_taxa is written last, exists() checks it.
+        c.executemany(
+            "INSERT INTO meta(key, value) VALUES (?, ?)",
+            [
+                ("snapshot_file", str(snapshot_path.name)),
+                ("imported_at", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                ("number_of_taxa", str(number_of_rows)),
+            ],
+        )
+        c.close()
+        return number_of_rows
+
+    def read_snapshot_rows(self, snapshot_path):
+        """Yields rows with values for the columns in darwin_core_columns."""
+        if zipfile.is_zipfile(snapshot_path):
+            with zipfile.ZipFile(snapshot_path) as zip_file:
+                file_name, delimiter, quotechar, skip_lines, terms = self.read_meta(
+                    zip_file
+                )
+                with zip_file.open(file_name) as binary_file:
+                    text_file = io.TextIOWrapper(
+                        binary_file, encoding="utf-8", errors="replace"
+                    )
+                    yield from self.parse_rows(
+                        text_file, delimiter, quotechar, skip_lines, terms
+                    )
+        else:
+            with snapshot_path.open("r", encoding="utf-8", errors="replace") as text_file:
+                yield from self.parse_rows(text_file, "\t", None, 1, None)
+
+    def read_meta(self, zip_file):
+        """Finds the taxon core file in a DwC-A. Uses meta.xml if available.
+        Returns (file_name, delimiter, quotechar, skip_lines, terms). If terms
+        is None the column names are read from the header row."""
+        names = zip_file.namelist()
+        meta_name = next((name for name in names if name.endswith("meta.xml")), None)
+        if meta_name:
+            root = xml.etree.ElementTree.fromstring(zip_file.read(meta_name))
+            for element in root:
+                if element.tag.split("}")[-1] != "core":
+                    continue
+                location = ""
+                terms = {}
+                for child in element.iter():
+                    tag = child.tag.split("}")[-1]
+                    if tag == "location":
+                        location = (child.text or "").strip()
+                    elif tag == "id":
+                        terms[int(child.get("index", 0))] = "taxonID"
+                    elif (tag == "field") and (child.get("index") is not None):
+                        term = child.get("term", "").rstrip("/").split("/")[-1]
+                        terms[int(child.get("index"))] = term
+                delimiter = self.unescape(element.get("fieldsTerminatedBy", "\\t"))
+                quotechar = self.unescape(element.get("fieldsEnclosedBy", "")) or None
+                skip_lines = int(element.get("ignoreHeaderLines", "0"))
+                meta_dir = meta_name.rpartition("/")[0]
+                file_name = meta_dir + "/" + location if meta_dir else location
+                if file_name in names:
+                    return (file_name, delimiter, quotechar, skip_lines, terms)
+        # No usable meta.xml, use taxon.txt with a header row.
+        for name in names:
+            if name.lower().endswith("taxon.txt"):
+                return (name, "\t", None, 1, None)
+        raise ValueError("No taxon file found in snapshot: " + str(zip_file.filename))
+
+    def unescape(self, value):
+        """For example "\\t" in meta.xml."""
+        return value.replace("\\t", "\t").replace("\\n", "\n")
+
+    def parse_rows(self, text_file, delimiter, quotechar, skip_lines, terms):
+        """ """
+        if quotechar:
+            reader = csv.reader(text_file, delimiter=delimiter, quotechar=quotechar)
+        else:
+            reader = csv.reader(text_file, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+        csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+        header = None
+        for row_number, row in enumerate(reader):
+            if row_number < skip_lines:
+                if (row_number == 0) and (terms is None):
+                    header = [item.strip() for item in row]
+                continue
+            if terms is None:
+                row_dict = dict(zip(header, row))
+            else:
+                row_dict = {
+                    term: row[index] for index, term in terms.items() if index < len(row)
+                }
+            yield self.to_db_row(row_dict)
+
+    def to_db_row(self, row_dict):
+        """Converts a Darwin Core row to a tuple for the table "taxon"."""
+        row = []
+        for column, term in darwin_core_columns.items():
+            value = row_dict.get(term, "").strip()
+            if column in id_columns:
+                value = parse_aphia_id(value)
+            row.append(value)
+        # Used for name matching.
+        row.append(worms_name_matcher.normalise_name(row_dict.get("scientificName", "")))
+        return tuple(row)
+
+    def get_meta(self, key, default=""):
+        """ """
+        with self.db_lock:
+            c = self.connect().cursor()
+            c.execute("SELECT value FROM meta WHERE key = ?", (key,))
+            row = c.fetchone()
+        return row[0] if row else default
+
+    def get_rows(self, aphia_id_list):
+        """Returns a dict. Key: AphiaID as int. Value: Dict with the columns
+        and valid_name, valid_authority from the accepted taxon."""
+        aphia_ids = []
+        for aphia_id in aphia_id_list:
+            aphia_id = parse_aphia_id(aphia_id)
+            if aphia_id is not None:
+                aphia_ids.append(aphia_id)
+        columns = ['t."' + column + '"' for column in darwin_core_columns]
+        column_names = list(darwin_core_columns) + ["valid_name", "valid_authority"]
+        rows_dict = {}
+        with self.db_lock:
+            c = self.connect().cursor()
+            for index in range(0, len(aphia_ids), self.max_query_variables):
+                chunk = aphia_ids[index : index + self.max_query_variables]
+                c.execute(
+                    "SELECT "
+                    + ", ".join(columns)
+                    + ", v.scientific_name, v.authority"
+                    + " FROM taxon AS t"
+                    + " LEFT JOIN taxon AS v ON v.aphia_id = t.accepted_id"
+                    + " WHERE t.aphia_id IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    chunk,
+                )
+                for row in c.fetchall():
+                    rows_dict[row[0]] = dict(zip(column_names, row))
+        return rows_dict
+
+    def get_records_by_names(self, scientific_name_list):
+        """Returns a dict. Key: Scientific name. Value: List of records where
+        the normalised names are the same, see normalise_name()."""
+        name_keys = {}
+        for scientific_name in scientific_name_list:
+            name_key = worms_name_matcher.normalise_name(scientific_name)
+            name_keys.setdefault(name_key, []).append(scientific_name)
+        key_list = list(name_keys)
+        aphia_ids_by_key = {}
+        with self.db_lock:
+            c = self.connect().cursor()
+            for index in range(0, len(key_list), self.max_query_variables):
+                chunk = key_list[index : index + self.max_query_variables]
+                c.execute(
+                    "SELECT name_key, aphia_id FROM taxon WHERE name_key IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    chunk,
+                )
+                for name_key, aphia_id in c.fetchall():
+                    aphia_ids_by_key.setdefault(name_key, []).append(aphia_id)
+        records_dict = self.get_records(
+            [aphia_id for aphia_ids in aphia_ids_by_key.values() for aphia_id in aphia_ids]
+        )
+        result_dict = {}
+        for name_key, scientific_names in name_keys.items():
+            records = [
+                records_dict[aphia_id] for aphia_id in aphia_ids_by_key.get(name_key, [])
+            ]
+            for scientific_name in scientific_names:
+                result_dict[scientific_name] = records
+        return result_dict
+
+    def get_record(self, aphia_id):
+        """Returns a dict in the same format as AphiaRecordByAphiaID, or None."""
+        return self.get_records([aphia_id]).get(parse_aphia_id(aphia_id), None)
+
+    def get_records(self, aphia_id_list):
+        """Returns a dict. Key: AphiaID as int. Value: Record in the same format
+        as AphiaRecordByAphiaID."""
+        return {
+            aphia_id: self.to_worms_record(row)
+            for aphia_id, row in self.get_rows(aphia_id_list).items()
+        }
+
+    def to_worms_record(self, row):
+        """ """
+        aphia_id = row["aphia_id"]
+        if row["accepted_id"] is None:
+            if row["status"] == "accepted":
+                valid_aphia_id = aphia_id
+                valid_name = row["scientific_name"]
+                valid_authority = row["authority"]
+            else:
+                valid_aphia_id = None
+                valid_name = None
+                valid_authority = None
+        else:
+            valid_aphia_id = row["accepted_id"]
+            valid_name = row["valid_name"]
+            valid_authority = row["valid_authority"]
+        return {
+            "AphiaID": aphia_id,
+            "url": url_template + str(aphia_id),
+            "scientificname": row["scientific_name"],
+            "authority": row["authority"] or None,
+            "status": row["status"],
+            "unacceptreason": row["unaccept_reason"] or None,
+            "rank": row["rank"],
+            "valid_AphiaID": valid_aphia_id,
+            "valid_name": valid_name,
+            "valid_authority": valid_authority or None,
+            "parentNameUsageID": row["parent_id"],
+            "kingdom": row["kingdom"] or None,
+            "phylum": row["phylum"] or None,
+            "class": row["class"] or None,
+            "order": row["order"] or None,
+            "family": row["family"] or None,
+            "genus": row["genus"] or None,
+            "lsid": lsid_template + str(aphia_id),
+            "modified": row["modified"] or None,
+        }
+
+    def get_classification(self, aphia_id):
+        """Returns a nested dict in the same format as AphiaClassificationByAphiaID,
+        or None. Unaccepted taxa without parent use the parent of the accepted taxon."""
+        lineage = []
+        seen = set()
+        current_id = parse_aphia_id(aphia_id)
+        while current_id is not None:
+            if current_id in seen:
+                print("Warning: Loop in offline classification for: ", aphia_id)
+                break
+            seen.add(current_id)
+            row = self.get_rows([current_id]).get(current_id, None)
+            if row is None:
+                break
+            lineage.append(row)
+            current_id = row["parent_id"]
+            if (current_id is None) and (row["accepted_id"] is not None):
+                accepted_row = self.get_rows([row["accepted_id"]]).get(
+                    row["accepted_id"], None
+                )
+                if accepted_row is not None:
+                    current_id = accepted_row["parent_id"]
+        if not lineage:
+            return None
+        classification = None
+        for row in lineage:
+            classification = {
+                "AphiaID": row["aphia_id"],
+                "rank": row["rank"],
+                "scientificname": row["scientific_name"],
+                "child": classification,
+            }
+        return classification
+
+
+def parse_aphia_id(value):
+    """Returns an int for values like 123, "123" or
+    "urn:lsid:marinespecies.org:taxname:123". None if not valid."""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().rpartition(":")[2]
+    if value.isdigit():
+        return int(value)
+    return None
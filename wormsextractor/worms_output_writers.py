@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+import importlib.util
+import json
+import os
+import pathlib
+
+# Columns stored as integers in typed formats. Empty values are stored as null.
+integer_columns = ("aphia_id", "parent_id", "valid_aphia_id")
+# Columns with few distinct values, dictionary encoded in typed formats.
+dictionary_columns = ("rank", "status")
+
+
+class TaxaWriter:
+    """
+    Base class for writers of the taxa_worms table. The file is written to
+    a temporary file that replaces the old file when closed without errors.
+    Readers will never see a partly written file.
+
+    Usage:
+        with TsvTaxaWriter(data_out_dir, header) as taxa_writer:
+            taxa_writer.write_taxon(taxon)
+    """
+
+    file_name = ""
+
+    def __init__(self, data_out_dir, header):
+        """
+        data_out_dir: Directory for the file.
+        header: Column names, in the order used in the file.
+        """
+        self.file_path = pathlib.Path(data_out_dir, self.file_name)
+        # Unique for each process, for concurrent runs in the same directory.
+        self.tmp_path = self.file_path.with_name(
+            self.file_name + "." + str(os.getpid()) + ".tmp"
+        )
+        self.header = header
+        self.number_of_taxa = 0
+
+    def __enter__(self):
+        """ """
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """The file is only replaced if there were no errors."""
+        try:
+            self.close()
+            if exc_type is None:
+                os.replace(self.tmp_path, self.file_path)
+        finally:
+            if self.tmp_path.exists():
+                self.tmp_path.unlink()
+        return False
+
+    def open(self):
+        """Opens self.tmp_path."""
+        raise NotImplementedError()
+
+    def write_taxon(self, taxon):
+        """ """
+        raise NotImplementedError()
+
+    def close(self):
+        """ """
+        raise NotImplementedError()
+
+
+class TextTaxaWriter(TaxaWriter):
+    """Base class for text formats."""
+
+    encoding = "utf-8"
+    encoding_errors = "strict"
+
+    def open(self):
+        """ """
+        self.out_file = self.tmp_path.open(
+            "w", encoding=self.encoding, errors=self.encoding_errors
+        )
+        self.write_header()
+
+    def write_header(self):
+        """ """
+
+    def close(self):
+        """ """
+        try:
+            self.out_file.flush()
+            os.fsync(self.out_file.fileno())
+        finally:
+            self.out_file.close()
+
+
+class TsvTaxaWriter(TextTaxaWriter):
+    """taxa_worms.txt: Tab separated, cp1252. Characters not in cp1252 are
+    dropped."""
+
+    file_name = "taxa_worms.txt"
+    encoding = "cp1252"
+    encoding_errors = "ignore"
+
+    def write_header(self):
+        """ """
+        self.out_file.write("\t".join(self.header) + "\n")
+
+    def write_taxon(self, taxon):
+        """ """
+        row = taxon.to_row(self.header)
+        try:
+            self.out_file.write("\t".join(row) + "\n")
+            self.number_of_taxa += 1
+        except Exception as e:
+            try:
+                print("Exception when writing to taxa_worms.txt: ", row[0], "   ", e)
+            except:
+                pass
+
+
+class JsonLinesTaxaWriter(TextTaxaWriter):
+    """taxa_worms.jsonl: One JSON object for each taxon, UTF-8. Keys are the
+    columns in the header."""
+
+    file_name = "taxa_worms.jsonl"
+
+    def write_taxon(self, taxon):
+        """ """
+        row_dict = dict(zip(self.header, taxon.to_row(self.header)))
+        self.out_file.write(json.dumps(row_dict, ensure_ascii=False) + "\n")
+        self.number_of_taxa += 1
+
+
+class ParquetTaxaWriter(TaxaWriter):
+    """
+    taxa_worms.parquet: Typed and compressed columns, for fast loading in
+    analytics tools. AphiaID columns are integers, rank and status are
+    dictionary encoded. Taxa are written in row groups of batch_size rows,
+    so memory use does not depend on the number of taxa.
+
+    Requires pyarrow, see is_parquet_available().
+    """
+
+    file_name = "taxa_worms.parquet"
+
+    def __init__(self, data_out_dir, header, batch_size=50000, compression="zstd"):
+        """ """
+        super().__init__(data_out_dir, header)
+        self.batch_size = batch_size
+        self.compression = compression
+        self.parquet_writer = None
+        self.schema = None
+        self.columns = {}  # Key: Column name. Value: List with values.
+
+    def open(self):
+        """ """
+        import pyarrow
+        import pyarrow.parquet
+
+        fields = []
+        for column in self.header:
+            if column in integer_columns:
+                column_type = pyarrow.int64()
+            elif column in dictionary_columns:
+                column_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+            else:
+                column_type = pyarrow.string()
+            fields.append(pyarrow.field(column, column_type))
+        self.schema = pyarrow.schema(fields)
+        self.parquet_writer = pyarrow.parquet.ParquetWriter(
+            str(self.tmp_path), self.schema, compression=self.compression
+        )
+        self.columns = {column: [] for column in self.header}
+
+    def write_taxon(self, taxon):
+        """ """
+        for column in self.header:
+            value = str(taxon.get(column, ""))
+            if column in integer_columns:
+                value = int(value) if value.isdigit() else None
+            self.columns[column].append(value)
+        self.number_of_taxa += 1
+        if len(self.columns[self.header[0]]) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self):
+        """Writes buffered taxa as one row group."""
+        import pyarrow
+
+        if not self.columns[self.header[0]]:
+            return
+        arrays = [
+            pyarrow.array(self.columns[field.name], type=field.type)
+            for field in self.schema
+        ]
+        self.parquet_writer.write_table(
+            pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        )
+        self.columns = {column: [] for column in self.header}
+
+    def close(self):
+        """ """
+        if self.parquet_writer is None:
+            return
+        try:
+            self.write_batch()
+        finally:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+
+# Key: Output format. Value: Writer class.
+taxa_writer_classes = {
+    "tsv": TsvTaxaWriter,
+    "jsonl": JsonLinesTaxaWriter,
+    "parquet": ParquetTaxaWriter,
+}
+
+
+def is_parquet_available():
+    """Parquet files are only written if pyarrow is installed."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class MultiTaxaWriter:
+    """
+    Writes the same taxa to several formats in one pass. All files are
+    replaced when the writer is closed without errors.
+
+    Usage:
+        with create_taxa_writer(data_out_dir, header, ["tsv", "parquet"]) as writer:
+            writer.write_taxon(taxon)
+    """
+
+    def __init__(self, writers):
+        """writers: List of TaxaWriter."""
+        self.writers = writers
+        self.exit_stack = None
+
+    def __enter__(self):
+        """ """
+        with contextlib.ExitStack() as exit_stack:
+            for writer in self.writers:
+                exit_stack.enter_context(writer)
+            self.exit_stack = exit_stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ """
+        exit_stack = self.exit_stack
+        self.exit_stack = None
+        return exit_stack.__exit__(exc_type, exc_value, traceback)
+
+    def write_taxon(self, taxon):
+        """ """
+        for writer in self.writers:
+            writer.write_taxon(taxon)
+
+
+def create_taxa_writer(data_out_dir, header, output_formats=("tsv",)):
+    """Returns a MultiTaxaWriter for the output formats "tsv", "jsonl" and
+    "parquet". Parquet is skipped, with a message, if pyarrow is not installed."""
+    writers = []
+    for output_format in dict.fromkeys(output_formats):
+        if output_format not in taxa_writer_classes:
+            raise ValueError("Unknown output format: " + str(output_format))
+        if (output_format == "parquet") and (not is_parquet_available()):
+            print("pyarrow is not installed, taxa_worms.parquet is not written.")
+            continue
+        writer_class = taxa_writer_classes[output_format]
+        writers.append(writer_class(data_out_dir, header))
+    return MultiTaxaWriter(writers)
@@ -5,82 +5,422 @@
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
 import json
-import urllib.request
+import time
+import urllib.parse
 
+from wormsextractor import worms_flow_control
+from wormsextractor import worms_http_pool
+from wormsextractor import worms_run_metrics
 from wormsextractor import worms_sqlite_cache
 
 
+def is_valid_aphia_id(aphia_id):
+    """AphiaIDs are positive integers. Other values are not sent to WoRMS."""
+    return str(aphia_id).strip().isdigit()
+
+
 class WormsRestClient:
     """
     For usage instructions check "https://github.com/sharkdata/species".
     """
 
-    def __init__(self):
-        """ """
-        self.db_cache = worms_sqlite_cache.WormsSqliteCache()
+    # Max number of AphiaIDs accepted by AphiaRecordsByAphiaIDs.
+    max_records_per_request = 50
+
+    def __init__(
+        self,
+        requests_per_second=None,
+        base_url="https://www.marinespecies.org/rest",
+        pool_size=10,
+        connect_timeout=10,
+        read_timeout=60,
+        ttl_days=None,
+        negative_ttl_days=1,
+        max_retries=5,
+        memory_cache_size=20000,
+        db_file="worms_cache.db",
+    ):
+        """
+        requests_per_second: Global limit for calls to the WoRMS REST API.
+            The rate used is lowered automatically if WoRMS is throttling.
+        pool_size: Max number of persistent HTTP connections.
+        connect_timeout, read_timeout: Timeouts in seconds for HTTP calls.
+        ttl_days, negative_ttl_days: Max age for cached results, see WormsSqliteCache.
+        max_retries: Retries for network errors and responses like 429 and 503.
+        memory_cache_size: Max number of decoded cache entries kept in memory.
+        db_file: SQLite file used as cache.
+        """
+        self.db_cache = worms_sqlite_cache.WormsSqliteCache(
+            db_file=db_file,
+            ttl_days=ttl_days,
+            negative_ttl_days=negative_ttl_days,
+            memory_cache_size=memory_cache_size,
+        )
+        # Shared by all threads using this client.
+        self.rate_controller = worms_flow_control.AdaptiveRateController(
+            max_requests_per_second=requests_per_second, max_concurrency=pool_size
+        )
+        self.retry_policy = worms_flow_control.RetryPolicy(max_retries=max_retries)
+        self.circuit_breaker = worms_flow_control.CircuitBreaker()
+        # Concurrent requests for the same AphiaID share one call to WoRMS.
+        self.single_flight = worms_flow_control.SingleFlight()
+        self.endpoint_metrics = worms_run_metrics.EndpointMetrics()
+        self.base_path = urllib.parse.urlsplit(base_url).path.rstrip("/")
+        self.http_pool = worms_http_pool.HttpConnectionPool(
+            base_url,
+            pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        )
+
+    def close(self):
+        """Closes open HTTP connections and the db cache."""
+        self.http_pool.close()
+        self.db_cache.close()
+
+    def flush(self):
+        """Commits results added to the db cache."""
+        self.db_cache.flush()
+
+    def close_connections(self):
+        """Closes idle HTTP connections. New connections are opened if needed."""
+        self.http_pool.close()
+
+    def get_cache_statistics(self):
+        """Statistics for the db cache and its memory tier."""
+        return self.db_cache.get_statistics()
+
+    def get_request_statistics(self):
+        """Latency histograms, response codes and bytes for each endpoint."""
+        return self.endpoint_metrics.get_statistics()
+
+    def refresh_stale(self, executor=None):
+        """Fetches new versions of cache entries that are older than the TTL."""
+        stale_list = self.db_cache.get_stale_ids("worms_records")
+        print("Refreshing stale records: ", len(stale_list))
+        self.get_records_by_aphiaids(stale_list, executor=executor)
+        stale_list = self.db_cache.get_stale_ids("classification")
+        print("Refreshing stale classifications: ", len(stale_list))
+        if executor:
+            list(executor.map(self.get_classification_by_aphiaid, stale_list))
+        else:
+            for aphia_id in stale_list:
+                self.get_classification_by_aphiaid(aphia_id)
+        self.db_cache.flush()
 
     def get_record_by_aphiaid(self, aphia_id):
         """WoRMS REST: AphiaRecordByAphiaID"""
+        if not is_valid_aphia_id(aphia_id):
+            return ({}, "AphiaID: " + str(aphia_id) + "  Invalid AphiaID")
         # Check db cache.
-        if self.db_cache.contains_worms_record(aphia_id):
-            worms_record = self.db_cache.get_worms_record(aphia_id)
-            error = ""
-            return (worms_record, error)
+        cached_result = self.db_cache.get_result("worms_records", aphia_id)
+        if cached_result is not None:
+            return cached_result
+        return self.single_flight.do(
+            ("worms_records", str(aphia_id)), lambda: self.fetch_record(aphia_id)
+        )
+
+    def fetch_record(self, aphia_id):
+        """Requests one record. Only called by the thread owning the request."""
+        # The request may have been finished by another thread after the
+        # first check.
+        cached_result = self.db_cache.get_result("worms_records", aphia_id)
+        if cached_result is not None:
+            return cached_result
 
         # Ask REST API.
-        url = "https://www.marinespecies.org/rest/AphiaRecordByAphiaID/" + str(aphia_id)
-        result_dict = {}
-        error = ""
-        try:
-            req = urllib.request.Request(url)
-            with urllib.request.urlopen(req) as response:
-                if response.getcode() == 200:
-                    result_dict = json.loads(response.read().decode("utf-8"))
-                else:
-                    error = (
-                        "AphiaID: "
-                        + str(aphia_id)
-                        + "  Response code: "
-                        + str(response.getcode())
-                    )
-        except Exception as e:
-            error = "AphiaID: " + str(aphia_id) + "  Exception: " + str(e)
-
-        # Save to db cache.
-        self.db_cache.add_worms_record(aphia_id, result_dict)
+        url = self.base_path + "/AphiaRecordByAphiaID/" + str(aphia_id)
+        result_dict, error = self.get_json(url)
+        if error:
+            error = "AphiaID: " + str(aphia_id) + "  " + error
+
+        # Save to db cache. Not found and errors are also cached, but not
+        # transient errors.
+        if not worms_flow_control.is_transient_error(error):
+            self.db_cache.add_result("worms_records", aphia_id, result_dict, error)
         #
         return (result_dict, error)
 
+    def get_records_by_aphiaids(self, aphia_id_list, executor=None):
+        """WoRMS REST: AphiaRecordsByAphiaIDs
+
+        Returns (records_dict, errors_dict), both with the requested AphiaIDs as keys.
+        Only AphiaIDs missing in the db cache are requested, in chunks of max 50.
+        An executor (for example concurrent.futures.ThreadPoolExecutor) can be
+        used to request the chunks in parallel.
+        """
+        records_dict = {}
+        errors_dict = {}
+        # Check db cache.
+        cached_results = self.db_cache.get_results("worms_records", aphia_id_list)
+        missing_list = []
+        for aphia_id in dict.fromkeys(aphia_id_list):
+            if aphia_id not in cached_results:
+                missing_list.append(aphia_id)
+            elif cached_results[aphia_id][1]:
+                errors_dict[aphia_id] = cached_results[aphia_id][1]
+            else:
+                records_dict[aphia_id] = cached_results[aphia_id][0]
+        if not missing_list:
+            return (records_dict, errors_dict)
+
+        # AphiaIDs already requested by other threads are not requested again.
+        key_dict = {
+            ("worms_records", str(aphia_id)): aphia_id for aphia_id in missing_list
+        }
+        owned_keys, waiting_dict = self.single_flight.claim(key_dict)
+        owned_list = [key_dict[key] for key in owned_keys]
+        new_results_dict = {}
+        try:
+            self.fetch_records(owned_list, executor, new_results_dict)
+        finally:
+            for key in owned_keys:
+                error = "AphiaID: " + key[1] + "  Exception: Request not completed"
+                self.single_flight.complete(
+                    key, new_results_dict.get(key_dict[key], ({}, error))
+                )
+        for key, call in waiting_dict.items():
+            new_results_dict[key_dict[key]] = call.wait()
+        for aphia_id, (worms_record, error) in new_results_dict.items():
+            if error:
+                errors_dict[aphia_id] = error
+            else:
+                records_dict[aphia_id] = worms_record
+        #
+        return (records_dict, errors_dict)
+
+    def fetch_records(self, aphia_id_list, executor, new_results_dict):
+        """Requests records in chunks and saves them in the db cache.
+        Results are added to new_results_dict. Value: (record, error)."""
+        if not aphia_id_list:
+            return
+        # The requests may have been finished by other threads after the
+        # first check.
+        new_results_dict.update(
+            self.db_cache.get_results("worms_records", aphia_id_list)
+        )
+        missing_list = []
+        for aphia_id in aphia_id_list:
+            if aphia_id in new_results_dict:
+                continue
+            if not is_valid_aphia_id(aphia_id):
+                # Not sent to WoRMS, one bad AphiaID makes the whole chunk fail.
+                error = "AphiaID: " + str(aphia_id) + "  Invalid AphiaID"
+                new_results_dict[aphia_id] = ({}, error)
+                continue
+            missing_list.append(aphia_id)
+
+        # Ask REST API.
+        chunk_size = self.max_records_per_request
+        chunks = [
+            missing_list[index : index + chunk_size]
+            for index in range(0, len(missing_list), chunk_size)
+        ]
+        if executor:
+            results = executor.map(self.get_records_chunk, chunks)
+        else:
+            results = map(self.get_records_chunk, chunks)
+        cache_results_dict = {}
+        retry_list = []
+        for chunk, (result_list, error) in zip(chunks, results):
+            if (
+                error
+                and (len(chunk) > 1)
+                and (not worms_flow_control.is_transient_error(error))
+            ):
+                # The error may be caused by one of the AphiaIDs. Requested
+                # one by one to isolate it.
+                retry_list.extend(chunk)
+                continue
+            fetched_dict = {}
+            for worms_record in result_list or []:
+                if worms_record:
+                    fetched_dict[str(worms_record.get("AphiaID", ""))] = worms_record
+            for aphia_id in chunk:
+                worms_record = fetched_dict.get(str(aphia_id), None)
+                if worms_record:
+                    new_results_dict[aphia_id] = (worms_record, "")
+                    cache_results_dict[aphia_id] = (worms_record, "")
+                    continue
+                elif error:
+                    aphia_error = "AphiaID: " + str(aphia_id) + "  " + error
+                else:
+                    aphia_error = "AphiaID: " + str(aphia_id) + "  Response code: 204"
+                new_results_dict[aphia_id] = ({}, aphia_error)
+                if not worms_flow_control.is_transient_error(aphia_error):
+                    cache_results_dict[aphia_id] = ({}, aphia_error)
+
+        # Save to db cache, one transaction for all new results.
+        self.db_cache.add_results("worms_records", cache_results_dict)
+        # Results from AphiaRecordByAphiaID are saved by fetch_record().
+        if executor:
+            retry_results = executor.map(self.fetch_record, retry_list)
+        else:
+            retry_results = map(self.fetch_record, retry_list)
+        new_results_dict.update(zip(retry_list, retry_results))
+        self.db_cache.flush()
+
+    def get_records_chunk(self, aphia_id_list):
+        """Requests one chunk from AphiaRecordsByAphiaIDs."""
+        query = urllib.parse.urlencode(
+            [("aphiaids[]", str(aphia_id)) for aphia_id in aphia_id_list]
+        )
+        url = self.base_path + "/AphiaRecordsByAphiaIDs?" + query
+        result_list, error = self.get_json(url)
+        if error == "Response code: 204":
+            # None of the AphiaIDs found.
+            return ([], "")
+        return (result_list, error)
+
+    def get_records_by_date(self, start_date, end_date=None):
+        """WoRMS REST: AphiaRecordsByDate
+
+        Generator that yields (records_list, error) for each page of max 50
+        records modified between start_date and end_date (ISO 8601 strings).
+        The db cache is not used.
+        """
+        offset = 1
+        while True:
+            query_list = [
+                ("startdate", start_date),
+                ("marine_only", "false"),
+                ("offset", str(offset)),
+            ]
+            if end_date:
+                query_list.insert(1, ("enddate", end_date))
+            url = (
+                self.base_path
+                + "/AphiaRecordsByDate?"
+                + urllib.parse.urlencode(query_list)
+            )
+            result_list, error = self.get_json(url)
+            if error == "Response code: 204":
+                # No more records.
+                return
+            if error:
+                yield ([], "Modified since: " + start_date + "  " + error)
+                return
+            yield (result_list, "")
+            if len(result_list) < self.max_records_per_request:
+                return
+            offset += len(result_list)
+
     def get_classification_by_aphiaid(self, aphia_id):
         """WoRMS REST: AphiaClassificationByAphiaID"""
         # Check db cache.
-        if self.db_cache.contains_classification(aphia_id):
-            worms_record = self.db_cache.get_classification(aphia_id)
-            error = ""
-            return (worms_record, error)
+        cached_result = self.db_cache.get_result("classification", aphia_id)
+        if cached_result is not None:
+            return cached_result
+        return self.single_flight.do(
+            ("classification", str(aphia_id)),
+            lambda: self.fetch_classification(aphia_id),
+        )
+
+    def fetch_classification(self, aphia_id):
+        """Requests one classification. Only called by the thread owning the request."""
+        cached_result = self.db_cache.get_result("classification", aphia_id)
+        if cached_result is not None:
+            return cached_result
 
         # Ask REST API.
-        url = "https://www.marinespecies.org/rest/AphiaClassificationByAphiaID/" + str(
-            aphia_id
+        url = self.base_path + "/AphiaClassificationByAphiaID/" + str(aphia_id)
+        result_dict, error = self.get_json(url)
+        if error:
+            error = "AphiaID: " + str(aphia_id) + "  " + error
+
+        # Save to db cache. Not found and errors are also cached, but not
+        # transient errors.
+        if not worms_flow_control.is_transient_error(error):
+            self.db_cache.add_result("classification", aphia_id, result_dict, error)
+        #
+        return (result_dict, error)
+
+    def get_records_by_match_names(self, scientific_name_list):
+        """WoRMS REST: AphiaRecordsByMatchNames
+
+        Returns (result_list, error). result_list contains one list of
+        matching records for each name, max 50 names in each call.
+        Matched records are added to the db cache.
+        """
+        query = urllib.parse.urlencode(
+            [("scientificnames[]", name) for name in scientific_name_list]
+            + [("marine_only", "false")]
         )
-        result_dict = {}
+        url = self.base_path + "/AphiaRecordsByMatchNames?" + query
+        result_list, error = self.get_json(url)
+        if error == "Response code: 204":
+            # None of the names found.
+            return ([[] for _name in scientific_name_list], "")
+        if error:
+            return ([], error)
+        new_results_dict = {}
+        for candidates in result_list or []:
+            for worms_record in candidates or []:
+                worms_record = dict(worms_record)
+                worms_record.pop("match_type", None)
+                aphia_id = str(worms_record.get("AphiaID", ""))
+                if aphia_id:
+                    new_results_dict[aphia_id] = (worms_record, "")
+        self.db_cache.add_results("worms_records", new_results_dict)
+        self.db_cache.flush()
+        return (result_list, "")
+
+    def iter_cached_records(self):
+        """Yields all found records in the db cache. WoRMS is not called."""
+        for _aphia_id, worms_record in self.db_cache.iter_data("worms_records"):
+            yield worms_record
+
+    def get_cached_classification(self, aphia_id):
+        """Returns a classification from the db cache, or None. WoRMS is not called."""
+        cached_result = self.db_cache.get_result("classification", aphia_id)
+        if (cached_result is None) or cached_result[1]:
+            return None
+        return cached_result[0]
+
+    def get_json(self, url):
+        """Calls the REST API. Returns (result, error).
+        Network errors and responses like 429 and 503 are retried with backoff."""
         error = ""
-        try:
-            req = urllib.request.Request(url)
-            with urllib.request.urlopen(req) as response:
-                if response.getcode() == 200:
-                    result_dict = json.loads(response.read().decode("utf-8"))
+        endpoint = url[len(self.base_path) :].lstrip("/").split("?")[0].split("/")[0]
+        for attempt in range(self.retry_policy.max_retries + 1):
+            try:
+                self.circuit_breaker.before_request()
+            except worms_flow_control.CircuitOpenError as e:
+                return ({}, "Exception: " + str(e))
+            retry_after = None
+            try:
+                with self.rate_controller.request_slot():
+                    start_time = time.monotonic()
+                    status, body, headers = self.http_pool.get(url)
+            except Exception as e:
+                self.endpoint_metrics.observe(
+                    endpoint, time.monotonic() - start_time, "exception"
+                )
+                error = "Exception: " + str(e)
+                self.circuit_breaker.record_failure()
+            else:
+                self.endpoint_metrics.observe(
+                    endpoint, time.monotonic() - start_time, status, len(body)
+                )
+                if status not in worms_flow_control.transient_status_codes:
+                    self.circuit_breaker.record_success()
+                    self.rate_controller.on_success()
+                    if status != 200:
+                        return ({}, "Response code: " + str(status))
+                    try:
+                        return (json.loads(body.decode("utf-8")), "")
+                    except Exception as e:
+                        return ({}, "Exception: " + str(e))
+                error = "Response code: " + str(status)
+                retry_after = worms_flow_control.parse_retry_after(
+                    headers.get("retry-after", "")
+                )
+                if status in worms_flow_control.throttle_status_codes:
+                    self.rate_controller.on_throttle()
+                if status == 429:
+                    self.circuit_breaker.record_throttle(retry_after)
                 else:
-                    error = (
-                        "AphiaID: "
-                        + str(aphia_id)
-                        + "  Response code: "
-                        + str(response.getcode())
-                    )
-        except Exception as e:
-            error = "AphiaID: " + str(aphia_id) + "  Exception: " + str(e)
-
-        # Save to db cache.
-        self.db_cache.add_classification(aphia_id, result_dict)
-        #
-        return (result_dict, error)
+                    self.circuit_breaker.record_failure()
+            if attempt < self.retry_policy.max_retries:
+                time.sleep(self.retry_policy.get_delay(attempt, retry_after))
+        return ({}, error)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import contextlib
+import datetime
+import threading
+import time
+
+# Upper bounds, in seconds, for the latency histogram buckets.
+latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class EndpointMetrics:
+    """
+    Thread safe request metrics for each WoRMS endpoint: Latency histogram,
+    response codes and bytes received. Used by WormsRestClient.
+    """
+
+    def __init__(self):
+        """ """
+        self.endpoints = {}  # Key: Endpoint name. Value: Dict with metrics.
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, status, bytes_received=0):
+        """Adds one request. status: HTTP response code, or "exception"."""
+        with self.lock:
+            metrics = self.endpoints.get(endpoint, None)
+            if metrics is None:
+                metrics = {
+                    "requests": 0,
+                    "seconds_sum": 0.0,
+                    "seconds_max": 0.0,
+                    "bytes_received": 0,
+                    "status_codes": {},
+                    "bucket_counts": [0] * len(latency_buckets),
+                }
+                self.endpoints[endpoint] = metrics
+            metrics["requests"] += 1
+            metrics["seconds_sum"] += seconds
+            metrics["seconds_max"] = max(metrics["seconds_max"], seconds)
+            metrics["bytes_received"] += bytes_received
+            status = str(status)
+            metrics["status_codes"][status] = metrics["status_codes"].get(status, 0) + 1
+            for index, upper_bound in enumerate(latency_buckets):
+                if seconds <= upper_bound:
+                    metrics["bucket_counts"][index] += 1
+                    break
+
+    def get_statistics(self):
+        """Returns a dict. Key: Endpoint name. Histogram buckets are cumulative,
+        as in Prometheus."""
+        statistics = {}
+        with self.lock:
+            for endpoint, metrics in sorted(self.endpoints.items()):
+                buckets = {}
+                cumulative_count = 0
+                bucket_counts = metrics["bucket_counts"]
+                for upper_bound, count in zip(latency_buckets, bucket_counts):
+                    cumulative_count += count
+                    buckets[str(upper_bound)] = cumulative_count
+                buckets["+Inf"] = metrics["requests"]
+                statistics[endpoint] = {
+                    "requests": metrics["requests"],
+                    "seconds_sum": round(metrics["seconds_sum"], 6),
+                    "seconds_mean": round(
+                        metrics["seconds_sum"] / metrics["requests"], 6
+                    ),
+                    "seconds_max": round(metrics["seconds_max"], 6),
+                    "bytes_received": metrics["bytes_received"],
+                    "status_codes": dict(metrics["status_codes"]),
+                    "latency_buckets": buckets,
+                }
+        return statistics
+
+
+class RunMetrics:
+    """
+    Wall time for the stages in a run, collected into a run report together
+    with statistics from the client, cache and resolvers.
+
+    Usage:
+        with run_metrics.stage("check_taxa_in_worms"):
+            ...
+        report = run_metrics.get_report(statistics)
+    """
+
+    def __init__(self):
+        """ """
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.start_time = time.monotonic()
+        self.stage_seconds = {}  # Key: Stage name. Value: Seconds.
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the wall time for a stage. Time is added if the same stage
+        is used more than once."""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + (
+                time.monotonic() - start_time
+            )
+
+    def get_report(self, statistics=None):
+        """Returns the run report as a dict. statistics: Dict with other
+        sections, for example {"cache": ..., "endpoints": ...}."""
+        report = {
+            "started_at": self.started_at.replace(microsecond=0).isoformat(),
+            "total_seconds": round(time.monotonic() - self.start_time, 3),
+            "stage_seconds": {
+                name: round(seconds, 3) for name, seconds in self.stage_seconds.items()
+            },
+        }
+        report.update(statistics or {})
+        return report
+
+
+def to_prometheus_text(report):
+    """Returns the run report in the Prometheus text format, for example for
+    the node exporter textfile collector."""
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        """samples: List of (suffix, labels, value). labels: List of (key, value)."""
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " " + metric_type)
+        for suffix, labels, value in samples:
+            label_text = ",".join(
+                key + '="' + str(label).replace('"', '\\"') + '"'
+                for key, label in labels
+            )
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append(name + suffix + label_text + " " + str(value))
+
+    add_metric(
+        "worms_run_seconds",
+        "gauge",
+        "Wall time for the run.",
+        [("", [], report.get("total_seconds", 0))],
+    )
+    add_metric(
+        "worms_stage_seconds",
+        "gauge",
+        "Wall time for each stage.",
+        [
+            ("", [("stage", name)], seconds)
+            for name, seconds in report.get("stage_seconds", {}).items()
+        ],
+    )
+    endpoints = report.get("endpoints", {})
+    if endpoints:
+        histogram_samples = []
+        for endpoint, metrics in endpoints.items():
+            for upper_bound, count in metrics["latency_buckets"].items():
+                histogram_samples.append(
+                    ("_bucket", [("endpoint", endpoint), ("le", upper_bound)], count)
+                )
+            histogram_samples.append(
+                ("_sum", [("endpoint", endpoint)], metrics["seconds_sum"])
+            )
+            histogram_samples.append(
+                ("_count", [("endpoint", endpoint)], metrics["requests"])
+            )
+        add_metric(
+            "worms_request_seconds",
+            "histogram",
+            "Latency for WoRMS requests.",
+            histogram_samples,
+        )
+        add_metric(
+            "worms_requests_total",
+            "counter",
+            "WoRMS requests by response code.",
+            [
+                ("", [("endpoint", endpoint), ("status", status)], count)
+                for endpoint, metrics in endpoints.items()
+                for status, count in metrics["status_codes"].items()
+            ],
+        )
+        add_metric(
+            "worms_response_bytes_total",
+            "counter",
+            "Bytes received from WoRMS.",
+            [
+                ("", [("endpoint", endpoint)], metrics["bytes_received"])
+                for endpoint, metrics in endpoints.items()
+            ],
+        )
+    for name, value in report.get("cache", {}).items():
+        if name.endswith("_size"):
+            add_metric(
+                "worms_" + name,
+                "gauge",
+                "Cache " + name.replace("_", " ") + ".",
+                [("", [], value)],
+            )
+        else:
+            add_metric(
+                "worms_" + name + "_total",
+                "counter",
+                "Cache " + name.replace("_", " ") + ".",
+                [("", [], value)],
+            )
+    return "\n".join(lines) + "\n"
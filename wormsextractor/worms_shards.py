@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import concurrent.futures
+import json
+import os
+import pathlib
+import time
+import zlib
+
+from wormsextractor import worms_extract_taxa
+from wormsextractor import worms_run_metrics
+from wormsextractor import worms_sqlite_cache
+from wormsextractor import worms_taxon
+
+
+def get_shard_index(key, number_of_shards):
+    """Stable hash partitioning. The same AphiaID or name gives the same shard
+    in all processes and on all nodes, which is not true for hash()."""
+    return zlib.crc32(str(key).strip().encode("utf-8")) % number_of_shards
+
+
+def partition(keys, number_of_shards):
+    """Returns one list of keys for each shard. The order is kept in each shard."""
+    shards = [[] for _index in range(number_of_shards)]
+    for key in keys:
+        shards[get_shard_index(key, number_of_shards)].append(key)
+    return shards
+
+
+def run_shard(shard_settings):
+    """Runs TaxaListGenerator.run_all() for one shard. Called in a worker process.
+    shard_settings: Keyword arguments for TaxaListGenerator."""
+    start_time = time.time()
+    generator = worms_extract_taxa.TaxaListGenerator(**shard_settings)
+    try:
+        generator.run_all()
+    finally:
+        generator.worms_client.close()
+    return {
+        "shard": pathlib.Path(shard_settings["data_in_dir"]).parent.name,
+        "number_of_taxa": len(generator.taxa_worms_dict),
+        "number_of_errors": len(generator.errors_list),
+        "seconds": round(time.time() - start_time, 3),
+    }
+
+
+def read_rows(file_path):
+    """Returns the rows in a tab separated outdata file, without header."""
+    if not file_path.exists():
+        return []
+    with file_path.open("r", encoding="cp1252", errors="ignore") as in_file:
+        rows = [row.rstrip("\r\n").split("\t") for row in in_file]
+    return [row for row in rows[1:] if any(row)]
+
+
+class ShardedTaxaRun:
+    """
+    Sharded version of TaxaListGenerator.run_all(), for large lists.
+
+    AphiaIDs and names in the indata lists are hash partitioned into shards.
+    Each shard is a directory with its own data_in, data_out and cache:
+
+        shards/shard_<index>_of_<number_of_shards>/
+
+    Shards are run in parallel processes, or one shard on each node in a
+    cluster (run_shard()), and then merged into one cache and one set of
+    outdata files (merge()). Taxa found in more than one shard, for example
+    higher taxa, are taken from the shard where they were fetched last.
+
+    The cache, if it exists, is copied to new shards as a warm start.
+    """
+
+    def __init__(self, taxa_list_generator, number_of_shards=1, shard_root="shards"):
+        """
+        taxa_list_generator: Used for settings, indata, outdata and the cache.
+        number_of_shards: Number of parts the indata lists are split into.
+        shard_root: Directory for the shard directories.
+        """
+        self.taxa_list_generator = taxa_list_generator
+        self.number_of_shards = number_of_shards
+        self.shard_root = shard_root
+
+    def get_shard_path(self, shard_index):
+        """ """
+        return pathlib.Path(
+            self.shard_root,
+            "shard_" + str(shard_index) + "_of_" + str(self.number_of_shards),
+        )
+
+    def run(self, processes=None):
+        """Runs all shards in parallel processes and merges the results.
+        processes: Number of worker processes. None: One for each shard, up
+        to the number of CPUs."""
+        generator = self.taxa_list_generator
+        print("\nSpecies list generator started in sharded mode.")
+        generator.run_metrics = worms_run_metrics.RunMetrics()
+        stage = generator.run_metrics.stage
+        if processes is None:
+            processes = min(self.number_of_shards, os.cpu_count() or 1)
+        processes = max(1, min(processes, self.number_of_shards))
+        shard_indexes = list(range(self.number_of_shards))
+        with stage("prepare_shards"):
+            settings_list = self.prepare_shards(shard_indexes, processes)
+        with stage("run_shards"):
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes
+            ) as executor:
+                summaries = list(executor.map(run_shard, settings_list))
+        for summary in summaries:
+            print(
+                "Shard done: ",
+                summary["shard"],
+                " taxa: ",
+                summary["number_of_taxa"],
+                " time: ",
+                summary["seconds"],
+                " s",
+            )
+        with stage("merge_shards"):
+            self.merge([self.get_shard_path(index) for index in shard_indexes])
+        generator.save_run_report(
+            {
+                "number_of_shards": self.number_of_shards,
+                "shards": summaries,
+                "number_of_taxa": len(generator.taxa_worms_dict),
+                "number_of_errors": len(generator.errors_list),
+            }
+        )
+        print("\nDone... Woho YES success")
+
+    def run_shard(self, shard_index):
+        """Runs one shard in this process, for example on one node in a cluster.
+        Use merge() when all shards are done."""
+        if not (0 <= shard_index < self.number_of_shards):
+            raise ValueError(
+                "Shard index must be 0 - " + str(self.number_of_shards - 1)
+            )
+        settings_list = self.prepare_shards([shard_index], 1)
+        summary = run_shard(settings_list[0])
+        print("\nShard done: ", summary["shard"], " taxa: ", summary["number_of_taxa"])
+        return summary
+
+    def prepare_shards(self, shard_indexes, processes):
+        """Writes indata files for the shards, and copies the cache to new
+        shards. Returns a list of settings for run_shard()."""
+        generator = self.taxa_list_generator
+        generator.indata_aphia_id_list = []
+        generator.indata_name_list = []
+        generator.read_indata_files()
+        number_of_shards = self.number_of_shards
+        aphia_id_shards = partition(generator.indata_aphia_id_list, number_of_shards)
+        name_shards = partition(generator.indata_name_list, number_of_shards)
+        cache_path = pathlib.Path(generator.cache_db_file)
+        # Limits for WoRMS calls are shared by the shards running at the same time.
+        requests_per_second = generator.requests_per_second
+        if requests_per_second:
+            requests_per_second = requests_per_second / processes
+        settings_list = []
+        for shard_index in shard_indexes:
+            shard_path = self.get_shard_path(shard_index)
+            self.write_shard_indata(
+                shard_path, aphia_id_shards[shard_index], name_shards[shard_index]
+            )
+            shard_cache_path = shard_path / "worms_cache.db"
+            if (
+                (not generator.offline_db)
+                and cache_path.exists()
+                and (not shard_cache_path.exists())
+            ):
+                print("Copying cache to shard: ", shard_path)
+                generator.worms_client.db_cache.backup_to(shard_cache_path)
+            settings_list.append(
+                {
+                    "data_in_dir": str(shard_path / "data_in"),
+                    "data_out_dir": str(shard_path / "data_out"),
+                    "max_workers": max(1, generator.max_workers // processes),
+                    "requests_per_second": requests_per_second,
+                    "cache_ttl_days": generator.cache_ttl_days,
+                    "cache_negative_ttl_days": generator.cache_negative_ttl_days,
+                    "cache_memory_size": generator.cache_memory_size,
+                    "offline_db": generator.offline_db,
+                    # JSON Lines keeps all characters when shards are merged.
+                    "output_formats": ("tsv", "jsonl"),
+                    "cache_db_file": str(shard_cache_path),
+                }
+            )
+        return settings_list
+
+    def write_shard_indata(self, shard_path, aphia_id_list, name_list):
+        """ """
+        data_in_path = pathlib.Path(shard_path, "data_in")
+        with worms_extract_taxa.atomic_write(
+            data_in_path / "aphia_id_list.txt"
+        ) as out_file:
+            out_file.write("used_aphia_id\n")
+            for aphia_id in aphia_id_list:
+                out_file.write(str(aphia_id) + "\n")
+        with worms_extract_taxa.atomic_write(
+            data_in_path / "indata_taxa_by_name.txt"
+        ) as out_file:
+            out_file.write("scientific_name\n")
+            for scientific_name in name_list:
+                out_file.write(scientific_name + "\n")
+
+    def merge(self, shard_paths):
+        """Merges shard caches into the cache, and shard outdata into the
+        outdata files. Shard directories can come from other nodes."""
+        generator = self.taxa_list_generator
+        shard_paths = [pathlib.Path(shard_path) for shard_path in shard_paths]
+        for shard_path in shard_paths:
+            if not (shard_path / "data_out").exists():
+                raise FileNotFoundError("No data_out in shard: " + str(shard_path))
+        if not generator.offline_db:
+            db_cache = generator.worms_client.db_cache
+            for shard_path in shard_paths:
+                shard_cache_path = shard_path / "worms_cache.db"
+                if shard_cache_path.exists():
+                    number_of_rows = db_cache.merge_from(shard_cache_path)
+                    print(
+                        "Cache merged from: ", shard_path, " entries: ", number_of_rows
+                    )
+        # Key: aphia_id. Value: (fetched_at, Taxon).
+        taxa_dict = {}
+        errors_dict = {}
+        translate_dict = {}
+        for shard_path in shard_paths:
+            fetched_times = self.get_fetched_times(shard_path)
+            for taxon in self.read_taxa(shard_path / "data_out"):
+                fetched_at = fetched_times.get(str(taxon.aphia_id), None) or 0.0
+                old_value = taxa_dict.get(taxon.aphia_id, None)
+                if (old_value is None) or (fetched_at > old_value[0]):
+                    taxa_dict[taxon.aphia_id] = (fetched_at, taxon)
+            for row in read_rows(shard_path / "data_out" / "errors.txt"):
+                errors_dict[tuple(row)] = row
+            for row in read_rows(shard_path / "data_out" / "translate_to_worms.txt"):
+                translate_dict[tuple(row)] = row
+        generator.taxa_worms_dict = {
+            aphia_id: taxon for aphia_id, (_fetched_at, taxon) in taxa_dict.items()
+        }
+        generator.errors_list = list(errors_dict.values())
+        generator.translate_to_worms_list = list(translate_dict.values())
+        generator.save_results()
+        print(
+            "\nShards merged: ",
+            len(shard_paths),
+            " taxa: ",
+            len(generator.taxa_worms_dict),
+            " errors: ",
+            len(generator.errors_list),
+        )
+
+    def get_fetched_times(self, shard_path):
+        """Fetch times for records in a shard cache. Key: aphia_id as text."""
+        shard_cache_path = pathlib.Path(shard_path, "worms_cache.db")
+        if not shard_cache_path.exists():
+            return {}
+        shard_cache = worms_sqlite_cache.WormsSqliteCache(
+            shard_cache_path, memory_cache_size=0
+        )
+        try:
+            return shard_cache.get_fetched_times("worms_records")
+        finally:
+            shard_cache.close()
+
+    def read_taxa(self, data_out_path):
+        """Yields a Taxon for each row in taxa_worms.jsonl, or in taxa_worms.txt
+        if there is no JSON Lines file."""
+        header = self.taxa_list_generator.taxa_worms_header
+        jsonl_path = data_out_path / "taxa_worms.jsonl"
+        if jsonl_path.exists():
+            with jsonl_path.open("r", encoding="utf-8") as in_file:
+                for row in in_file:
+                    if row.strip():
+                        row_dict = json.loads(row)
+                        yield worms_taxon.Taxon(
+                            **{column: row_dict.get(column, "") for column in header}
+                        )
+            return
+        tsv_path = data_out_path / "taxa_worms.txt"
+        if not tsv_path.exists():
+            return
+        with tsv_path.open("r", encoding="cp1252", errors="ignore") as in_file:
+            file_header = None
+            for row in in_file:
+                row = row.rstrip("\r\n").split("\t")
+                if file_header is None:
+                    file_header = row
+                    continue
+                row_dict = dict(zip(file_header, row))
+                yield worms_taxon.Taxon(
+                    **{column: row_dict.get(column, "") for column in header}
+                )
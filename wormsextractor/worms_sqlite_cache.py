@@ -7,133 +7,716 @@
 import pathlib
 import sqlite3
 import json
+import threading
+import time
+import zlib
+
+from wormsextractor import worms_memory_cache
+
+# Status for each cache entry.
+STATUS_OK = "ok"
+STATUS_NOT_FOUND = "not_found"
+STATUS_ERROR = "error"
+
+# Version of the db schema, stored in "PRAGMA user_version". Version 1 files,
+# with data as JSON text and aphia_id as varchar, are migrated when opened.
+SCHEMA_VERSION = 2
+
+# Columns extracted from WoRMS records, for indexed queries over the cache.
+# Key: Column name. Value: (SQL type, key in the WoRMS record).
+record_columns = {
+    "scientific_name": ("text", "scientificname"),
+    "rank": ("text", "rank"),
+    "status": ("text", "status"),
+    "valid_aphia_id": ("INTEGER", "valid_AphiaID"),
+    "parent_id": ("INTEGER", "parentNameUsageID"),
+    "modified": ("text", "modified"),
+}
 
 
 class WormsSqliteCache:
-    """ """
+    """
+    Cache for results from WoRMS, in a SQLite file.
 
-    def __init__(self, db_file="worms_cache.db"):
-        """ """
+    Data is stored as zlib compressed JSON, with aphia_id as INTEGER primary
+    key. For worms_records, the columns in record_columns are also stored as
+    indexed columns, see find_record_ids() and find_records().
+    """
+
+    # Tables that can be used in the generic methods.
+    tables = ("worms_records", "classification")
+    # Max number of variables in one "IN (...)" query.
+    max_query_variables = 500
+
+    def __init__(
+        self,
+        db_file="worms_cache.db",
+        commit_batch_size=100,
+        ttl_days=None,
+        negative_ttl_days=1,
+        memory_cache_size=20000,
+    ):
+        """
+        commit_batch_size: Number of added rows before a commit is done.
+            Call flush() or close() to commit the remaining rows.
+        ttl_days: Max age for cached results. None: Never expires.
+        negative_ttl_days: Max age for cached "not found" and error results.
+            None: Never expires. 0: Not found and errors are not cached.
+        memory_cache_size: Max number of decoded entries kept in memory.
+            0: Always read from the db.
+        """
         self.db_file = db_file
         self.db_path = pathlib.Path(self.db_file)
         self.db_conn = None
+        self.commit_batch_size = commit_batch_size
+        self.ttl_days = ttl_days
+        self.negative_ttl_days = negative_ttl_days
+        self.uncommitted_rows = 0
+        # The connection is shared between worker threads.
+        self.db_lock = threading.RLock()
+        # Memory tier. Key: (table, aphia_id as text).
+        # Value: (data, cache_status, fetched_at).
+        self.memory_cache = worms_memory_cache.LruCache(memory_cache_size)
+        # Statistics.
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
 
     def createDb(self):
         """ """
         if not self.db_path.exists():
-            self.db_conn = sqlite3.connect(self.db_path)
+            self.db_conn = sqlite3.connect(self.db_path, check_same_thread=False)
             c = self.db_conn.cursor()
-            c.execute(
-                "CREATE TABLE worms_records(aphia_id varchar(20) PRIMARY KEY, data json)"
-            )
-            c.execute(
-                "CREATE TABLE classification(aphia_id varchar(20) PRIMARY KEY, data json)"
-            )
+            try:
+                for table in self.tables:
+                    self.create_table(c, table)
+                c.execute("CREATE TABLE meta(key text PRIMARY KEY, value text)")
+                c.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+                self.db_conn.commit()
+            finally:
+                c.close()
+
+    def create_table(self, c, table):
+        """Creates a cache table, with indexes, in the current schema version."""
+        columns = ["aphia_id INTEGER PRIMARY KEY", "data blob"]
+        columns += ["cache_status text", "fetched_at real"]
+        if table == "worms_records":
+            for column, (sql_type, _key) in record_columns.items():
+                columns.append(column + " " + sql_type)
+        c.execute("CREATE TABLE " + table + "(" + ", ".join(columns) + ")")
+        if table == "worms_records":
+            for column in record_columns:
+                c.execute(
+                    "CREATE INDEX "
+                    + table
+                    + "_"
+                    + column
+                    + " ON "
+                    + table
+                    + "("
+                    + column
+                    + ")"
+                )
+
+    def upgradeDb(self):
+        """Upgrades cache files created by older versions. Version 1 tables
+        are copied to the current schema, and the file is vacuumed."""
+        c = self.db_conn.cursor()
+        try:
+            c.execute("PRAGMA user_version")
+            version = c.fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            if version > SCHEMA_VERSION:
+                raise ValueError(
+                    "Cache file "
+                    + str(self.db_path)
+                    + " has schema version "
+                    + str(version)
+                    + ", newer than this code ("
+                    + str(SCHEMA_VERSION)
+                    + ")."
+                )
+            for table in self.tables:
+                c.execute("PRAGMA table_info(" + table + ")")
+                columns = [row[1] for row in c.fetchall()]
+                if columns and ("cache_status" not in columns):
+                    print("Upgrading cache table: ", table)
+                    c.execute(
+                        "ALTER TABLE "
+                        + table
+                        + " ADD COLUMN cache_status text default '"
+                        + STATUS_OK
+                        + "'"
+                    )
+                    # Fetch time is unknown for old rows, NULL is used.
+                    c.execute("ALTER TABLE " + table + " ADD COLUMN fetched_at real")
+            c.execute("CREATE TABLE IF NOT EXISTS meta(key text PRIMARY KEY, value text)")
+            self.db_conn.commit()
+            # All tables are migrated in one transaction.
+            c.execute("BEGIN")
+            for table in self.tables:
+                self.migrate_table(c, table)
+            c.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
             self.db_conn.commit()
+            c.execute("VACUUM")
+        except Exception:
+            self.db_conn.rollback()
+            raise
+        finally:
+            c.close()
+
+    def migrate_table(self, c, table):
+        """Copies a version 1 table to the current schema. Rows with keys that
+        are not AphiaIDs are dropped, they are fetched again if used."""
+        c.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type='table' AND name=?", (table,)
+        )
+        if c.fetchone()[0] == 0:
+            self.create_table(c, table)
+            return
+        print("Migrating cache table to schema version ", SCHEMA_VERSION, ": ", table)
+        old_table = table + "_v1"
+        c.execute("ALTER TABLE " + table + " RENAME TO " + old_table)
+        self.create_table(c, table)
+        read_cursor = self.db_conn.cursor()
+        try:
+            read_cursor.execute(
+                "select aphia_id, data, cache_status, fetched_at from " + old_table
+            )
+            number_of_rows = 0
+            while True:
+                old_rows = read_cursor.fetchmany(10000)
+                if not old_rows:
+                    break
+                rows = []
+                for aphia_id, data, cache_status, fetched_at in old_rows:
+                    if not str(aphia_id).strip().isdigit():
+                        continue
+                    try:
+                        data_json = json.loads(data) if data else {}
+                    except ValueError:
+                        continue
+                    rows.append(
+                        self.to_db_row(
+                            table, aphia_id, data_json, cache_status, fetched_at
+                        )
+                    )
+                c.executemany(self.get_insert_sql(table), rows)
+                number_of_rows += len(rows)
+        finally:
+            read_cursor.close()
+        c.execute("DROP TABLE " + old_table)
+        print("Rows migrated: ", number_of_rows)
+
+    def get_columns(self, table):
+        """Column names in the current schema version."""
+        columns = ["aphia_id", "data", "cache_status", "fetched_at"]
+        if table == "worms_records":
+            columns += list(record_columns)
+        return columns
+
+    def get_insert_sql(self, table):
+        """ """
+        columns = self.get_columns(table)
+        return (
+            "insert or replace into "
+            + table
+            + "("
+            + ", ".join(columns)
+            + ") values ("
+            + ", ".join(["?"] * len(columns))
+            + ")"
+        )
+
+    def to_db_row(self, table, aphia_id, data_json, cache_status, fetched_at):
+        """Returns a row for get_insert_sql(). Data is stored compressed."""
+        row = [
+            int(str(aphia_id).strip()),
+            zlib.compress(json.dumps(data_json).encode("utf-8")),
+            cache_status,
+            fetched_at,
+        ]
+        if table == "worms_records":
+            is_found = cache_status in (None, STATUS_OK)
+            for _column, (sql_type, key) in record_columns.items():
+                value = data_json.get(key, None) if is_found else None
+                if sql_type == "INTEGER":
+                    value = int(value) if str(value).isdigit() else None
+                row.append(value)
+        return row
+
+    def decode_data(self, data):
+        """ """
+        return json.loads(zlib.decompress(data).decode("utf-8"))
 
     def connect(self):
         """ """
+        if self.db_conn is not None:
+            return
         self.createDb()
         if self.db_conn == None:
-            self.db_conn = sqlite3.connect(self.db_path)
+            self.db_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.upgradeDb()
+        # WAL: Readers in other processes are not blocked by the writer.
+        self.db_conn.execute("PRAGMA journal_mode=WAL")
+        self.db_conn.execute("PRAGMA synchronous=NORMAL")
+
+    def flush(self):
+        """Commits added rows."""
+        with self.db_lock:
+            if self.db_conn is not None and self.uncommitted_rows > 0:
+                self.db_conn.commit()
+            self.uncommitted_rows = 0
+
+    def close(self):
+        """ """
+        with self.db_lock:
+            if self.db_conn is not None:
+                self.flush()
+                self.db_conn.close()
+                self.db_conn = None
+
+    def check_table(self, table):
+        """ """
+        if table not in self.tables:
+            raise ValueError("Not a cache table: " + str(table))
+
+    def is_fresh(self, cache_status, fetched_at):
+        """Checks the age of a cache entry against the TTL for its status."""
+        if cache_status in (None, STATUS_OK):
+            ttl_days = self.ttl_days
+        else:
+            ttl_days = self.negative_ttl_days
+        if ttl_days is None:
+            return True
+        if fetched_at is None:
+            return False
+        return (time.time() - fetched_at) < (ttl_days * 86400)
+
+    def get_or_none(self, table, aphia_id):
+        """Returns the cached data, or None if not cached or not fresh.
+        One query per call."""
+        entry = self.get_entries(table, [aphia_id]).get(aphia_id, None)
+        if entry is None:
+            return None
+        data, cache_status, _fetched_at = entry
+        if cache_status not in (None, STATUS_OK):
+            return None
+        return data
+
+    def get_many(self, table, aphia_id_list):
+        """Returns a dict with fresh cached data. Key: aphia_id as in aphia_id_list."""
+        result_dict = {}
+        for aphia_id, entry in self.get_entries(table, aphia_id_list).items():
+            data, cache_status, _fetched_at = entry
+            if cache_status in (None, STATUS_OK):
+                result_dict[aphia_id] = data
+        return result_dict
+
+    def get_entries(self, table, aphia_id_list):
+        """Returns a dict with fresh entries, both found and negative.
+        Key: aphia_id as in aphia_id_list. Value: (data, cache_status, fetched_at).
+        Entries in the memory tier are used before the db."""
+        self.check_table(table)
+        # Keys are stored as text.
+        key_dict = {str(aphia_id): aphia_id for aphia_id in aphia_id_list}
+        key_list = []
+        result_dict = {}
+        for key, aphia_id in key_dict.items():
+            entry = self.memory_cache.get((table, key))
+            if (entry is not None) and self.is_fresh(entry[1], entry[2]):
+                result_dict[aphia_id] = entry
+            else:
+                key_list.append(key)
+        if key_list:
+            self.get_db_entries(table, key_list, key_dict, result_dict)
+        with self.db_lock:
+            self.cache_hits += len(result_dict)
+            self.cache_misses += len(key_dict) - len(result_dict)
+        return result_dict
+
+    def get_db_entries(self, table, key_list, key_dict, result_dict):
+        """Reads entries not in the memory tier. Results are added to result_dict."""
+        # The db only contains AphiaIDs. Key: aphia_id as int. Value: Text key.
+        db_keys = {int(key): key for key in key_list if key.isdigit()}
+        db_key_list = list(db_keys)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                for index in range(0, len(db_key_list), self.max_query_variables):
+                    keys = db_key_list[index : index + self.max_query_variables]
+                    c.execute(
+                        "select aphia_id, data, cache_status, fetched_at from "
+                        + table
+                        + " where aphia_id in ("
+                        + ",".join(["?"] * len(keys))
+                        + ")",
+                        keys,
+                    )
+                    for aphia_id, data, cache_status, fetched_at in c.fetchall():
+                        self.bytes_read += len(data)
+                        if self.is_fresh(cache_status, fetched_at):
+                            key = db_keys[aphia_id]
+                            entry = (self.decode_data(data), cache_status, fetched_at)
+                            self.memory_cache.put((table, key), entry)
+                            result_dict[key_dict[key]] = entry
+            finally:
+                c.close()
+
+    def put_many(self, table, rows, cache_status=STATUS_OK):
+        """Adds or replaces rows. rows: Iterable of (aphia_id, data_json).
+        Keys that are not AphiaIDs are only kept in the memory tier."""
+        self.check_table(table)
+        fetched_at = time.time()
+        rows = list(rows)
+        if not rows:
+            return
+        for aphia_id, data_json in rows:
+            self.memory_cache.put(
+                (table, str(aphia_id)), (data_json, cache_status, fetched_at)
+            )
+        rows = [
+            self.to_db_row(table, aphia_id, data_json, cache_status, fetched_at)
+            for aphia_id, data_json in rows
+            if str(aphia_id).strip().isdigit()
+        ]
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.executemany(self.get_insert_sql(table), rows)
+                self.bytes_written += sum(len(row[1]) for row in rows)
+                self.uncommitted_rows += len(rows)
+                if self.uncommitted_rows >= self.commit_batch_size:
+                    self.flush()
+            finally:
+                c.close()
+
+    def get_result(self, table, aphia_id):
+        """Returns (data, error) from a fresh cache entry, or None if not cached.
+        For negative entries data is an empty dict and error the cached error."""
+        return self.get_results(table, [aphia_id]).get(aphia_id, None)
+
+    def get_results(self, table, aphia_id_list):
+        """As get_result, for multiple AphiaIDs. Missing entries are not included."""
+        result_dict = {}
+        for aphia_id, entry in self.get_entries(table, aphia_id_list).items():
+            data, cache_status, _fetched_at = entry
+            if cache_status in (None, STATUS_OK):
+                result_dict[aphia_id] = (data, "")
+            else:
+                result_dict[aphia_id] = ({}, data.get("error", cache_status))
+        return result_dict
+
+    def add_result(self, table, aphia_id, data_json, error=""):
+        """Adds a result from WoRMS. Errors and empty results are cached as negative
+        entries."""
+        self.add_results(table, {aphia_id: (data_json, error)})
+
+    def add_results(self, table, results_dict):
+        """As add_result, for multiple results. Value: (data_json, error)."""
+        rows_dict = {STATUS_OK: [], STATUS_NOT_FOUND: [], STATUS_ERROR: []}
+        for aphia_id, (data_json, error) in results_dict.items():
+            if data_json and not error:
+                if table == "classification":
+                    data_json["aphiaId"] = aphia_id
+                rows_dict[STATUS_OK].append((aphia_id, data_json))
+            elif self.negative_ttl_days == 0:
+                continue
+            elif (not error) or error.endswith("Response code: 204"):
+                rows_dict[STATUS_NOT_FOUND].append((aphia_id, {"error": error}))
+            else:
+                rows_dict[STATUS_ERROR].append((aphia_id, {"error": error}))
+        with self.db_lock:
+            for cache_status, rows in rows_dict.items():
+                self.put_many(table, rows, cache_status=cache_status)
+
+    def get_statistics(self):
+        """Hits and misses for cache lookups, and bytes read from and written to
+        the db file. Statistics for the memory tier are included."""
+        with self.db_lock:
+            statistics = {
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "cache_bytes_read": self.bytes_read,
+                "cache_bytes_written": self.bytes_written,
+            }
+        statistics.update(self.memory_cache.get_statistics())
+        return statistics
+
+    def get_stale_ids(self, table):
+        """Returns AphiaIDs for entries that are too old, for selective refresh."""
+        self.check_table(table)
+        stale_list = []
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute("select aphia_id, cache_status, fetched_at from " + table)
+                for aphia_id, cache_status, fetched_at in c.fetchall():
+                    if not self.is_fresh(cache_status, fetched_at):
+                        stale_list.append(str(aphia_id))
+            finally:
+                c.close()
+        return stale_list
+
+    def invalidate(self, table, aphia_id_list):
+        """Removes entries. They will be fetched again when used."""
+        self.check_table(table)
+        for aphia_id in aphia_id_list:
+            self.memory_cache.remove((table, str(aphia_id)))
+        keys = [
+            (int(str(aphia_id).strip()),)
+            for aphia_id in aphia_id_list
+            if str(aphia_id).strip().isdigit()
+        ]
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.executemany("delete from " + table + " where aphia_id = ?", keys)
+                self.db_conn.commit()
+                self.uncommitted_rows = 0
+            finally:
+                c.close()
+
+    def get_ids(self, table):
+        """Returns all AphiaIDs in a table, as text."""
+        self.check_table(table)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute("select aphia_id from " + table)
+                return [str(row[0]) for row in c.fetchall()]
+            finally:
+                c.close()
+
+    def iter_data(self, table):
+        """Yields (aphia_id, data) for all found entries in a table.
+        The memory tier is not used, to avoid filling it with all entries."""
+        self.check_table(table)
+        with self.db_lock:
+            self.connect()
+            c = self.db_conn.cursor()
+            try:
+                c.execute(
+                    "select aphia_id, data from "
+                    + table
+                    + " where cache_status is null or cache_status = ?",
+                    (STATUS_OK,),
+                )
+                rows = c.fetchall()
+            finally:
+                c.close()
+        for aphia_id, data in rows:
+            yield (str(aphia_id), self.decode_data(data))
+
+    def get_record_conditions(self, conditions):
+        """Returns (where_sql, values) for find_record_ids() and find_records()."""
+        where_list = ["(cache_status is null or cache_status = ?)"]
+        values = [STATUS_OK]
+        for key, value in conditions.items():
+            if key == "modified_since":
+                where_list.append("modified >= ?")
+            elif key in record_columns:
+                where_list.append(key + " = ?")
+                if record_columns[key][0] == "INTEGER":
+                    value = int(value)
+            else:
+                raise ValueError("Not a record column: " + str(key))
+            values.append(value)
+        return (" and ".join(where_list), values)
+
+    def find_record_ids(self, **conditions):
+        """Returns AphiaIDs, as text, for found records matching all conditions.
+        Keys: The columns in record_columns, and modified_since (ISO date).
+        Only indexed columns are read, for example:
+            find_record_ids(parent_id=104108)
+            find_record_ids(status="unaccepted")"""
+        where_sql, values = self.get_record_conditions(conditions)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute(
+                    "select aphia_id from worms_records where " + where_sql, values
+                )
+                return [str(row[0]) for row in c.fetchall()]
+            finally:
+                c.close()
+
+    def find_records(self, **conditions):
+        """As find_record_ids(). Returns a dict with records. Key: aphia_id as text.
+        The memory tier is not used."""
+        where_sql, values = self.get_record_conditions(conditions)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute(
+                    "select aphia_id, data from worms_records where " + where_sql,
+                    values,
+                )
+                rows = c.fetchall()
+            finally:
+                c.close()
+        return {str(aphia_id): self.decode_data(data) for aphia_id, data in rows}
+
+    def count_records(self, **conditions):
+        """As find_record_ids(). Returns the number of records."""
+        where_sql, values = self.get_record_conditions(conditions)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute(
+                    "select count(*) from worms_records where " + where_sql, values
+                )
+                return c.fetchone()[0]
+            finally:
+                c.close()
+
+    def get_fetched_times(self, table):
+        """Returns a dict with the fetch time for all entries in a table.
+        Key: aphia_id as text. Value: Time from time.time(), or None."""
+        self.check_table(table)
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute("select aphia_id, fetched_at from " + table)
+                return {str(aphia_id): fetched_at for aphia_id, fetched_at in c}
+            finally:
+                c.close()
+
+    def merge_from(self, db_file):
+        """Adds entries from another cache file, for example a shard. For
+        AphiaIDs in both files the entry fetched last is kept. Returns the
+        number of entries added or replaced."""
+        # Migrates the other file if it has an older schema version.
+        other_cache = WormsSqliteCache(db_file, memory_cache_size=0)
+        other_cache.connect()
+        other_cache.close()
+        number_of_rows = 0
+        with self.db_lock:
+            self.connect()
+            self.flush()
+            self.memory_cache.clear()
+            c = self.db_conn.cursor()
+            c.execute("ATTACH DATABASE ? AS other", (str(db_file),))
+            try:
+                for table in self.tables:
+                    columns = ", ".join(self.get_columns(table))
+                    c.execute(
+                        "insert or replace into main."
+                        + table
+                        + "("
+                        + columns
+                        + ") select "
+                        + columns
+                        + " from other."
+                        + table
+                        + " as o where not exists (select 1 from main."
+                        + table
+                        + " as m where m.aphia_id = o.aphia_id"
+                        + " and ifnull(m.fetched_at, 0) >= ifnull(o.fetched_at, 0))"
+                    )
+                    number_of_rows += c.rowcount
+                self.db_conn.commit()
+            except Exception:
+                self.db_conn.rollback()
+                raise
+            finally:
+                c.execute("DETACH DATABASE other")
+                c.close()
+        return number_of_rows
+
+    def backup_to(self, db_file):
+        """Copies the cache to a new file, for example as a warm start for a
+        shard. The cache can be used while copied."""
+        with self.db_lock:
+            self.connect()
+            self.flush()
+            target_conn = sqlite3.connect(str(db_file))
+            try:
+                self.db_conn.backup(target_conn)
+            finally:
+                target_conn.close()
+
+    def get_meta(self, key, default=None):
+        """Returns a value stored in the meta table, for example last sync time."""
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute("select value from meta where key = ?", (key,))
+                result = c.fetchone()
+                return result[0] if result else default
+            finally:
+                c.close()
+
+    def set_meta(self, key, value):
+        """ """
+        with self.db_lock:
+            self.connect()
+            try:
+                c = self.db_conn.cursor()
+                c.execute(
+                    "insert or replace into meta(key, value) values (?, ?)",
+                    (key, str(value)),
+                )
+                self.db_conn.commit()
+                self.uncommitted_rows = 0
+            finally:
+                c.close()
 
     def add_worms_record(self, aphia_id, data_json):
         """ """
         if len(data_json) == 0:
             print("Error: Empty record to cache, record: ", aphia_id)
             return
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            c.execute(
-                "insert into worms_records values (?, ?)",
-                (
-                    aphia_id,
-                    json.dumps(
-                        data_json,
-                    ),
-                ),
-            )
-            self.db_conn.commit()
-        finally:
-            c.close()
+        self.put_many("worms_records", [(aphia_id, data_json)])
+
+    def add_worms_records(self, records_dict):
+        """Adds multiple records, key: aphia_id, in one transaction."""
+        self.put_many(
+            "worms_records",
+            [
+                (aphia_id, data_json)
+                for aphia_id, data_json in records_dict.items()
+                if len(data_json) > 0
+            ],
+        )
+        self.flush()
 
     def get_worms_record(self, aphia_id):
         """ """
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            c.execute("select data from worms_records where aphia_id = ?", (aphia_id,))
-            result_dict = c.fetchone()
-            # print(result_dict)
-            result_dict = json.loads(result_dict[0])
-            return result_dict
-        finally:
-            c.close()
+        return self.get_or_none("worms_records", aphia_id)
+
+    def get_worms_records(self, aphia_id_list):
+        """ """
+        return self.get_many("worms_records", aphia_id_list)
 
     def contains_worms_record(self, aphia_id):
         """ """
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            c.execute(
-                "select 1 from worms_records where aphia_id = ? limit 1", (aphia_id,)
-            )
-            result = c.fetchone()
-            if result and (len(result) > 0):
-                return True
-            else:
-                return False
-        finally:
-            c.close()
+        return self.get_or_none("worms_records", aphia_id) is not None
 
     def add_classification(self, aphia_id, data_json):
         """ """
         if len(data_json) == 0:
             print("Error: Empty record to cache, classification: ", aphia_id)
             return
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            data_json["aphiaId"] = aphia_id
-            c.execute(
-                "insert into classification values (?, ?)",
-                (
-                    aphia_id,
-                    json.dumps(
-                        data_json,
-                    ),
-                ),
-            )
-            self.db_conn.commit()
-        finally:
-            c.close()
+        data_json["aphiaId"] = aphia_id
+        self.put_many("classification", [(aphia_id, data_json)])
 
     def get_classification(self, aphia_id):
         """ """
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            c.execute("select data from classification where aphia_id = ?", (aphia_id,))
-            result_dict = c.fetchone()
-            # print(result_dict)
-            result_dict = json.loads(result_dict[0])
-            return result_dict
-        finally:
-            c.close()
+        return self.get_or_none("classification", aphia_id)
 
     def contains_classification(self, aphia_id):
         """ """
-        self.connect()
-        try:
-            c = self.db_conn.cursor()
-            c.execute(
-                "select 1 from classification where aphia_id = ? limit 1", (aphia_id,)
-            )
-            result = c.fetchone()
-            if result and (len(result) > 0):
-                return True
-            else:
-                return False
-        finally:
-            c.close()
+        return self.get_or_none("classification", aphia_id) is not None
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import itertools
+import pathlib
+
+from wormsextractor import worms_classification_resolver
+from wormsextractor import worms_extract_taxa
+from wormsextractor import worms_name_matcher
+from wormsextractor import worms_synonym_resolver
+from wormsextractor import worms_taxon
+from wormsextractor import worms_taxonomy_tree
+
+
+class TaxaStreamPipeline:
+    """
+    Streaming version of TaxaListGenerator.run_all().
+
+    The pipeline is built from generator stages:
+    read AphiaIDs -> fetch records -> resolve ancestors -> emit rows.
+    Each stage only asks the previous one for more taxa when it needs them,
+    and only one chunk of taxa is fetched at a time. Memory used depends on the
+    number of distinct higher taxa, not on the number of taxa in the list.
+
+    Rows for taxa in the indata list are written in the same order as in the
+    indata file, followed by rows for the higher taxa.
+    """
+
+    def __init__(self, taxa_list_generator, chunk_size=500):
+        """
+        taxa_list_generator: Used for directories, headers and the WoRMS client.
+        chunk_size: Number of taxa fetched from WoRMS in each step.
+        """
+        self.taxa_list_generator = taxa_list_generator
+        self.worms_client = taxa_list_generator.worms_client
+        self.chunk_size = chunk_size
+        # Higher taxa from the classifications. Key: aphia_id.
+        self.higher_taxa_dict = {}
+        self.classification_resolver = (
+            worms_classification_resolver.ClassificationResolver(
+                self.worms_client, self.higher_taxa_dict
+            )
+        )
+        self.taxonomy_tree = worms_taxonomy_tree.TaxonomyTree()
+        # Unaccepted taxa. Memory used depends on the number of unaccepted taxa.
+        self.synonym_resolver = worms_synonym_resolver.SynonymResolver(
+            self.worms_client
+        )
+        self.input_aphia_ids = set()
+        self.errors_file = None
+
+    def run(self):
+        """ """
+        print("\nSpecies list generator started in streaming mode.")
+        generator = self.taxa_list_generator
+        data_out_dir = generator.data_out_dir
+        try:
+            with worms_extract_taxa.atomic_write(
+                pathlib.Path(data_out_dir, "errors.txt")
+            ) as errors_file:
+                self.errors_file = errors_file
+                errors_file.write("\t".join(["scientific_name", "aphia_id", "error"]) + "\n")
+                with generator.create_taxa_writer() as taxa_writer:
+                    aphia_ids = itertools.chain(self.read_aphia_ids(), self.read_names())
+                    taxa = self.fetch_taxa(aphia_ids)
+                    rows = self.resolve_ancestors(taxa)
+                    self.emit_rows(rows, taxa_writer)
+                    self.emit_rows(self.valid_taxa_rows(), taxa_writer)
+                    # Higher taxa are known when all indata taxa are processed.
+                    self.emit_rows(self.higher_taxa_rows(), taxa_writer)
+                self.save_translate_to_worms()
+            statistics = self.classification_resolver.get_statistics()
+            print(
+                "\nClassification calls made: ",
+                statistics["classification_calls_made"],
+                " avoided: ",
+                statistics["classification_calls_avoided"],
+            )
+        finally:
+            self.errors_file = None
+            generator.shutdown_executor()
+            self.worms_client.close_connections()
+            self.worms_client.flush()
+        generator.print_cache_statistics()
+        print("\nDone... Woho YES success")
+
+    def read_aphia_ids(self):
+        """Stage 1: Yields AphiaIDs from data_in/aphia_id_list.txt."""
+        indata_aphia_id = pathlib.Path(
+            self.taxa_list_generator.data_in_dir, "aphia_id_list.txt"
+        )
+        if not indata_aphia_id.exists():
+            return
+        print("Importing file: ", indata_aphia_id)
+        with indata_aphia_id.open("r", encoding="cp1252", errors="ignore") as indata_file:
+            header = None
+            for row in indata_file:
+                row = [item.strip() for item in row.strip().split("\t")]
+                if header is None:
+                    header = row
+                    continue
+                aphia_id = dict(zip(header, row)).get("used_aphia_id", "")
+                # Avoid duplicates.
+                if aphia_id and (aphia_id not in self.input_aphia_ids):
+                    self.input_aphia_ids.add(aphia_id)
+                    yield aphia_id
+
+    def read_names(self):
+        """Stage 1: Yields AphiaIDs for names in data_in/indata_taxa_by_name.txt.
+        Names are matched in chunks, see NameMatcher."""
+        indata_name = pathlib.Path(
+            self.taxa_list_generator.data_in_dir, "indata_taxa_by_name.txt"
+        )
+        if not indata_name.exists():
+            return
+        print("Importing file: ", indata_name)
+        name_matcher = worms_name_matcher.NameMatcher(self.worms_client)
+        executor = self.taxa_list_generator.get_executor()
+        with indata_name.open("r", encoding="cp1252", errors="ignore") as indata_file:
+            header = None
+            names = set()
+            chunk = []
+            for row in itertools.chain(indata_file, [None]):
+                if row is not None:
+                    row = [item.strip() for item in row.strip().split("\t")]
+                    if header is None:
+                        header = row
+                        continue
+                    scientific_name = dict(zip(header, row)).get("scientific_name", "")
+                    if scientific_name and (scientific_name not in names):
+                        names.add(scientific_name)
+                        chunk.append(scientific_name)
+                    if len(chunk) < self.chunk_size:
+                        continue
+                records_dict, errors_dict = name_matcher.match_names(
+                    chunk, executor=executor
+                )
+                for scientific_name in chunk:
+                    if scientific_name in errors_dict:
+                        self.write_error([scientific_name, "", errors_dict[scientific_name]])
+                        continue
+                    aphia_id = str(records_dict[scientific_name].get("AphiaID", ""))
+                    # Avoid duplicates.
+                    if aphia_id not in self.input_aphia_ids:
+                        self.input_aphia_ids.add(aphia_id)
+                        yield aphia_id
+                chunk = []
+
+    def fetch_taxa(self, aphia_ids):
+        """Stage 2: Yields (worms_rec, classification_dict) for each AphiaID.
+        Records are fetched in batches and classifications for new lineages
+        in parallel."""
+        executor = self.taxa_list_generator.get_executor()
+        aphia_ids = iter(aphia_ids)
+        while True:
+            chunk = list(itertools.islice(aphia_ids, self.chunk_size))
+            if not chunk:
+                return
+            records_dict, errors_dict = self.worms_client.get_records_by_aphiaids(
+                chunk, executor=executor
+            )
+            found_records = [
+                records_dict[aphia_id] for aphia_id in chunk if aphia_id in records_dict
+            ]
+            classification_dict = self.classification_resolver.prefetch(
+                found_records, executor=executor
+            )
+            for aphia_id in chunk:
+                if aphia_id not in records_dict:
+                    error = errors_dict.get(aphia_id, "AphiaID: " + str(aphia_id))
+                    self.write_error(["", aphia_id, error])
+                    continue
+                yield (records_dict[aphia_id], classification_dict)
+
+    def resolve_ancestors(self, taxa):
+        """Stage 3: Adds classification nodes to the taxonomy tree and yields
+        a Taxon for each record."""
+        for worms_rec, classification_dict in taxa:
+            error = self.classification_resolver.add_to_higher_taxa(
+                worms_rec, classification_dict
+            )
+            taxon = worms_taxon.normalise_worms_record(worms_rec)
+            if error:
+                self.write_error(["", taxon.aphia_id, error])
+            self.add_to_tree(taxon.aphia_id)
+            self.add_parent_info(taxon)
+            self.synonym_resolver.add_taxon(taxon)
+            print("Processing: ", taxon.scientific_name)
+            yield taxon
+
+    def valid_taxa_rows(self):
+        """Yields rows for valid taxa used by unaccepted taxa, if not already
+        in the indata list."""
+        executor = self.taxa_list_generator.get_executor()
+        aphia_id_list = []
+        for aphia_id in self.synonym_resolver.resolve(executor=executor):
+            if aphia_id not in self.input_aphia_ids:
+                self.input_aphia_ids.add(aphia_id)
+                aphia_id_list.append(aphia_id)
+        print("\nValid taxa added for unaccepted taxa: ", len(aphia_id_list))
+        yield from self.resolve_ancestors(self.fetch_taxa(aphia_id_list))
+
+    def save_translate_to_worms(self):
+        """Writes translate_to_worms.txt. Called when all taxa are processed."""
+        rows, errors = self.synonym_resolver.get_translate_rows()
+        for row in errors:
+            self.write_error(row)
+        header = self.synonym_resolver.translate_to_worms_header
+        with worms_extract_taxa.atomic_write(
+            pathlib.Path(self.taxa_list_generator.data_out_dir, "translate_to_worms.txt")
+        ) as translate_file:
+            translate_file.write("\t".join(header) + "\n")
+            for row in rows:
+                translate_file.write("\t".join(row) + "\n")
+
+    def add_to_tree(self, aphia_id):
+        """Adds a taxon and its ancestors from higher_taxa_dict to the taxonomy tree."""
+        current_id = aphia_id
+        while (current_id in self.higher_taxa_dict) and (
+            current_id not in self.taxonomy_tree
+        ):
+            higher_taxon = self.higher_taxa_dict[current_id]
+            self.taxonomy_tree.add_node(
+                current_id,
+                higher_taxon.rank,
+                higher_taxon.scientific_name,
+                higher_taxon.parent_id,
+            )
+            current_id = higher_taxon.parent_id
+
+    def higher_taxa_rows(self):
+        """Yields rows for higher taxa not in the indata list."""
+        input_ids = {str(aphia_id) for aphia_id in self.input_aphia_ids}
+        higher_ids = [
+            aphia_id
+            for aphia_id in self.taxonomy_tree.nodes
+            if str(aphia_id) not in input_ids
+        ]
+        executor = self.taxa_list_generator.get_executor()
+        for chunk_start in range(0, len(higher_ids), self.chunk_size):
+            chunk = higher_ids[chunk_start : chunk_start + self.chunk_size]
+            records_dict, errors_dict = self.worms_client.get_records_by_aphiaids(
+                chunk, executor=executor
+            )
+            for aphia_id in chunk:
+                if aphia_id in errors_dict:
+                    self.write_error(["", aphia_id, errors_dict[aphia_id]])
+                scientific_name = self.taxonomy_tree.nodes[aphia_id].scientific_name
+                print("- Processing higher taxa: ", scientific_name, " (", aphia_id, ")")
+                taxon = worms_taxon.normalise_worms_record(records_dict.get(aphia_id, {}))
+                taxon.aphia_id = aphia_id
+                self.add_parent_info(taxon)
+                yield taxon
+
+    def emit_rows(self, taxa, taxa_writer):
+        """Stage 4: Writes rows to taxa_worms.txt and the other output formats."""
+        for taxon in taxa:
+            taxa_writer.write_taxon(taxon)
+
+    def add_parent_info(self, taxon):
+        """Adds parent, classification and rank columns from the taxonomy tree."""
+        tree = self.taxonomy_tree
+        aphia_id = taxon.aphia_id
+        if aphia_id not in tree:
+            taxon.classification = "[" + taxon.rank + "] " + taxon.scientific_name
+            return
+        taxon.parent_id = tree.nodes[aphia_id].parent_id
+        taxon.parent_name = tree.get_parent_name(aphia_id)
+        taxon.classification = tree.get_classification(aphia_id)
+        for column, name in tree.get_rank_columns(aphia_id).items():
+            if name:
+                taxon[column] = name
+
+    def write_error(self, row):
+        """ """
+        try:
+            self.errors_file.write("\t".join([str(item) for item in row]) + "\n")
+        except Exception as e:
+            print("Exception when writing to errors.txt: ", row[1], "   ", e)
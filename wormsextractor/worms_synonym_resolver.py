@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+from wormsextractor import worms_taxon
+
+
+class SynonymResolver:
+    """
+    Translates unaccepted taxa to valid taxa.
+
+    Unaccepted taxa are collected with add_taxon(). resolve() then fetches
+    the valid taxa, in batches and through the cache. If a valid taxon is
+    unaccepted too, the chain is followed to its end. Each AphiaID is only
+    fetched once, which also protects against loops.
+
+    Usage:
+        resolver = SynonymResolver(worms_client)
+        for taxon in taxa:
+            resolver.add_taxon(taxon)
+        valid_aphia_ids = resolver.resolve(executor)
+        translate_rows, errors = resolver.get_translate_rows()
+    """
+
+    translate_to_worms_header = [
+        "scientific_name_from",
+        "scientific_name_to",
+        "aphia_id_from",
+        "aphia_id_to",
+        "status_from",
+        "status_to",
+    ]
+
+    def __init__(self, worms_client):
+        """ """
+        self.worms_client = worms_client
+        self.unaccepted_ids = []
+        self.taxa = {}  # Key: AphiaID as text. Value: Taxon.
+        self.fetched_ids = set()
+
+    def add_taxon(self, taxon):
+        """Unaccepted taxa are saved, other taxa are ignored."""
+        if self.is_unaccepted(taxon):
+            aphia_id = str(taxon.aphia_id)
+            if aphia_id not in self.taxa:
+                self.unaccepted_ids.append(aphia_id)
+            self.taxa[aphia_id] = taxon
+
+    def is_unaccepted(self, taxon):
+        """True if the taxon has another valid taxon."""
+        if taxon.status == "accepted":
+            return False
+        return str(taxon.valid_aphia_id) not in ("", str(taxon.aphia_id))
+
+    def resolve(self, executor=None):
+        """Fetches all valid taxa needed, in rounds until the end of each chain
+        is reached. Returns a list of the valid AphiaIDs, as text."""
+        valid_ids = []
+        while True:
+            missing_list = []
+            for taxon in list(self.taxa.values()):
+                valid_id = str(taxon.valid_aphia_id)
+                if (
+                    self.is_unaccepted(taxon)
+                    and (valid_id not in self.taxa)
+                    and (valid_id not in self.fetched_ids)
+                ):
+                    self.fetched_ids.add(valid_id)
+                    missing_list.append(valid_id)
+            if not missing_list:
+                break
+            records_dict, _errors_dict = self.worms_client.get_records_by_aphiaids(
+                missing_list, executor=executor
+            )
+            for aphia_id, worms_rec in records_dict.items():
+                self.taxa[aphia_id] = worms_taxon.normalise_worms_record(worms_rec)
+        for aphia_id in self.unaccepted_ids:
+            target = self.get_valid_taxon(aphia_id)[0]
+            if (target is not None) and (str(target.aphia_id) not in valid_ids):
+                valid_ids.append(str(target.aphia_id))
+        return valid_ids
+
+    def get_valid_taxon(self, aphia_id):
+        """Follows the chain of valid taxa. Returns (taxon, error).
+        taxon is None if the end of the chain is missing or is a loop."""
+        taxon = self.taxa[str(aphia_id)]
+        chain = [str(aphia_id)]
+        while self.is_unaccepted(taxon):
+            valid_id = str(taxon.valid_aphia_id)
+            if valid_id in chain:
+                return (None, "Loop in valid taxa: " + " -> ".join(chain + [valid_id]))
+            if valid_id not in self.taxa:
+                return (None, "Valid taxa not found: " + valid_id)
+            chain.append(valid_id)
+            taxon = self.taxa[valid_id]
+        return (taxon, "")
+
+    def get_translate_rows(self):
+        """Returns (rows, errors). One row for each unaccepted taxon, sorted by
+        scientific name. Errors are rows for errors.txt."""
+        rows = []
+        errors = []
+        for aphia_id in self.unaccepted_ids:
+            taxon = self.taxa[aphia_id]
+            target, error = self.get_valid_taxon(aphia_id)
+            if target is None:
+                errors.append([taxon.scientific_name, aphia_id, error])
+                continue
+            rows.append(
+                [
+                    taxon.scientific_name,
+                    target.scientific_name,
+                    aphia_id,
+                    str(target.aphia_id),
+                    taxon.status,
+                    target.status,
+                ]
+            )
+        rows.sort()
+        return (rows, errors)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import pathlib
+
+from wormsextractor import worms_taxon
+
+
+class TaxaIndex:
+    """
+    In-memory indexes of Taxon records, used to join other lists to WoRMS.
+
+    Taxa can be found by AphiaID and by scientific name.
+    A name can have more than one taxon, for example for homonyms.
+
+    Usage:
+        taxa_index = TaxaIndex()
+        taxa_index.load_cache(db_cache)
+        taxon = taxa_index.get_by_name("Acartia tonsa")
+    """
+
+    def __init__(self):
+        """ """
+        self.by_aphia_id = {}  # Key: AphiaID as text. Value: Taxon.
+        self.by_name = {}  # Key: Scientific name. Value: List of Taxon.
+
+    def __len__(self):
+        """ """
+        return len(self.by_aphia_id)
+
+    def add_taxon(self, taxon):
+        """ """
+        aphia_id = str(taxon.aphia_id)
+        if (not aphia_id) or (aphia_id in self.by_aphia_id):
+            return
+        self.by_aphia_id[aphia_id] = taxon
+        if taxon.scientific_name:
+            self.by_name.setdefault(taxon.scientific_name, []).append(taxon)
+
+    def add_taxa(self, taxa):
+        """taxa: Iterable with Taxon records, for example
+        TaxaListGenerator.taxa_worms_dict.values()."""
+        for taxon in taxa:
+            self.add_taxon(taxon)
+
+    def load_cache(self, db_cache):
+        """Adds all records in a WormsSqliteCache."""
+        for _aphia_id, worms_rec in db_cache.iter_data("worms_records"):
+            self.add_taxon(worms_taxon.normalise_worms_record(worms_rec))
+
+    def load_taxa_worms_file(self, file_path):
+        """Adds taxa from a taxa_worms.txt file created by TaxaListGenerator."""
+        file_path = pathlib.Path(file_path)
+        with file_path.open("r", encoding="cp1252", errors="ignore") as indata_file:
+            header = None
+            for row in indata_file:
+                row = [item.strip() for item in row.strip().split("\t")]
+                if header is None:
+                    header = row
+                else:
+                    self.add_taxon(worms_taxon.Taxon(**dict(zip(header, row))))
+
+    def get_by_aphia_id(self, aphia_id):
+        """Returns a Taxon or None."""
+        return self.by_aphia_id.get(str(aphia_id), None)
+
+    def get_all_by_name(self, scientific_name):
+        """Returns a list of Taxon."""
+        return self.by_name.get(scientific_name, [])
+
+    def get_by_name(self, scientific_name):
+        """Returns a Taxon, or None if not found or if there is more than one
+        taxon with the name. Accepted taxa are used before other taxa."""
+        taxa = self.get_all_by_name(scientific_name)
+        if len(taxa) > 1:
+            taxa = [taxon for taxon in taxa if taxon.status == "accepted"]
+        if len(taxa) == 1:
+            return taxa[0]
+        return None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+
+class Taxon:
+    """
+    Compact taxon record with the columns used in taxa_worms.txt.
+
+    Values can be accessed as attributes or, with the column names used in
+    the output header, with get() and [].
+    Note: The column "class" is stored in the attribute "class_".
+    """
+
+    __slots__ = (
+        "scientific_name",
+        "authority",
+        "rank",
+        "aphia_id",
+        "url",
+        "parent_name",
+        "parent_id",
+        "status",
+        "valid_aphia_id",
+        "valid_name",
+        "valid_authority",
+        "kingdom",
+        "phylum",
+        "class_",
+        "order",
+        "family",
+        "genus",
+        "classification",
+        "lsid",
+    )
+
+    def __init__(self, **kwargs):
+        """Keyword arguments are column names. None is replaced by ""."""
+        for attribute in self.__slots__:
+            setattr(self, attribute, "")
+        for column, value in kwargs.items():
+            self[column] = value
+
+    def __setitem__(self, column, value):
+        """ """
+        if value in ["None", None]:
+            value = ""
+        setattr(self, attribute_name(column), value)
+
+    def __getitem__(self, column):
+        """ """
+        return getattr(self, attribute_name(column))
+
+    def get(self, column, default=""):
+        """Same as dict.get(), for columns in the output header."""
+        return getattr(self, attribute_name(column), default)
+
+    def to_dict(self):
+        """ """
+        return {
+            column_name(attribute): getattr(self, attribute)
+            for attribute in self.__slots__
+        }
+
+    @classmethod
+    def from_dict(cls, taxon_dict):
+        """ """
+        return cls(**taxon_dict)
+
+    def to_row(self, header):
+        """Returns a list of strings for the columns in header."""
+        return [str(self.get(column, "")) for column in header]
+
+    def __repr__(self):
+        """ """
+        return "Taxon(" + str(self.aphia_id) + ", " + self.scientific_name + ")"
+
+
+def attribute_name(column):
+    """ """
+    return "class_" if column == "class" else column
+
+
+def column_name(attribute):
+    """ """
+    return "class" if attribute == "class_" else attribute
+
+
+# Translate keys from WoRMS. Other used keys have the same name as the column.
+worms_record_keys = {
+    "AphiaID": "aphia_id",
+    "valid_AphiaID": "valid_aphia_id",
+    "scientificname": "scientific_name",
+    "lsid": "lsid",  # MH adderar LSID
+}
+
+
+def normalise_worms_record(worms_rec):
+    """Creates a Taxon from a WoRMS record (AphiaRecordByAphiaID).
+    Only columns in the output are kept. The WoRMS record is not changed."""
+    taxon = Taxon()
+    for key, value in worms_rec.items():
+        column = worms_record_keys.get(key, key)
+        if (column in Taxon.__slots__) or (column == "class"):
+            taxon[column] = value
+    # Calculated later from the classification.
+    taxon.parent_id = ""
+    taxon.parent_name = ""
+    taxon.classification = ""
+    return taxon
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2021-present SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+
+class TaxonNode:
+    """One taxon in the TaxonomyTree."""
+
+    __slots__ = (
+        "aphia_id",
+        "rank",
+        "scientific_name",
+        "parent_id",
+        "classification",
+        "rank_names",
+    )
+
+    def __init__(self, aphia_id, rank, scientific_name, parent_id):
+        """ """
+        self.aphia_id = aphia_id
+        self.rank = rank
+        self.scientific_name = scientific_name
+        self.parent_id = parent_id
+        # Calculated when needed.
+        self.classification = None
+        self.rank_names = None
+
+
+class TaxonomyTree:
+    """
+    In-memory taxonomy tree, built from parent links.
+
+    Classification strings and rank columns (kingdom, phylum, etc.) are
+    calculated once for each node and reused by all descendants.
+
+    Example:
+        tree = TaxonomyTree()
+        tree.add_node(aphia_id, rank, scientific_name, parent_id)
+        classification = tree.get_classification(aphia_id)
+    """
+
+    # Output columns calculated from the classification.
+    rank_columns = ["kingdom", "phylum", "class", "order", "family", "genus"]
+
+    def __init__(self):
+        """ """
+        self.nodes = {}  # Key: aphia_id.
+        self.children = {}  # Key: parent_id. Value: List of aphia_id.
+        self.rank_index = {rank: index for index, rank in enumerate(self.rank_columns)}
+
+    def add_node(self, aphia_id, rank, scientific_name, parent_id):
+        """Adds a node. Existing nodes are not changed."""
+        if aphia_id in self.nodes:
+            return self.nodes[aphia_id]
+        node = TaxonNode(aphia_id, rank, scientific_name, parent_id)
+        self.nodes[aphia_id] = node
+        if parent_id not in ("", None):
+            self.children.setdefault(parent_id, []).append(aphia_id)
+        return node
+
+    def __contains__(self, aphia_id):
+        """ """
+        return aphia_id in self.nodes
+
+    def __len__(self):
+        """ """
+        return len(self.nodes)
+
+    def build(self):
+        """Calculates classification and rank columns for all nodes.
+        Linear in the number of nodes since calculated values are reused."""
+        for aphia_id in self.nodes:
+            self.calculate(aphia_id)
+
+    def calculate(self, aphia_id):
+        """Calculates values for a node and the ancestors not already calculated."""
+        node = self.nodes.get(aphia_id, None)
+        if node is None:
+            return None
+        if node.classification is not None:
+            return node
+        if not node.scientific_name:
+            node.classification = ""
+            node.rank_names = ("",) * len(self.rank_columns)
+            return node
+        # Walk up to the first node with calculated values.
+        path = []
+        in_path = set()
+        current = node
+        while (current is not None) and (current.classification is None):
+            if current.aphia_id in in_path:
+                print("Warning: Loop in classification for: ", current.scientific_name)
+                break
+            path.append(current)
+            in_path.add(current.aphia_id)
+            current = self.get_parent(current)
+        if (current is not None) and (current.classification is not None):
+            classification = current.classification
+            rank_names = current.rank_names
+        else:
+            classification = ""
+            rank_names = ("",) * len(self.rank_columns)
+        # Calculate downwards, root first.
+        for current in reversed(path):
+            part = "[" + current.rank + "] " + current.scientific_name
+            if classification:
+                classification = classification + " - " + part
+            else:
+                classification = part
+            rank = self.normalise_rank(current.rank)
+            if rank in self.rank_index:
+                rank_names = list(rank_names)
+                rank_names[self.rank_index[rank]] = current.scientific_name
+                rank_names = tuple(rank_names)
+            current.classification = classification
+            current.rank_names = rank_names
+        return node
+
+    def get_parent(self, node):
+        """Returns the parent node, or None. Nodes without name are not used."""
+        parent = self.nodes.get(node.parent_id, None)
+        if (parent is None) or (not parent.scientific_name):
+            return None
+        return parent
+
+    def normalise_rank(self, rank):
+        """For example "Phylum (Division)" -> "phylum"."""
+        return rank.split(" (")[0].strip().lower()
+
+    def get_classification(self, aphia_id):
+        """Classification string, for example "[Kingdom] Animalia - [Phylum] Mollusca"."""
+        node = self.calculate(aphia_id)
+        return node.classification if node else ""
+
+    def get_rank_columns(self, aphia_id):
+        """Returns a dict with the rank columns, for example {"kingdom": "Animalia", ...}."""
+        node = self.calculate(aphia_id)
+        if node is None:
+            return {}
+        return dict(zip(self.rank_columns, node.rank_names))
+
+    def get_parent_name(self, aphia_id):
+        """ """
+        node = self.nodes.get(aphia_id, None)
+        if node is None:
+            return ""
+        parent = self.nodes.get(node.parent_id, None)
+        return parent.scientific_name if parent else ""
+
+    def ancestors(self, aphia_id):
+        """Returns a list of AphiaIDs from the parent up to the root."""
+        result = []
+        seen = {aphia_id}
+        node = self.nodes.get(aphia_id, None)
+        while node is not None:
+            parent = self.nodes.get(node.parent_id, None)
+            if (parent is None) or (parent.aphia_id in seen):
+                break
+            result.append(parent.aphia_id)
+            seen.add(parent.aphia_id)
+            node = parent
+        return result
+
+    def descendants(self, aphia_id):
+        """Returns a list of AphiaIDs for all descendants, breadth first."""
+        result = []
+        seen = {aphia_id}
+        queue = list(self.children.get(aphia_id, []))
+        index = 0
+        while index < len(queue):
+            child_id = queue[index]
+            index += 1
+            if child_id in seen:
+                continue
+            seen.add(child_id)
+            result.append(child_id)
+            queue.extend(self.children.get(child_id, []))
+        return result
+
+    def lowest_common_ancestor(self, aphia_id_1, aphia_id_2):
+        """Returns the AphiaID of the lowest common ancestor, or None.
+        A taxon is counted as an ancestor of itself."""
+        if (aphia_id_1 not in self.nodes) or (aphia_id_2 not in self.nodes):
+            return None
+        lineage_1 = set([aphia_id_1] + self.ancestors(aphia_id_1))
+        for aphia_id in [aphia_id_2] + self.ancestors(aphia_id_2):
+            if aphia_id in lineage_1:
+                return aphia_id
+        return None